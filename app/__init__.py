@@ -6,12 +6,14 @@ from flask import Flask, redirect, url_for
 from flask_admin import Admin, AdminIndexView, expose
 # Scheduler removed - not needed for static content vault
 # from flask_apscheduler import APScheduler
-from flask_blogging_patron import BloggingEngine, SQLAStorage
+from flask_blogging_patron import BloggingEngine, SQLAStorage, \
+    apply_sqlite_profile
 from flask_bootstrap import Bootstrap
 from flask_login import LoginManager, current_user
 from flask_migrate import Migrate
 from flask_principal import Permission, RoleNeed
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy.pool import QueuePool
 import os
 import shelve
 
@@ -23,9 +25,25 @@ Codex beauty standards!
 
 VERSION = '0.7.37'
 
+class PooledSQLAlchemy(SQLAlchemy):
+    """
+    Flask-SQLAlchemy only pools file based SQLite connections through
+    the dialect's NullPool, which rejects SQLALCHEMY_POOL_SIZE. Use a
+    QueuePool when a pool size is configured; pooled connections may be
+    checked out by another thread than the one that opened them.
+    """
+    def apply_driver_hacks(self, app, info, options):
+        super(PooledSQLAlchemy, self).apply_driver_hacks(app, info, options)
+        if info.drivername == 'sqlite' and options.get('pool_size') and \
+                'poolclass' not in options:
+            options['poolclass'] = QueuePool
+            options.setdefault('connect_args', {})['check_same_thread'] = \
+                False
+
+
 # register extensions
 bootstrap = Bootstrap()
-db = SQLAlchemy()
+db = PooledSQLAlchemy()
 migrate = Migrate()
 global sql_storage
 blog_engine = BloggingEngine()
@@ -73,8 +91,14 @@ def create_app(config_class=Config):
     bootstrap.init_app(app)
     db.init_app(app)
     with app.app_context():
+        if app.config.get('SQLITE_PROFILE'):
+            # WAL, busy_timeout etc.; the blog storage shares this engine
+            apply_sqlite_profile(db.engine)
         global sql_storage
-        sql_storage = SQLAStorage(db=db)
+        sql_storage = SQLAStorage(
+            db=db, lazy=app.config.get('BLOGGING_LAZY_STORAGE', False),
+            read_bind=app.config.get('BLOGGING_READ_BIND'),
+            sqlite_profile=app.config.get('SQLITE_PROFILE', False))
     migrate.init_app(app, db)
     login.init_app(app)
     admin.init_app(app)
@@ -101,6 +125,13 @@ def create_app(config_class=Config):
     )
     app.register_blueprint(main_bp)
 
+    from app.freeze import freeze_command
+    app.cli.add_command(freeze_command)
+    from app.assets import init_assets
+    init_assets(app)
+    from app.site_version import init_site_version
+    init_site_version(app)
+
     import logging
     from logging import StreamHandler
     stream_handler = StreamHandler()
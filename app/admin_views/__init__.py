@@ -1,7 +1,9 @@
 from app import admin, db
 # Removed unused forms for Square, Email, Isso, etc.
 from app.admin_views.forms import ThemeForm
+from app.freeze import refreeze
 from app.models import User, PriceLevel, ThirdPartyServices
+from app.site_version import bump_site_version
 from app.utils import pairing, hup_gunicorn
 from app.admin_utils.utils import isso_config
 from flask_admin import BaseView, expose
@@ -73,6 +75,7 @@ class GAView(LibrePatronBaseView):
             db.session.commit()
             current_app.config['BLOGGING_GOOGLE_ANALYTICS'] = \
                 ga.code
+            bump_site_version()
             flash('Google Analytics data saved.')
             Thread(hup_gunicorn()).start()
             return redirect(url_for('admin.index'))
@@ -106,8 +109,10 @@ class ThemeView(LibrePatronBaseView):
             current_app.jinja_env.cache = {}
             current_app.jinja_env.globals['THEME_FILE'] = 'themes/' + \
                 form.theme.data + '.min.css'
+            bump_site_version()
             flash('Theme saved. Switch from the admin panel back to \
                     your site to see the changes. You may need to reload.')
+            refreeze()
             Thread(hup_gunicorn()).start()
             return redirect(url_for('theme.theme'))
         return self.render(
@@ -141,6 +146,7 @@ class IssoView(LibrePatronBaseView):
             db.session.commit()
             isso_config()
             current_app.config['COMMENTS'] = True
+            bump_site_version()
             flash('User comments active.')
             Thread(hup_gunicorn()).start()
             return redirect(url_for('admin.index'))
@@ -245,6 +251,12 @@ class PriceView(LibrePatronModelView):
     '''
     list_template = 'admin/custom_list.html'
 
+    def after_model_change(self, form, model, is_created):
+        refreeze()
+
+    def after_model_delete(self, model):
+        refreeze()
+
 
 # Import our new persona admin views
 try:
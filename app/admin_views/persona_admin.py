@@ -2,9 +2,23 @@ from flask_admin.contrib.sqla import ModelView
 from flask_admin import BaseView, expose
 from flask_login import current_user
 from flask import redirect, url_for, request, flash, current_app
+from app.freeze import refreeze
+from app.site_version import bump_site_version
 import json
 import os
 
+
+def _apply_persona_config(config):
+    # the public pages read these from app.config; refresh them, then
+    # the ETags and the frozen copies
+    current_app.config['PERSONA'] = config['persona']
+    current_app.config['THEME_CONFIG'] = config['theme']
+    current_app.config['CONTENT_CONFIG'] = config['content']
+    current_app.config['SEO_CONFIG'] = config['seo']
+    bump_site_version()
+    refreeze()
+
+
 class PersonaConfigView(BaseView):
     @expose('/')
     def index(self):
@@ -47,6 +61,7 @@ class PersonaConfigView(BaseView):
             # Save updated config
             with open(config_path, 'w') as f:
                 json.dump(config, f, indent=2)
+            _apply_persona_config(config)
             
             flash('Persona configuration updated successfully!', 'success')
         except Exception as e:
@@ -96,6 +111,7 @@ class VideoContentView(BaseView):
             
             with open(config_path, 'w') as f:
                 json.dump(config, f, indent=2)
+            _apply_persona_config(config)
             
             flash('Premium video titles updated successfully!', 'success')
         except Exception as e:
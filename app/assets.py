@@ -0,0 +1,134 @@
+from app.site_version import bump_site_version
+from flask import current_app, url_for
+from flask.cli import with_appcontext
+import click
+import gzip
+import hashlib
+import json
+import os
+import re
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+'''
+Content-hashed copies of the static assets, with .gz and .br siblings
+for nginx's gzip_static/brotli_static. `flask assets` writes them and
+static/assets.json, which maps every asset to its hashed name; the
+static_url() template helper reads it once per worker.
+'''
+
+MANIFEST = 'assets.json'
+ASSET_EXTENSIONS = ('.css', '.js', '.svg')
+# uploads and media change outside of a build
+EXCLUDED_FOLDERS = ('images', 'videos', 'upload')
+_HASHED = re.compile(r'\.[0-9a-f]{10}\.\w+$')
+
+
+def _write(path, data):
+    temporary = path + '.tmp'
+    with open(temporary, 'wb') as f:
+        f.write(data)
+    os.replace(temporary, path)
+
+
+def _write_changed(path, data):
+    # leaves files that already hold data alone, mtime included
+    try:
+        with open(path, 'rb') as f:
+            if f.read() == data:
+                return
+    except OSError:
+        pass
+    _write(path, data)
+
+
+def _compress(path, data, hashed=False):
+    # the siblings of a hashed copy can only hold its content; those of
+    # an original are stale once it changed in place, so they are
+    # compared. mtime=0 keeps the .gz identical between builds
+    siblings = [('.gz', lambda: gzip.compress(data, 9, mtime=0))]
+    if brotli is not None:
+        siblings.append(('.br', lambda: brotli.compress(data)))
+    for extension, compress in siblings:
+        if hashed and os.path.exists(path + extension):
+            continue
+        _write_changed(path + extension, compress())
+
+
+def _assets(static_folder):
+    for root, folders, files in os.walk(static_folder):
+        if root == static_folder:
+            folders[:] = [f for f in folders if f not in EXCLUDED_FOLDERS]
+        for name in sorted(files):
+            if name.endswith(ASSET_EXTENSIONS) and not _HASHED.search(name):
+                path = os.path.join(root, name)
+                yield os.path.relpath(path, static_folder) \
+                    .replace(os.sep, '/'), path
+
+
+def build_assets(static_folder):
+    '''
+    Writes a content-hashed copy (and its compressed siblings) of every
+    asset next to the original, so relative URLs inside stylesheets
+    still resolve, then the manifest. Copies from earlier builds are
+    kept for pages still referencing them. Returns the manifest.
+    '''
+    files = {}
+    for filename, path in _assets(static_folder):
+        with open(path, 'rb') as f:
+            data = f.read()
+        digest = hashlib.sha256(data).hexdigest()[:10]
+        base, extension = os.path.splitext(filename)
+        hashed = '%s.%s%s' % (base, digest, extension)
+        hashed_path = os.path.join(static_folder, hashed)
+        if not os.path.exists(hashed_path):
+            _write(hashed_path, data)
+        _compress(hashed_path, data, hashed=True)
+        _compress(path, data)
+        files[filename] = hashed
+    manifest = {'files': files}
+    _write(os.path.join(static_folder, MANIFEST),
+           json.dumps(manifest, indent=2, sort_keys=True).encode())
+    return manifest
+
+
+def load_manifest(app):
+    # once per worker; `flask assets` runs before the workers start
+    manifest = app.extensions.get('assets')
+    if manifest is None:
+        try:
+            with open(os.path.join(app.static_folder, MANIFEST)) as f:
+                manifest = json.load(f)['files']
+        except (OSError, ValueError, KeyError):
+            manifest = {}
+        app.extensions['assets'] = manifest
+    return manifest
+
+
+def static_url(filename, **kwargs):
+    '''
+    url_for('static') for the hashed copy of filename, if the build
+    wrote one; the original otherwise.
+    '''
+    manifest = load_manifest(current_app)
+    return url_for('static', filename=manifest.get(filename, filename),
+                   **kwargs)
+
+
+@click.command('assets')
+@with_appcontext
+def assets_command():
+    '''Write the hashed and compressed static assets and their manifest.'''
+    manifest = build_assets(current_app.static_folder)
+    # the pages now link the new copies, so their ETags change too
+    bump_site_version()
+    click.echo('Fingerprinted %d assets%s.' % (
+        len(manifest['files']),
+        '' if brotli is not None else ' (no brotli module, .gz only)'))
+
+
+def init_assets(app):
+    app.jinja_env.globals['static_url'] = static_url
+    app.cli.add_command(assets_command)
@@ -3,7 +3,6 @@ from datetime import datetime
 from flask import render_template, current_app, url_for
 from flask_ezmail.message import Message
 import logging
-from markdown import Markdown
 from threading import Thread
 from urllib.parse import urlencode
 
@@ -157,8 +156,11 @@ def email_post(post):
     '''
     mail = Email.query.first()
     try:
-        markdown = Markdown()
-        post['rendered_text'] = markdown.convert(post['text'])
+        # same renderer, extensions and per thread Markdown as the blog
+        post_processor = current_app.extensions['blogging'].post_processor
+        # render, not render_text: images point at the resized copies
+        if not post_processor.is_rendered(post):
+            post_processor.render(post)
         html_body = render_template(
             'email/email_post.html',
             post=post,
@@ -0,0 +1,130 @@
+from datetime import datetime
+from flask import current_app, url_for
+from flask.cli import with_appcontext
+from threading import Lock, Thread
+import click
+import hashlib
+import json
+import os
+
+'''
+Writes fully rendered copies of the public pages to FREEZE_FOLDER,
+so nginx can serve them to anonymous visitors without going through
+gunicorn. The manifest records the hash of every frozen page and a
+version that is bumped whenever one of them changes; pages whose
+output did not change are not rewritten.
+'''
+
+FROZEN_ENDPOINTS = ('main.index', 'main.privacy', 'main.terms',
+                    'main.support')
+MANIFEST = 'manifest.json'
+
+_freeze_lock = Lock()
+
+
+def _page_file(path):
+    # /privacy -> privacy/index.html, / -> index.html
+    return os.path.join(path.strip('/'), 'index.html').lstrip('/')
+
+
+def _read_manifest(folder):
+    try:
+        with open(os.path.join(folder, MANIFEST)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {'version': 0, 'pages': {}}
+
+
+def _write(path, data):
+    # readers (nginx) never see a partly written file
+    directory = os.path.dirname(path)
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+    temporary = path + '.tmp'
+    with open(temporary, 'wb') as f:
+        f.write(data)
+    os.replace(temporary, path)
+
+
+def frozen_paths(app):
+    # the endpoints this app has, with the URLs they are served at
+    paths = {}
+    with app.test_request_context():
+        for endpoint in FROZEN_ENDPOINTS:
+            if endpoint in app.view_functions:
+                paths[endpoint] = url_for(endpoint)
+    return paths
+
+
+def freeze(app, folder=None, force=False):
+    '''
+    Renders the public pages as an anonymous visitor and writes the ones
+    whose HTML changed since the last freeze. Returns the manifest.
+    '''
+    folder = folder or app.config['FREEZE_FOLDER']
+    with _freeze_lock:
+        manifest = _read_manifest(folder)
+        pages = manifest['pages']
+        changed = []
+        # SERVER_NAME and PREFERRED_URL_SCHEME apply, as for url_for
+        client = app.test_client()
+        for endpoint, path in frozen_paths(app).items():
+            response = client.get(path)
+            if response.status_code != 200:
+                app.logger.warning(
+                    f'Not freezing {path}: status {response.status_code}')
+                continue
+            body = response.get_data()
+            digest = hashlib.sha256(body).hexdigest()
+            page_file = _page_file(path)
+            target = os.path.join(folder, page_file)
+            page = pages.get(path)
+            if not force and page is not None and \
+                    page['sha256'] == digest and os.path.exists(target):
+                continue
+            _write(target, body)
+            pages[path] = {
+                'endpoint': endpoint,
+                'file': page_file,
+                'sha256': digest,
+                'frozen_at': datetime.utcnow().isoformat(),
+            }
+            changed.append(path)
+        if changed:
+            manifest['version'] += 1
+            _write(os.path.join(folder, MANIFEST),
+                   json.dumps(manifest, indent=2, sort_keys=True).encode())
+        manifest['changed'] = changed
+        return manifest
+
+
+def refreeze():
+    '''
+    Re-freezes the public pages in the background after an admin saved
+    something they show. Does nothing unless FREEZE_ON_SAVE is set.
+    '''
+    app = current_app._get_current_object()
+    if not app.config.get('FREEZE_ON_SAVE'):
+        return
+
+    def run():
+        try:
+            freeze(app)
+        except Exception:
+            app.logger.exception('Exception in refreeze')
+
+    Thread(target=run).start()
+
+
+@click.command('freeze')
+@click.option('--output', default=None,
+              help='Directory to write to (default FREEZE_FOLDER).')
+@click.option('--force', is_flag=True,
+              help='Rewrite every page, not only the changed ones.')
+@with_appcontext
+def freeze_command(output, force):
+    '''Write the public pages as static HTML for nginx to serve.'''
+    manifest = freeze(current_app._get_current_object(), output, force)
+    click.echo('Frozen manifest version %d, %d pages rewritten: %s' % (
+        manifest['version'], len(manifest['changed']),
+        ', '.join(manifest['changed']) or 'none'))
@@ -56,7 +56,7 @@ def index():
             if current_user.role == 'admin':
                 meta['is_user_blogger'] = True
     meta['post_id'] = temp_post['post_id']
-    meta['slug'] = PostProcessor.create_slug(temp_post['title'])
+    meta['slug'] = PostProcessor.get_slug(post)
     page_by_id_fetched.send(
         blog_engine.app,
         engine=blog_engine,
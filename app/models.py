@@ -136,6 +136,14 @@ def load_user(id):
     return User.query.get(int(id))
 
 
+@blog_engine.users_loader
+def load_users(ids):
+    # one query for all the authors on a blog page
+    ids = [int(id) for id in ids if str(id).isdigit()]
+    users = User.query.filter(User.id.in_(ids)).all() if ids else []
+    return {str(user.id): user for user in users}
+
+
 @identity_loaded.connect
 def on_identity_loaded(sender, identity):
     if hasattr(current_user, 'role'):
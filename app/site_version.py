@@ -0,0 +1,51 @@
+from flask import current_app
+import os
+import uuid
+
+'''
+The site version is part of the ETags of the blog pages. The pages
+also show the theme, the persona config and the hashed asset URLs,
+which change without any post changing; the admin saves and `flask
+assets` bump the version, so browsers holding a page from before get
+it again instead of a 304. It is kept in SITE_VERSION_FILE, so that a
+bump reaches every worker.
+'''
+
+# SITE_VERSION_FILE -> ((inode, mtime), version), read again on change
+_versions = {}
+
+
+def site_version(app=None):
+    '''The current version, '' until the first bump.'''
+    path = (app or current_app).config['SITE_VERSION_FILE']
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return ''
+    key = (stat.st_ino, stat.st_mtime_ns)
+    known = _versions.get(path)
+    if known is None or known[0] != key:
+        try:
+            with open(path) as f:
+                known = (key, f.read().strip())
+        except OSError:
+            return ''
+        _versions[path] = known
+    return known[1]
+
+
+def bump_site_version(app=None):
+    '''
+    Writes a new version. Random rather than counted, so that workers
+    bumping at once don't need a lock.
+    '''
+    path = (app or current_app).config['SITE_VERSION_FILE']
+    temporary = '%s.%d.tmp' % (path, os.getpid())
+    with open(temporary, 'w') as f:
+        f.write(uuid.uuid4().hex)
+    os.replace(temporary, path)
+
+
+def init_site_version(app):
+    # the library adds it to the ETags of the posts, listings and feeds
+    app.config['BLOGGING_ETAG_SALT'] = lambda: site_version(app)
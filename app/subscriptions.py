@@ -11,6 +11,9 @@ subscribers unless the post is marked 'noemail.'
 
 @editor_post_saved.connect
 def email_trigger(sender, engine, post_id, user, post):
+    # the signal is global; other blog engines (e.g. in tests) save too
+    if engine is not blog_engine:
+        return
     send_post = blog_engine.storage.get_post_by_id(post_id)
     for tag in send_post['tags']:
         email = True
@@ -1,5 +1,14 @@
 #!/bin/sh
-flask db upgrade
+# the workers of a lazy storage expect the tables to be migrated
+flask db upgrade || exit 1
 wait
-python3 docker_boot.py &
+# store the renderings a renderer change made stale
+flask blogging render
+flask assets
+flask freeze
+flask blogging feeds
+# warms up the app behind the proxy of the LibrePatron image
+if [ -n "$VIRTUAL_HOST" ]; then
+    python3 docker_boot.py &
+fi
 exec gunicorn patron:app
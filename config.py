@@ -32,6 +32,28 @@ class Config(object):
     BLOGGING_PLUGINS = None
     BLOGGING_ALLOW_FILE_UPLOAD = True
     BLOGGING_ESCAPE_MARKDOWN = False
+    # workers skip creating and reflecting the blogging tables at boot;
+    # only safe where migrations run first, as boot.sh does
+    BLOGGING_LAZY_STORAGE = os.environ.get('BLOGGING_LAZY_STORAGE') == '1'
+    # memoized blog views, shared by the gunicorn workers on the node
+    BLOGGING_CACHE_TYPE = os.environ.get('BLOGGING_CACHE_TYPE') or \
+        'filesystem'
+    BLOGGING_CACHE_DIR = os.environ.get('BLOGGING_CACHE_DIR') or \
+        join(basedir, 'cache')
+    BLOGGING_CACHE_TIMEOUT = 60
+    # stale pages are served for this long while they are rendered again
+    BLOGGING_CACHE_GRACE = 600
+    BLOGGING_CACHE_THRESHOLD = 2000
+    # the Atom feeds, updated entry by entry as posts are saved
+    BLOGGING_FEED_DIR = os.environ.get('BLOGGING_FEED_DIR') or \
+        join(basedir, 'feeds')
+    # public pages frozen to static HTML for nginx, see app/freeze.py
+    FREEZE_FOLDER = os.environ.get('FREEZE_FOLDER') or \
+        join(basedir, 'frozen')
+    FREEZE_ON_SAVE = True
+    # part of the blog ETags, bumped by admin saves, see app/site_version.py
+    SITE_VERSION_FILE = os.environ.get('SITE_VERSION_FILE') or \
+        join(basedir, 'site_version')
     # Comments system completely disabled
     COMMENTS = False
     COMMENTS_URL = None
@@ -54,6 +76,19 @@ class Config(object):
             SECRET_KEY = key['key']
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or \
         'sqlite:///' + join(basedir, 'app.db')
+    # WAL journal, busy_timeout and friends for SQLite, applied on connect
+    SQLITE_PROFILE = True
+    # keep SQLite connections (and their page cache) in a pool instead of
+    # reconnecting on every checkout
+    SQLALCHEMY_POOL_SIZE = 5
+    # optional read replica: blog reads go to it, writes to the primary,
+    # and an author reads from the primary for a few seconds after saving
+    if os.environ.get('DATABASE_REPLICA_URL') is not None:
+        SQLALCHEMY_BINDS = {'replica': os.environ.get('DATABASE_REPLICA_URL')}
+        BLOGGING_READ_BIND = 'replica'
+    else:
+        BLOGGING_READ_BIND = None
+    BLOGGING_READ_YOUR_WRITES = 10
     SCHEDULER_JOBSTORES = {
             'default': SQLAlchemyJobStore(url=SQLALCHEMY_DATABASE_URI)
         }
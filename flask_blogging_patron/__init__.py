@@ -1,6 +1,6 @@
 from .engine import BloggingEngine
 from .processor import PostProcessor
-from .sqlastorage import SQLAStorage
+from .sqlastorage import SQLAStorage, apply_sqlite_profile
 from .storage import Storage
 
 
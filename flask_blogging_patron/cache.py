@@ -0,0 +1,172 @@
+"""
+Hit and miss counters for the cache the blog views are memoized in, and
+the generations their cache keys are versioned with.
+"""
+try:
+    from builtins import object
+except ImportError:
+    pass
+import errno
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+
+GENERATION_PREFIX = "generation:"
+
+
+class CacheStats(object):
+    """
+    Wraps a Flask-Caching backend and counts the hits and misses of
+    ``get``, which the memoized views call once per request. Every
+    worker writes its counts to ``<stats_dir>/<pid>.json`` at most once
+    per ``flush_interval`` seconds, so ``stats`` can add up the counts of
+    all the workers on the node. The files of workers that have exited
+    are removed by ``stats``.
+
+    :param backend: The cache backend
+    :type backend: object
+    :param stats_dir: (Optional) The directory shared by the workers. If
+     ``None``, only this process is counted.
+    :type stats_dir: str
+    :param flush_interval: Seconds between writes of the counts
+    :type flush_interval: float
+    """
+
+    def __init__(self, backend, stats_dir=None, flush_interval=1.0):
+        self._backend = backend
+        self._stats_dir = stats_dir
+        self._flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._flushed = 0
+        self._logger = logging.getLogger(__name__)
+        self.hits = 0
+        self.misses = 0
+        if stats_dir and not os.path.exists(stats_dir):
+            try:
+                os.makedirs(stats_dir)
+            except OSError:
+                pass  # another worker made it
+
+    def __getattr__(self, name):
+        return getattr(self._backend, name)
+
+    def get(self, key):
+        value = self._backend.get(key)
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        self.flush()
+        return value
+
+    def flush(self, force=False):
+        now = time.time()
+        if not self._stats_dir or \
+                (not force and now - self._flushed < self._flush_interval):
+            return
+        self._flushed = now
+        path = os.path.join(self._stats_dir, "%d.json" % os.getpid())
+        try:
+            with open(path + ".tmp", "w") as f:
+                json.dump(dict(hits=self.hits, misses=self.misses,
+                               updated=now), f)
+            os.replace(path + ".tmp", path)
+        except (OSError, IOError) as e:
+            self._logger.warning(str(e))
+
+    def stats(self):
+        """
+        The counts of all the running workers.
+
+        :return: A dict with the ``hits``, ``misses``, ``hit_ratio`` and
+         the number of ``workers`` counted.
+        """
+        if self.hits or self.misses:
+            self.flush(force=True)
+        workers = [dict(hits=self.hits, misses=self.misses)]
+        if self._stats_dir:
+            workers = []
+            for name in os.listdir(self._stats_dir):
+                if not name.endswith(".json"):
+                    continue
+                path = os.path.join(self._stats_dir, name)
+                try:
+                    pid = int(name[:-len(".json")])
+                except ValueError:
+                    continue
+                if not _is_running(pid):
+                    # restarted by gunicorn; its pid may be reused later
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        pass
+                    continue
+                try:
+                    with open(path) as f:
+                        workers.append(json.load(f))
+                except (OSError, IOError, ValueError):
+                    continue
+        hits = sum(w["hits"] for w in workers)
+        misses = sum(w["misses"] for w in workers)
+        lookups = hits + misses
+        return dict(hits=hits, misses=misses, workers=len(workers),
+                    hit_ratio=float(hits) / lookups if lookups else None)
+
+
+def _is_running(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        # EPERM: running, as another user
+        return e.errno != errno.ESRCH
+    return True
+
+
+def _new_generation():
+    return uuid.uuid4().hex[:12]
+
+
+def get_generations(cache, namespaces):
+    """
+    The current generation of every namespace, from the shared cache, so
+    all the workers key their entries the same. A namespace without one
+    (never bumped, or evicted) starts a new generation rather than going
+    back to an old one.
+
+    :param cache: The cache
+    :type cache: object
+    :param namespaces: The namespaces, such as ``"post:1"``
+    :type namespaces: list
+    :return: The generations, in the order of ``namespaces``
+    """
+    keys = [GENERATION_PREFIX + namespace for namespace in namespaces]
+    generations = list(cache.get_many(*keys)) if keys else []
+    for i, generation in enumerate(generations):
+        if generation is None:
+            generation = _new_generation()
+            # another worker may have started it first
+            if not cache.add(keys[i], generation, timeout=0):
+                generation = cache.get_many(keys[i])[0] or generation
+            generations[i] = generation
+    return generations
+
+
+def bump_generations(cache, namespaces):
+    """
+    Moves the namespaces to a new generation, which orphans the entries
+    keyed with the current one in every worker. They expire on their
+    own.
+
+    :param cache: The cache
+    :type cache: object
+    :param namespaces: The namespaces to invalidate
+    :type namespaces: iterable
+    """
+    generations = dict((GENERATION_PREFIX + namespace, _new_generation())
+                       for namespace in namespaces)
+    if generations:
+        cache.set_many(generations, timeout=0)
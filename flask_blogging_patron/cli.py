@@ -0,0 +1,178 @@
+"""
+The ``flask blogging`` maintenance commands.
+"""
+import click
+import datetime
+import json
+import os
+from flask import current_app
+from flask.cli import AppGroup
+
+blogging_cli = AppGroup("blogging",
+                        help="Maintenance commands for the blog storage.")
+
+
+_DATE_FIELDS = ("post_date", "last_modified_date")
+_EXPORT_FIELDS = ("post_id", "title", "text", "user_id", "tags", "draft") + \
+    _DATE_FIELDS
+
+
+def _get_engine():
+    return current_app.extensions["FLASK_BLOGGING_ENGINE"]
+
+
+def _get_storage():
+    return _get_engine().storage
+
+
+def _parse_date(value):
+    for date_format in ("%Y-%m-%dT%H:%M:%S.%f", "%Y-%m-%dT%H:%M:%S"):
+        try:
+            return datetime.datetime.strptime(value, date_format)
+        except ValueError:
+            pass
+    raise ValueError("Invalid date: %r" % value)
+
+
+def _to_ndjson(post):
+    record = dict((k, post.get(k)) for k in _EXPORT_FIELDS)
+    for field in _DATE_FIELDS:
+        if record[field] is not None:
+            record[field] = record[field].isoformat()
+    record["draft"] = bool(record["draft"])
+    return json.dumps(record, default=str)
+
+
+def _from_ndjson(lines, progress=None, chunk_size=None):
+    # counts the posts yielded in progress["read"], and keeps the line
+    # of the first post of the latest chunk in progress["chunk_line"]
+    for number, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            post = json.loads(line)
+            for field in _DATE_FIELDS:
+                if post.get(field):
+                    post[field] = _parse_date(post[field])
+        except ValueError as e:
+            raise click.ClickException("Line %d: %s" % (number, e))
+        if progress is not None:
+            if progress["read"] % chunk_size == 0:
+                progress["chunk_line"] = number
+            progress["read"] += 1
+        yield post
+
+
+@blogging_cli.command("recount")
+def recount():
+    """Rebuild the maintained post counters."""
+    storage = _get_storage()
+    try:
+        buckets = storage.recount_posts()
+    except NotImplementedError:
+        raise click.ClickException("%s does not maintain post counters." %
+                                   type(storage).__name__)
+    click.echo("Rebuilt %d post counters." % buckets)
+
+
+@blogging_cli.command("export")
+@click.argument("output", type=click.File("w"), default="-")
+@click.option("--chunk-size", default=500, show_default=True,
+              help="Posts read from the storage at a time.")
+def export_posts(output, chunk_size):
+    """Write every post to OUTPUT as newline-delimited JSON."""
+    count = 0
+    for post in _get_storage().iter_posts(chunk_size=chunk_size):
+        output.write(_to_ndjson(post) + "\n")
+        count += 1
+    click.echo("Exported %d posts." % count, err=True)
+
+
+@blogging_cli.command("import")
+@click.argument("source", type=click.File("r"), default="-")
+@click.option("--chunk-size", default=500, show_default=True,
+              help="Posts written per transaction.")
+def import_posts(source, chunk_size):
+    """Insert the posts in SOURCE (newline-delimited JSON) as new posts."""
+    progress = dict(read=0, chunk_line=None)
+    saved = _get_storage().save_posts_bulk(
+        _from_ndjson(source, progress, chunk_size), chunk_size=chunk_size)
+    if saved < progress["read"]:
+        # the storage stops at the first chunk it could not write, which
+        # is the last one it read
+        raise click.ClickException(
+            "Imported %d posts, then failed on the chunk starting at line "
+            "%d." % (saved, progress["chunk_line"]))
+    click.echo("Imported %d posts." % saved, err=True)
+
+
+@blogging_cli.command("cache-stats")
+def cache_stats():
+    """Show the hits and misses of the view cache over all workers."""
+    stats = _get_engine().cache_stats()
+    if stats is None:
+        raise click.ClickException("No view cache is configured.")
+    ratio = stats["hit_ratio"]
+    click.echo("%d hits, %d misses (%s hit ratio) over %d workers." % (
+        stats["hits"], stats["misses"],
+        "n/a" if ratio is None else "%.1f%%" % (ratio * 100),
+        stats["workers"]))
+
+
+@blogging_cli.command("feeds")
+def rebuild_feeds():
+    """Build the stored Atom feeds again from the storage."""
+    engine = _get_engine()
+    if engine.feeds is None:
+        raise click.ClickException("No BLOGGING_FEED_DIR is configured.")
+    # the feeds link to the site, and url_for needs a request for that
+    with current_app.test_request_context(
+            base_url=engine.config.get("BLOGGING_SITEURL") or None):
+        built = engine.feeds.rebuild()
+    click.echo("Built %d feeds in %s." % (built, engine.feeds.folder))
+
+
+@blogging_cli.command("render")
+@click.option("--force", is_flag=True,
+              help="Render every post, not only the stale ones.")
+@click.option("--chunk-size", default=500, show_default=True,
+              help="Posts read from the storage at a time.")
+def render_posts(force, chunk_size):
+    """Render and store the HTML of posts whose rendering is stale."""
+    engine = _get_engine()
+    post_processor = engine.post_processor
+    rendered = failed = 0
+    for post in engine.storage.iter_posts(chunk_size=chunk_size):
+        if not force and post_processor.is_rendered(post):
+            continue
+        post_processor.render(post)
+        try:
+            saved = engine.storage.save_rendered(
+                post["post_id"], post["rendered_text"], post["meta"],
+                post["render_version"], post["excerpt"],
+                post["rendered_excerpt"])
+        except NotImplementedError:
+            raise click.ClickException("%s cannot store rendered posts." %
+                                       type(engine.storage).__name__)
+        if saved:
+            rendered += 1
+        else:
+            failed += 1
+    click.echo("Rendered %d posts, %d failed." % (rendered, failed))
+
+
+@blogging_cli.command("images")
+def image_derivatives():
+    """Generate the resized copies of images uploaded before."""
+    images = _get_engine().images
+    if images is None or not images.available:
+        raise click.ClickException("Image derivatives need file uploads "
+                                   "and Pillow.")
+    folder = os.path.dirname(images.folder)
+    generated = 0
+    for filename in sorted(os.listdir(folder)):
+        path = os.path.join(folder, filename)
+        if os.path.isfile(path) and images.generate(path) is not None:
+            generated += 1
+    click.echo("Generated derivatives of %d images. Run `flask blogging "
+               "render --force` to use them in stored posts." % generated)
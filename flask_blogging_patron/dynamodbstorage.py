@@ -3,7 +3,9 @@ from .storage import Storage
 import boto3
 from boto3.dynamodb.conditions import Key
 import datetime
+import json
 from shortuuid import ShortUUID
+from .utils import decode_cursor, CURSOR_BEFORE
 import copy
 
 
@@ -25,7 +27,7 @@ class DynamoDBStorage(Storage):
 
     def save_post(self, title, text, user_id, tags, draft=False,
                   post_date=None, last_modified_date=None, meta_data=None,
-                  post_id=None):
+                  post_id=None, slug=None):
         try:
             current_datetime = datetime.datetime.utcnow()
             post_date = post_date or current_datetime
@@ -34,6 +36,7 @@ class DynamoDBStorage(Storage):
             tags = self.normalize_tags(tags)
             draft = 1 if draft else 0
             r = {'title': title,
+                 'slug': slug if slug is not None else self.create_slug(title),
                  'text': text,
                  'user_id': user_id,
                  'tags': tags,
@@ -54,16 +57,20 @@ class DynamoDBStorage(Storage):
                 self._blog_posts_table.put_item(Item=r)
                 self._insert_tags(tags, post_id, post_date, draft)
             else:
-                expr = 'SET title = :title, #t = :text, user_id = :user_id, '\
+                expr = 'SET title = :title, slug = :slug, #t = :text, '\
+                       'user_id = :user_id, '\
                        'tags = :tags, draft = :draft, '\
                        'post_date = :post_date, '\
                        'last_modified_date = :last_modified_date, '\
-                       'meta_data = :meta_data'
+                       'meta_data = :meta_data '\
+                       'REMOVE rendered_text, rendered_meta, excerpt, '\
+                       'rendered_excerpt, render_version'
                 self._blog_posts_table.update_item(
                     Key={'post_id': post_id},
                     UpdateExpression=expr,
                     ExpressionAttributeValues={
                         ':title': r['title'],
+                        ':slug': r['slug'],
                         ':text': r['text'],
                         ':user_id': r['user_id'],
                         ':tags': r['tags'],
@@ -86,22 +93,26 @@ class DynamoDBStorage(Storage):
         return post_id
 
     def get_posts(self, count=10, offset=0, recent=True, tag=None,
-                  user_id=None, include_draft=False):
+                  user_id=None, include_draft=False, cursor=None,
+                  fields=None):
         try:
             post_ids = self._get_post_ids(count=count, offset=offset,
                                           recent=recent,
                                           tag=tag, user_id=user_id,
-                                          include_draft=include_draft)
+                                          include_draft=include_draft,
+                                          cursor=cursor)
         except Exception as e:
             self._logger.exception(str(e))
             post_ids = []
         return [self.get_post_by_id(p) for p in post_ids]
 
     def _get_post_ids(self, count=10, offset=0, recent=True, tag=None,
-                      user_id=None, include_draft=False):
+                      user_id=None, include_draft=False, cursor=None):
         # include_draft is not supported yet
+        cursor = decode_cursor(cursor)
+        backwards = cursor is not None and cursor[0] == CURSOR_BEFORE
         kwargs = dict(ProjectionExpression='post_id',
-                      ScanIndexForward=not recent)
+                      ScanIndexForward=recent if backwards else not recent)
         if count:
             kwargs['Limit'] = count
         table = self._blog_posts_table
@@ -110,6 +121,7 @@ class DynamoDBStorage(Storage):
                 dict(IndexName='user_id_index',
                      KeyConditionExpression=Key('user_id').eq(user_id))
             )
+            start_key = {'user_id': user_id}
 
         elif tag:
             table = self._tag_posts_table
@@ -118,11 +130,26 @@ class DynamoDBStorage(Storage):
                 dict(IndexName='tag_index',
                      KeyConditionExpression=Key('tag').eq(norm_tag))
             )
+            start_key = {'tag': norm_tag}
         else:
             kwargs.update(
                 dict(IndexName='post_index',
                      KeyConditionExpression=Key('draft').eq(0))
             )
+            start_key = {'draft': 0}
+        if cursor is not None:
+            _, post_date, post_id = cursor
+            # the index key plus the table key of the post the cursor
+            # points to is a valid ExclusiveStartKey in either direction
+            start_key['post_date'] = self._to_timestamp(post_date)
+            if tag:
+                start_key['tag_id'] = "%s_%s" % (norm_tag, post_id)
+            else:
+                start_key['post_id'] = post_id
+            kwargs["ExclusiveStartKey"] = start_key
+            response = getattr(table, "query")(**kwargs)
+            post_ids = [p['post_id'] for p in response['Items']]
+            return post_ids[::-1] if backwards else post_ids
         if offset and offset > 0:
             kwargs2 = copy.deepcopy(kwargs)
             kwargs2['Limit'] = offset
@@ -153,19 +180,95 @@ class DynamoDBStorage(Storage):
                 Key={'post_id': post_id}
             )
             item = response.get('Item')
-            if item:
-                r = item
-                r['post_date'] = self._from_timestamp(r['post_date'])
-                r['last_modified_date'] = \
-                    self._from_timestamp(r['last_modified_date'])
-                r["draft"] = bool(r["draft"])
-            else:
-                r = None
+            r = self._from_item(item) if item else None
         except Exception as e:
             self._logger.exception(str(e))
             r = None
         return r
 
+    def save_posts_bulk(self, posts, chunk_size=500):
+        # batch_writer buffers the puts into BatchWriteItem calls of 25
+        # items, so chunk_size only bounds how much is held in memory
+        saved = 0
+        current_datetime = datetime.datetime.utcnow()
+        try:
+            with self._blog_posts_table.batch_writer() as posts_writer, \
+                    self._tag_posts_table.batch_writer() as tags_writer:
+                for post in posts:
+                    post_date = self._to_timestamp(
+                        post.get("post_date") or current_datetime)
+                    last_modified_date = self._to_timestamp(
+                        post.get("last_modified_date") or current_datetime)
+                    tags = self.normalize_tags(post.get("tags") or [])
+                    draft = 1 if post.get("draft") else 0
+                    post_id = self._uuid.uuid()
+                    posts_writer.put_item(Item={
+                        'post_id': post_id,
+                        'title': post["title"],
+                        'slug': post.get("slug") or
+                        self.create_slug(post["title"]),
+                        'text': post["text"],
+                        'user_id': str(post["user_id"]),
+                        'tags': tags,
+                        'draft': draft,
+                        'post_date': post_date,
+                        'last_modified_date': last_modified_date,
+                        'meta_data': post.get("meta_data")
+                    })
+                    for t in set(tags):
+                        tags_writer.put_item(Item={
+                            'tag_id': "%s_%s" % (t, post_id), 'tag': t,
+                            'post_date': post_date, 'post_id': post_id,
+                            'draft': draft})
+                    saved += 1
+        except Exception as e:
+            self._logger.exception(str(e))
+        return saved
+
+    def iter_posts(self, chunk_size=500):
+        kwargs = dict(Limit=chunk_size)
+        while True:
+            response = self._blog_posts_table.scan(**kwargs)
+            for item in response['Items']:
+                yield self._from_item(item)
+            last_key = response.get('LastEvaluatedKey')
+            if not last_key:
+                return
+            kwargs['ExclusiveStartKey'] = last_key
+
+    def _from_item(self, item):
+        item['post_date'] = self._from_timestamp(item['post_date'])
+        item['last_modified_date'] = \
+            self._from_timestamp(item['last_modified_date'])
+        item["draft"] = bool(item["draft"])
+        if "rendered_meta" in item:
+            item["meta"] = json.loads(item.pop("rendered_meta"))
+        return item
+
+    def save_rendered(self, post_id, rendered_text, meta, render_version,
+                      excerpt=None, rendered_excerpt=None):
+        try:
+            self._blog_posts_table.update_item(
+                Key={'post_id': post_id},
+                UpdateExpression='SET rendered_text = :rendered_text, '
+                                 'rendered_meta = :rendered_meta, '
+                                 'excerpt = :excerpt, '
+                                 'rendered_excerpt = :rendered_excerpt, '
+                                 'render_version = :render_version',
+                ConditionExpression='attribute_exists(post_id)',
+                ExpressionAttributeValues={
+                    ':rendered_text': rendered_text,
+                    ':rendered_meta': json.dumps(meta),
+                    ':excerpt': excerpt,
+                    ':rendered_excerpt': rendered_excerpt,
+                    ':render_version': render_version
+                }
+            )
+            return True
+        except Exception as e:
+            self._logger.exception(str(e))
+        return False
+
     def delete_post(self, post_id):
         try:
             r = self.get_post_by_id(post_id)
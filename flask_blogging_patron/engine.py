@@ -5,12 +5,26 @@ try:
     from builtins import object
 except ImportError:
     pass
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from flask import g, has_app_context
 from .processor import PostProcessor
+from .images import ImageDerivatives
+from .cache import CacheStats, bump_generations
+from .feeds import FeedArtifacts
 from flask_principal import Principal, Permission, RoleNeed
-from .signals import engine_initialised, post_processed, blueprint_created
+from .signals import engine_initialised, post_processed, \
+    blueprint_created, editor_post_saved, post_deleted
 from flask_fileupload import FlaskFileUpload
 
 
+def _render(post_processor, text):
+    # runs in a render worker; module level so process pools can pickle it
+    post = dict(text=text)
+    post_processor.render(post)
+    return post["rendered_text"], post["meta"], post["excerpt"], \
+        post["rendered_excerpt"], post["render_version"]
+
+
 class BloggingEngine(object):
     """
     The BloggingEngine is the class for initializing the blog support for your
@@ -54,6 +68,8 @@ class BloggingEngine(object):
         self.storage = storage
         self.config = None
         self.ffu = None
+        self.images = None
+        self.feeds = None
         self.cache = cache
         self._blogger_permission = None
         self.post_processor = PostProcessor() if post_processor is None \
@@ -61,6 +77,8 @@ class BloggingEngine(object):
         if extensions:
             self.post_processor.set_custom_extensions(extensions)
         self.user_callback = None
+        self.users_callback = None
+        self._render_executor = None
         self.file_upload = file_upload
         if app is not None and storage is not None:
             self.init_app(app, storage)
@@ -91,6 +109,11 @@ class BloggingEngine(object):
         self.config = self.app.config
         self.storage = storage or self.storage
         self.cache = cache or self.cache
+        self._init_cache()
+        feed_dir = self.config.get("BLOGGING_FEED_DIR")
+        if feed_dir:
+            self.feeds = FeedArtifacts(
+                self, feed_dir, self.config.get("BLOGGING_FEED_LIMIT"))
         self._register_plugins(self.app, self.config)
 
         from .views import create_blueprint
@@ -102,11 +125,173 @@ class BloggingEngine(object):
 
         self.app.extensions["FLASK_BLOGGING_ENGINE"] = self  # duplicate
         self.app.extensions["blogging"] = self
+        from .cli import blogging_cli
+        self.app.cli.add_command(blogging_cli)
         self.principal = Principal(self.app)
+        editor_post_saved.connect(self._post_saved, sender=self.app)
+        post_deleted.connect(self._post_deleted, sender=self.app)
         engine_initialised.send(self.app, engine=self)
 
         if self.config.get("BLOGGING_ALLOW_FILEUPLOAD", True):
             self.ffu = self.file_upload or FlaskFileUpload(app)
+            self._init_images()
+
+    def _init_images(self):
+        # resized and WebP copies of local uploads, used by rendered posts
+        widths = self.config.get("BLOGGING_IMAGE_WIDTHS", (480, 960, 1440))
+        storage = self.ffu.storage
+        if not widths or not hasattr(storage, "abs_img_folder"):
+            return
+        base_url = "%s/%s" % (self.app.static_url_path, storage.img_folder)
+        self.images = ImageDerivatives(
+            storage.abs_img_folder, base_url, widths,
+            quality=self.config.get("BLOGGING_IMAGE_QUALITY", 80))
+        if self.images.available:
+            self.images.install(storage)
+        self.post_processor.set_image_derivatives(self.images)
+
+    def _init_cache(self):
+        """
+        Sets up the cache the views are memoized in from the
+        ``BLOGGING_CACHE_*`` settings (``BLOGGING_CACHE_TYPE``,
+        ``BLOGGING_CACHE_DIR``, ...), which are passed to Flask-Caching as
+        the matching ``CACHE_*`` settings, unless a cache was given. With a
+        ``filesystem`` cache every worker on the node shares the entries.
+        The backend is wrapped in ``CacheStats`` to count hits and misses.
+        """
+        prefix = "BLOGGING_CACHE_"
+        if self.cache is None and self.config.get(prefix + "TYPE"):
+            from flask_caching import Cache
+            cache_config = dict(("CACHE_" + key[len(prefix):], value)
+                                for key, value in self.config.items()
+                                if key.startswith(prefix))
+            cache_config.setdefault("CACHE_DEFAULT_TIMEOUT", self.config.get(
+                "BLOGGING_CACHE_TIMEOUT", 60))
+            cache_config.setdefault("CACHE_KEY_PREFIX", "blogging_")
+            self.cache = Cache()
+            self.cache.init_app(self.app, config=cache_config)
+        if self.cache is None:
+            return
+        stats_dir = self.config.get(prefix + "STATS_DIR")
+        if stats_dir is None and self.config.get(prefix + "DIR"):
+            stats_dir = self.config[prefix + "DIR"].rstrip("/\\") + "-stats"
+        backends = self.app.extensions.get("cache", {})
+        backend = backends.get(self.cache)
+        if backend is not None and not isinstance(backend, CacheStats):
+            backends[self.cache] = CacheStats(backend, stats_dir)
+
+    def cache_stats(self):
+        """
+        The hits and misses of the view cache, added up over the workers.
+
+        :return: A dict as returned by ``CacheStats.stats``, or ``None``
+         without a cache.
+        """
+        backend = self.app.extensions.get("cache", {}).get(self.cache)
+        return backend.stats() if isinstance(backend, CacheStats) else None
+
+    def _read_your_writes(self, app, **kwargs):
+        # storages with a read replica route the writer's next reads to the
+        # primary for BLOGGING_READ_YOUR_WRITES seconds
+        window = self.config.get("BLOGGING_READ_YOUR_WRITES", 10)
+        if window and hasattr(self.storage, "read_from_primary"):
+            self.storage.read_from_primary(window)
+
+    def _post_saved(self, app, post_id=None, post=None, **kwargs):
+        self._read_your_writes(app)
+        saved = None
+        if post_id is not None and (
+                self.cache is not None or self.feeds is not None or
+                self.config.get("BLOGGING_RENDER_TEXT", True)):
+            saved = self.storage.get_post_by_id(post_id)
+        # render the new text now rather than on the first page view
+        if saved is not None and \
+                self.config.get("BLOGGING_RENDER_TEXT", True):
+            self.post_processor.render(saved)
+            self.save_rendered(saved)
+        # ``post`` is the post as it was before the save, {} for a new one
+        self.invalidate_posts(post, saved or dict(post_id=post_id))
+        if saved is not None:
+            self._update_feeds(post_id, saved, (post or {}).get("tags"))
+
+    def _post_deleted(self, app, post_id=None, post=None, **kwargs):
+        self._read_your_writes(app)
+        self.invalidate_posts(post or dict(post_id=post_id))
+        self._update_feeds(post_id, None, (post or {}).get("tags"))
+
+    def _update_feeds(self, post_id, post, old_tags):
+        if self.feeds is None:
+            return
+        try:
+            if post is not None:
+                self.process_post(post, render=True)
+            self.feeds.update(post_id, post, old_tags or [])
+        except Exception as e:
+            self.app.logger.exception(str(e))
+
+    def invalidate_posts(self, *posts):
+        """
+        Invalidates the cached views showing ``posts``: the page of each
+        post (by id and by slug), the listings of its tags and of its
+        author, the index, feed and sitemap, and the sitemap shard holding
+        the post. Pass a changed post as it was before and after the
+        change, so the tags and slug it lost are invalidated too. The
+        views key their entries with the generation of these namespaces,
+        kept in the shared cache, so every worker sees the invalidation.
+
+        :param posts: Post dicts; only ``post_id``, ``slug``, ``user_id``
+         and ``tags`` are used.
+        :type posts: dict
+        """
+        if self.cache is None:
+            return
+        namespaces = set(["posts"])
+        for post in posts:
+            if not post:
+                continue
+            if post.get("post_id") is not None:
+                namespaces.add("post:%s" % post["post_id"])
+                shard = self._sitemap_shard(post["post_id"])
+                if shard is not None:
+                    namespaces.add("sitemap:%s" % shard)
+            if post.get("slug"):
+                # the page as found through its slug URL
+                namespaces.add("post:%s" % post["slug"])
+            if post.get("user_id") is not None:
+                namespaces.add("author:%s" % post["user_id"])
+            for tag in post.get("tags") or []:
+                namespaces.add("tag:%s" % self.storage.normalize_tag(tag))
+        try:
+            bump_generations(self.cache, namespaces)
+        except Exception as e:
+            self.app.logger.exception(str(e))
+
+    def _sitemap_shard(self, post_id):
+        # the shard of the sitemap listing the post; see
+        # Storage.get_sitemap_shards
+        try:
+            post_id = int(post_id)
+        except (TypeError, ValueError):
+            return None
+        shard_size = self.config.get("BLOGGING_SITEMAP_SHARD_SIZE", 50000)
+        return (post_id - 1) // shard_size + 1
+
+    def save_rendered(self, post):
+        """
+        Persist the rendering of ``post`` in the storage, if the storage
+        supports it.
+
+        :param post: A post dictionary rendered by the post processor
+        :type post: dict
+        :return: ``True`` if the rendering was stored
+        """
+        try:
+            return self.storage.save_rendered(
+                post["post_id"], post["rendered_text"], post["meta"],
+                post["render_version"], post.get("excerpt"),
+                post.get("rendered_excerpt"))
+        except NotImplementedError:
+            return False
 
     @property
     def blogger_permission(self):
@@ -129,6 +314,59 @@ class BloggingEngine(object):
         self.user_callback = callback
         return callback
 
+    def users_loader(self, callback):
+        """
+        The decorator for loading many users at once, e.g. with a single
+        ``IN`` query. Optional; without it users are loaded one at a time
+        through the ``user_loader`` callback.
+
+        :param callback: The callback function that takes a list of
+         unicode ``user_id`` values and returns a dict mapping them to users.
+         Unknown ids may be left out.
+        :return: The callback function
+        """
+        self.users_callback = callback
+        return callback
+
+    def load_users(self, user_ids):
+        """
+        Returns a dict of ``user_id`` to user for the given ids. Users are
+        remembered for the rest of the request (the app context), and the
+        ones not seen yet are fetched with one ``users_loader`` call.
+
+        :param user_ids: The user ids to load
+        :type user_ids: iterable
+        :return: A dict mapping each unicode ``user_id`` to its user, or to
+         ``None`` if it is unknown
+        """
+        memo = self._user_memo()
+        missing = sorted(set(str(u) for u in user_ids) - set(memo))
+        if missing:
+            if self.users_callback is not None:
+                users = self.users_callback(missing) or {}
+                for user_id in missing:
+                    memo[user_id] = users.get(user_id)
+            else:
+                for user_id in missing:
+                    memo[user_id] = self._load_user(user_id)
+        return dict((str(u), memo[str(u)]) for u in user_ids)
+
+    def _load_user(self, user_id):
+        try:
+            return self.user_callback(user_id)
+        except Exception:
+                raise Exception("No user_loader has been installed for this "
+                                "BloggingEngine. Add one with the "
+                                "'BloggingEngine.user_loader' decorator.")
+
+    @staticmethod
+    def _user_memo():
+        if not has_app_context():
+            return {}
+        if not hasattr(g, "blogging_users"):
+            g.blogging_users = {}
+        return g.blogging_users
+
     def is_user_blogger(self):
         return self.blogger_permission.require().can()
 
@@ -149,17 +387,111 @@ class BloggingEngine(object):
         :return:
         """
         post_processor = self.post_processor
+        if render:
+            self._load_stale_summaries([post])
+        stale = render and not post_processor.is_rendered(post)
         post_processor.process(post, render)
-        try:
-            author = self.user_callback(post["user_id"])
-        except Exception:
-                raise Exception("No user_loader has been installed for this "
-                                "BloggingEngine. Add one with the "
-                                "'BloggingEngine.user_loader' decorator.")
+        if stale:
+            self._save_rendered_on_read(post)
+        author = self.load_users([post["user_id"]])[str(post["user_id"])]
         if author is not None:
             post["user_name"] = self.get_user_name(author)
         post_processed.send(self.app, engine=self, post=post, render=render)
 
+    def process_posts(self, posts, render=True):
+        """
+        Processes a list of posts like ``process_post``, loading all of
+        their authors up front in one batch.
+
+        :param posts: A list of post dictionaries
+        :type posts: list
+        :param render: Choice if the markdown text has to be converted or not
+        :type render: bool
+        :return:
+        """
+        self.load_users(set(post["user_id"] for post in posts))
+        if render:
+            self._load_stale_summaries(posts)
+            self._render_posts(posts)
+        for post in posts:
+            self.process_post(post, render=render)
+
+    def _load_stale_summaries(self, posts):
+        # summaries (see Storage.SUMMARY_FIELDS) whose excerpt is missing
+        # or stale need the whole post to be rendered again; they are
+        # fetched in one batch
+        stale = [post for post in posts if "text" not in post and
+                 not self.post_processor.is_rendered(post)]
+        if not stale:
+            return
+        try:
+            full = self.storage.get_posts_by_ids(
+                [post["post_id"] for post in stale])
+        except NotImplementedError:
+            full = [self.storage.get_post_by_id(post["post_id"])
+                    for post in stale]
+        by_id = dict((str(f["post_id"]), f) for f in full if f is not None)
+        for post in stale:
+            if str(post["post_id"]) in by_id:
+                post.update(by_id[str(post["post_id"])])
+
+    def _render_posts(self, posts):
+        """
+        Renders the posts without a current rendering on the render
+        executor, if ``BLOGGING_RENDER_WORKERS`` is set, and stores the
+        results. Results are assigned in the order of ``posts``.
+        """
+        post_processor = self.post_processor
+        stale = [post for post in posts
+                 if not post_processor.is_rendered(post)]
+        executor = self.render_executor
+        if executor is None or len(stale) < 2:
+            return
+        # a few chunks per worker keeps a process pool's IPC overhead low;
+        # thread pools ignore chunksize
+        workers = self.config.get("BLOGGING_RENDER_WORKERS")
+        chunksize = max(1, len(stale) // (workers * 4))
+        results = executor.map(_render, [post_processor] * len(stale),
+                               [post["text"] for post in stale],
+                               chunksize=chunksize)
+        for post, (rendered_text, meta, excerpt, rendered_excerpt,
+                   render_version) in zip(stale, results):
+            post["rendered_text"] = rendered_text
+            post["meta"] = meta
+            post["excerpt"] = excerpt
+            post["rendered_excerpt"] = rendered_excerpt
+            post["render_version"] = render_version
+            self._save_rendered_on_read(post)
+
+    def _save_rendered_on_read(self, post):
+        # posts are rendered and stored when saved and by `flask blogging
+        # render`; storing them from page views takes write locks (and the
+        # primary, with a read replica), so it is opt-in
+        if self.config.get("BLOGGING_SAVE_RENDERED_ON_READ", False):
+            self.save_rendered(post)
+
+    @property
+    def render_executor(self):
+        """
+        The bounded pool used by ``process_posts`` to render posts, or
+        ``None`` to render them one by one. Configured with
+        ``BLOGGING_RENDER_WORKERS`` (the pool size, default 0) and
+        ``BLOGGING_RENDER_EXECUTOR`` (``"thread"``, the default, or
+        ``"process"``). Markdown rendering holds the GIL, so only a
+        process pool renders on several cores at once. The pool is made on
+        first use, i.e. after gunicorn has forked the worker.
+        """
+        workers = self.config.get("BLOGGING_RENDER_WORKERS", 0) \
+            if self.config else 0
+        if not workers:
+            return None
+        if self._render_executor is None:
+            if self.config.get("BLOGGING_RENDER_EXECUTOR") == "process":
+                self._render_executor = ProcessPoolExecutor(workers)
+            else:
+                self._render_executor = ThreadPoolExecutor(workers)
+        return self._render_executor
+
     @classmethod
     def get_user_name(cls, user):
         user_name = user.get_name() if hasattr(user, "get_name") else str(user)
@@ -0,0 +1,233 @@
+"""
+The Atom feeds of the blog, kept as files and updated one entry at a
+time as posts are saved and deleted.
+"""
+try:
+    from builtins import object
+except ImportError:
+    pass
+import datetime
+import json
+import os
+import threading
+try:
+    from urllib.parse import quote
+except ImportError:  # pragma: no cover
+    from urllib import quote
+from flask import url_for
+from werkzeug.contrib.atom import AtomFeed, FeedEntry
+from .utils import ensureUtf, FileLock
+
+_DATE_FORMAT = "%Y-%m-%dT%H:%M:%S.%f"
+
+
+class FeedArtifacts(object):
+    """
+    The feed of all posts and the feeds of single tags, stored in
+    ``folder`` as the XML served (``<name>.atom.xml``) and its entries
+    (``<name>.json``). A feed is built from the storage the first time
+    it is asked for. After that, ``update`` splices in or drops the entry
+    of a changed post, so a request for the feed only reads a file.
+    Updates are serialised over the workers with a lock file.
+
+    :param engine: The blogging engine
+    :type engine: BloggingEngine
+    :param folder: The directory the feeds are stored in
+    :type folder: str
+    :param limit: (Optional) The number of entries per feed. If ``None``,
+     every post is in the feed.
+    :type limit: int
+    """
+
+    def __init__(self, engine, folder, limit=None):
+        self._engine = engine
+        self.folder = folder
+        self.limit = limit
+        self._lock = threading.Lock()
+        if not os.path.exists(folder):
+            try:
+                os.makedirs(folder)
+            except OSError:
+                pass  # another worker made it
+
+    def _name(self, tag=None):
+        if tag is None:
+            return "all"
+        tag = self._engine.storage.normalize_tag(tag)
+        return "tag-" + quote(tag, safe="")
+
+    def path(self, tag=None):
+        """
+        The file holding the XML of the feed of ``tag``, or of all posts.
+        """
+        return os.path.join(self.folder, self._name(tag) + ".atom.xml")
+
+    def open(self, tag=None):
+        """
+        Opens the XML of a feed for reading in binary mode, building the
+        feed first if it is not stored yet.
+
+        :param tag: (Optional) The tag of the feed
+        :type tag: str
+        :return: The open file, or ``None`` if there is no post with
+         ``tag``
+        """
+        try:
+            return open(self.path(tag), "rb")
+        except (OSError, IOError):
+            pass
+        with self._locked():
+            if not os.path.exists(self.path(tag)) and \
+                    not self._build(tag) and tag is not None:
+                return None
+        return open(self.path(tag), "rb")
+
+    def build(self, tag=None):
+        """
+        Builds a feed from the storage, replacing the stored one.
+
+        :param tag: (Optional) The tag of the feed
+        :type tag: str
+        :return: The number of entries
+        """
+        with self._locked():
+            return self._build(tag)
+
+    def rebuild(self):
+        """
+        Builds the feed of all posts and every stored tag feed again, e.g.
+        after the renderer changed.
+
+        :return: The number of feeds built
+        """
+        built = 0
+        with self._locked():
+            tags = self._stored_tags()
+            if None not in tags:
+                tags.insert(0, None)
+            for tag in tags:
+                self._build(tag)
+                built += 1
+        return built
+
+    def update(self, post_id, post=None, tags=()):
+        """
+        Drops the entry of ``post_id`` from the stored feeds it may be in
+        and splices in the new entry, if ``post`` is published. Feeds
+        that are not stored yet are left to be built when asked for.
+
+        :param post_id: The identifier of the changed post
+        :type post_id: str
+        :param post: (Optional) The post as saved, processed and rendered.
+         ``None`` if it was deleted.
+        :type post: dict
+        :param tags: The tags the post had before the change
+        :type tags: list
+        """
+        storage = self._engine.storage
+        if post is not None and post.get("draft"):
+            post = None
+        new_tags = set(storage.normalize_tags(post["tags"])) \
+            if post is not None else set()
+        entry = self._entry(post) if post is not None else None
+        with self._locked():
+            for tag in [None] + sorted(
+                    new_tags | set(storage.normalize_tags(tags))):
+                entries = self._read_entries(tag)
+                if entries is None:
+                    continue
+                kept = [e for e in entries
+                        if str(e["post_id"]) != str(post_id)]
+                if entry is not None and (tag is None or tag in new_tags):
+                    kept.append(entry)
+                elif self.limit is not None and \
+                        len(kept) < len(entries) == self.limit:
+                    # an older post moves up into the feed
+                    self._build(tag)
+                    continue
+                kept.sort(key=lambda e: (e["published"], e["post_id"]),
+                          reverse=True)
+                self._write(tag, kept[:self.limit])
+
+    def _locked(self):
+        return FileLock(self._lock, os.path.join(self.folder, ".lock"))
+
+    def _stored_tags(self):
+        tags = []
+        for filename in os.listdir(self.folder):
+            if filename == "all.json":
+                tags.append(None)
+            elif filename.startswith("tag-") and filename.endswith(".json"):
+                with open(os.path.join(self.folder, filename)) as f:
+                    tags.append(json.load(f)["tag"])
+        return tags
+
+    def _build(self, tag):
+        engine = self._engine
+        posts = engine.storage.get_posts(
+            count=self.limit, offset=None, recent=True, user_id=None,
+            tag=tag, include_draft=False)
+        if not posts and tag is not None:
+            return 0
+        engine.process_posts(posts, render=True)
+        self._write(tag, [self._entry(post) for post in posts])
+        return len(posts)
+
+    def _entry(self, post):
+        config = self._engine.config
+        entry = FeedEntry(
+            post["title"], ensureUtf(post["rendered_text"]),
+            content_type="html",
+            author=post.get("user_name") or "Unknown author",
+            url=config.get("BLOGGING_SITEURL", "") + post["url"],
+            updated=post["last_modified_date"],
+            published=post["post_date"])
+        return dict(post_id=post["post_id"],
+                    published=post["post_date"].strftime(_DATE_FORMAT),
+                    updated=post["last_modified_date"].strftime(_DATE_FORMAT),
+                    xml="".join("  " + line for line in entry.generate()))
+
+    def _urls(self, tag):
+        # the URLs of the feed and of the site, absolute
+        site_url = self._engine.config.get("BLOGGING_SITEURL")
+        if tag is None:
+            feed_url = url_for("blogging.feed", _external=not site_url)
+        else:
+            feed_url = url_for("blogging.tag_feed", tag=tag.lower(),
+                               _external=not site_url)
+        if site_url:
+            return site_url + feed_url, site_url + "/"
+        return feed_url, url_for("blogging.index", _external=True)
+
+    def _read_entries(self, tag):
+        try:
+            with open(os.path.join(self.folder,
+                                   self._name(tag) + ".json")) as f:
+                return json.load(f)["entries"]
+        except (OSError, IOError, ValueError, KeyError):
+            return None
+
+    def _write(self, tag, entries):
+        config = self._engine.config
+        site_name = config.get("BLOGGING_SITENAME", "Flask-Blogging")
+        title = "%s - All Articles" % site_name if tag is None else \
+            "%s - %s" % (site_name, tag)
+        feed_url, url = self._urls(tag)
+        updated = max([datetime.datetime.strptime(e["updated"], _DATE_FORMAT)
+                       for e in entries] or [datetime.datetime.utcnow()])
+        lines = list(AtomFeed(title, feed_url=feed_url, url=url,
+                              updated=updated, generator=None).generate())
+        xml = "".join(lines[:-1] + [e["xml"] for e in entries] + lines[-1:])
+        name = self._name(tag)
+        # the XML first: a reader never sees entries it doesn't have yet
+        _write(os.path.join(self.folder, name + ".atom.xml"),
+               xml.encode("utf-8"))
+        _write(os.path.join(self.folder, name + ".json"),
+               json.dumps(dict(tag=tag, entries=entries)).encode("utf-8"))
+
+
+def _write(path, data):
+    temporary = "%s.%d.tmp" % (path, os.getpid())
+    with open(temporary, "wb") as f:
+        f.write(data)
+    os.replace(temporary, path)
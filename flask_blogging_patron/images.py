@@ -0,0 +1,262 @@
+"""
+Resized and WebP derivatives of uploaded images, and the ``<img>``
+rewriting that serves them.
+"""
+try:
+    from builtins import object
+except ImportError:
+    pass
+import hashlib
+import io
+import json
+import logging
+import os
+import re
+import threading
+try:
+    from urllib.parse import urlparse
+except ImportError:  # pragma: no cover
+    from urlparse import urlparse
+try:
+    from PIL import Image
+except ImportError:  # pragma: no cover
+    Image = None
+from .utils import FileLock
+
+
+_IMG_TAG = re.compile(r'<\s*img\s[^>]*>', re.IGNORECASE)
+_SRC_ATTR = re.compile(r'\ssrc="([^"]+)"', re.IGNORECASE)
+_FORMATS = {".jpg": "JPEG", ".jpeg": "JPEG", ".png": "PNG", ".gif": "GIF",
+            ".webp": "WEBP"}
+
+
+def lazy_images(html, derivatives=None, sizes="100vw"):
+    """
+    Rewrite the ``<img>`` tags of ``html`` to load lazily. Images with
+    derivatives in ``derivatives`` get a ``srcset`` of the resized
+    copies, their ``src`` points at the largest copy, and they are
+    wrapped in a ``<picture>`` offering the WebP copies first.
+
+    :param html: The rendered post
+    :type html: str
+    :param derivatives: (Optional) An ``ImageDerivatives`` instance
+    :type derivatives: ImageDerivatives
+    :param sizes: The ``sizes`` attribute to use with ``srcset``
+    :type sizes: str
+    :return: The rewritten HTML
+    """
+    def rewrite(match):
+        tag = match.group(0)
+        if " loading=" not in tag:
+            tag = re.sub(r'^<\s*img', '<img loading="lazy"', tag)
+        src = _SRC_ATTR.search(tag)
+        entry = derivatives.lookup(src.group(1)) \
+            if derivatives is not None and src is not None else None
+        files = [v["file"] for v in entry["variants"] if v.get("file")] \
+            if entry else None
+        if not files or " srcset=" in tag:
+            return tag
+        tag = tag.replace(src.group(0), ' src="%s" srcset="%s" sizes="%s"' %
+                          (derivatives.url(files[-1]),
+                           derivatives.srcset(entry), sizes), 1)
+        webp = derivatives.srcset(entry, webp=True)
+        if not webp:
+            return tag
+        return '<picture><source type="image/webp" srcset="%s" ' \
+               'sizes="%s">%s</picture>' % (webp, sizes, tag)
+    return _IMG_TAG.sub(rewrite, html)
+
+
+class ImageDerivatives(object):
+    """
+    Generates resized copies of uploaded images, each with a WebP
+    variant, and keeps track of them in ``manifest.json``. The copies
+    are named after the sha256 of the original, so uploading the same
+    image twice does not generate them again. Needs Pillow; without it
+    no derivatives are generated and the images are served as uploaded.
+
+    :param folder: The directory the uploads are stored in
+    :type folder: str
+    :param base_url: The URL the uploads are served from
+    :type base_url: str
+    :param widths: The widths, in pixels, to generate copies at
+    :type widths: list
+    :param quality: The JPEG and WebP quality
+    :type quality: int
+    """
+    subfolder = "derived"
+
+    def __init__(self, folder, base_url, widths=(480, 960, 1440),
+                 quality=80):
+        self.folder = os.path.join(folder, self.subfolder)
+        self.base_url = base_url.rstrip("/") + "/"
+        self.widths = sorted(widths)
+        self.quality = quality
+        self._logger = logging.getLogger(__name__)
+        self._lock = threading.Lock()
+        self._manifest = {}
+        self._manifest_mtime = None
+
+    @property
+    def available(self):
+        return Image is not None
+
+    @property
+    def manifest_path(self):
+        return os.path.join(self.folder, "manifest.json")
+
+    def url(self, filename):
+        return "%s%s/%s" % (self.base_url, self.subfolder, filename)
+
+    def manifest(self):
+        """
+        The manifest, keyed by the URL of the original upload. It is
+        re-read when another worker has written it since.
+        """
+        try:
+            mtime = os.stat(self.manifest_path).st_mtime
+        except OSError:
+            return {}
+        if mtime != self._manifest_mtime:
+            with self._lock:
+                try:
+                    with open(self.manifest_path) as f:
+                        self._manifest = json.load(f)
+                    self._manifest_mtime = mtime
+                except (OSError, ValueError) as e:
+                    self._logger.warning(str(e))
+        return self._manifest
+
+    def lookup(self, src):
+        # posts may link uploads with the site URL in front
+        return self.manifest().get(urlparse(src).path)
+
+    def srcset(self, entry, webp=False):
+        key = "webp" if webp else "file"
+        return ", ".join("%s %dw" % (self.url(v[key]), v["width"])
+                         for v in entry["variants"] if v.get(key))
+
+    def generate(self, path):
+        """
+        Generate the derivatives of the image at ``path`` and record them
+        in the manifest.
+
+        :param path: The path to the uploaded original
+        :type path: str
+        :return: The manifest entry, or ``None`` if the file is not an
+         image this can resize.
+        """
+        extension = os.path.splitext(path)[1].lower()
+        if not self.available or extension not in _FORMATS:
+            return None
+        with open(path, "rb") as f:
+            data = f.read()
+        digest = hashlib.sha256(data).hexdigest()[:16]
+        try:
+            image = Image.open(io.BytesIO(data))
+            image.load()
+        except (IOError, OSError) as e:
+            self._logger.warning("%s: %s" % (path, e))
+            return None
+        if not os.path.exists(self.folder):
+            os.makedirs(self.folder)
+        image_format = _FORMATS[extension]
+        if image_format == "GIF":
+            # animated GIFs would lose their frames
+            image_format = "PNG"
+            extension = ".png"
+        variants = []
+        for width in self.widths:
+            if width >= image.width and variants:
+                break
+            width = min(width, image.width)
+            height = max(1, image.height * width // image.width)
+            copy = None
+            variant = dict(width=width)
+            for key, fmt, ext in (("file", image_format, extension),
+                                  ("webp", "WEBP", ".webp")):
+                filename = "%s-%dw%s" % (digest, width, ext)
+                target = os.path.join(self.folder, filename)
+                if not os.path.exists(target):
+                    if copy is None:
+                        copy = image.resize((width, height), Image.LANCZOS) \
+                            if width != image.width else image.copy()
+                    try:
+                        self._save(copy, target, fmt)
+                    except (IOError, OSError, KeyError) as e:
+                        # Pillow built without WebP support
+                        self._logger.warning(str(e))
+                        continue
+                variant[key] = filename
+            variants.append(variant)
+        entry = dict(hash=digest, width=image.width, variants=variants)
+        self._update_manifest(self._original_url(path), entry)
+        return entry
+
+    def remove(self, path):
+        """
+        Forget the derivatives of a deleted upload. The files stay, other
+        uploads with the same content may still use them.
+        """
+        self._update_manifest(self._original_url(path), None)
+
+    def _original_url(self, path):
+        return self.base_url + os.path.basename(path)
+
+    def _save(self, image, target, image_format):
+        if image_format in ("JPEG", "WEBP") and image.mode not in ("RGB",
+                                                                   "RGBA"):
+            image = image.convert("RGBA" if "A" in image.mode else "RGB")
+        if image_format == "JPEG" and image.mode == "RGBA":
+            image = image.convert("RGB")
+        temporary = target + ".tmp"
+        image.save(temporary, image_format, quality=self.quality,
+                   optimize=True)
+        os.replace(temporary, target)
+
+    def _update_manifest(self, src, entry):
+        if not os.path.exists(self.folder):
+            try:
+                os.makedirs(self.folder)
+            except OSError:
+                pass  # another worker made it
+        # the workers read, change and write the manifest one at a time
+        with FileLock(self._lock,
+                      os.path.join(self.folder, ".manifest.lock")):
+            self._manifest_mtime = None
+            manifest = {}
+            if os.path.exists(self.manifest_path):
+                with open(self.manifest_path) as f:
+                    manifest = json.load(f)
+            if entry is None:
+                manifest.pop(src, None)
+            else:
+                manifest[src] = entry
+            temporary = self.manifest_path + ".tmp"
+            with open(temporary, "w") as f:
+                json.dump(manifest, f, sort_keys=True)
+            os.replace(temporary, self.manifest_path)
+
+    def install(self, storage):
+        """
+        Generate derivatives whenever ``storage``, a ``flask_fileupload``
+        ``LocalStorage``, stores or deletes a file.
+        """
+        store, delete = storage.store, storage.delete
+
+        def store_with_derivatives(filename, file_data):
+            filename = store(filename, file_data)
+            path = os.path.join(storage.abs_img_folder, filename)
+            try:
+                self.generate(path)
+            except Exception as e:
+                # the upload itself succeeded
+                self._logger.exception(str(e))
+            return filename
+
+        def delete_with_derivatives(filename):
+            delete(filename)
+            self.remove(filename)
+
+        storage.store = store_with_derivatives
+        storage.delete = delete_with_derivatives
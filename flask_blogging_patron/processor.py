@@ -1,4 +1,9 @@
+import copy
+import hashlib
 import re
+import threading
+from html import unescape
+from html.parser import HTMLParser
 try:
     from builtins import object
 except ImportError:
@@ -8,6 +13,7 @@ from markdown.extensions.meta import MetaExtension
 from flask import url_for
 from flask_login import current_user
 from slugify import slugify
+from .images import lazy_images
 
 
 class MathJaxPattern(markdown.inlinepatterns.Pattern):
@@ -34,9 +40,88 @@ def makeExtension(configs=[]):
     return MathJaxExtension(configs)
 
 
+_VOID_ELEMENTS = frozenset(["area", "base", "br", "col", "embed", "hr", "img",
+                            "input", "link", "meta", "source", "track",
+                            "wbr"])
+_WORDS_BEFORE_CUT = re.compile(r"(.*\s)\S*$", re.DOTALL)
+
+
+class _Teaser(HTMLParser):
+    """
+    Copies HTML until ``length`` characters of text were copied, cutting
+    the text at a word and closing the elements left open, so the teaser
+    is well formed. Collects the plain text on the way.
+    """
+
+    def __init__(self, length):
+        HTMLParser.__init__(self, convert_charrefs=False)
+        self.length = length
+        self.html = []
+        self.text = []
+        self._open = []
+        self._size = 0
+        self.cut = False
+
+    def handle_starttag(self, tag, attrs):
+        if not self.cut:
+            self.html.append(self.get_starttag_text())
+            self.text.append(" ")
+            if tag not in _VOID_ELEMENTS:
+                self._open.append(tag)
+
+    def handle_startendtag(self, tag, attrs):
+        if not self.cut:
+            self.html.append(self.get_starttag_text())
+
+    def handle_endtag(self, tag):
+        if not self.cut and tag in self._open:
+            while self._open.pop() != tag:
+                pass
+            self.html.append("</%s>" % tag)
+            self.text.append(" ")
+
+    def handle_data(self, data):
+        self._text(data, data)
+
+    def handle_entityref(self, name):
+        self._text("&%s;" % name, unescape("&%s;" % name))
+
+    def handle_charref(self, name):
+        self._text("&#%s;" % name, unescape("&#%s;" % name))
+
+    def _text(self, html, text):
+        if self.cut:
+            return
+        remaining = self.length - self._size
+        if len(text) > remaining:
+            head = text[:remaining]
+            if not text[remaining].isspace():
+                # drop the word cut in half, unless it is longer than the
+                # whole excerpt
+                words = _WORDS_BEFORE_CUT.match(head)
+                head = words.group(1) if words else "" if self._size else head
+            html = text = head.rstrip() + u"\u2026"
+            self.cut = True
+        self.html.append(html)
+        self.text.append(text)
+        self._size += len(text)
+
+    def teaser(self):
+        return "".join(self.html) + \
+            "".join("</%s>" % tag for tag in reversed(self._open))
+
+
 class PostProcessor(object):
 
     _markdown_extensions = [MathJaxExtension(), MetaExtension()]
+    # bump when a change here alters the HTML rendered for stored posts
+    renderer_version = 3
+    # characters of text in the excerpt shown by post listings
+    excerpt_length = 500
+    # per thread Markdown instances, see ``markdown``
+    _local = threading.local()
+    # the ``ImageDerivatives`` the ``<img>`` tags are rewritten to use
+    _image_derivatives = None
 
     @staticmethod
     def create_slug(title):
@@ -47,18 +132,113 @@ class PostProcessor(object):
         regex = re.compile(r'<\s*img [^>]*src="([^"]+)')
         return regex.findall(post["rendered_text"])
 
+    @classmethod
+    def get_slug(cls, post):
+        """
+        The slug stored with the post, or made from its title for posts
+        stored without one.
+        """
+        return post.get("slug") or cls.create_slug(post["title"])
+
     @classmethod
     def construct_url(cls, post):
         url = url_for("blogging.page_by_id", post_id=post["post_id"],
-                      slug=cls.create_slug(post["title"]))
+                      slug=cls.get_slug(post))
         return url
 
+    @classmethod
+    def markdown(cls):
+        """
+        Returns a ``Markdown`` instance configured with ``all_extensions``,
+        ready to convert a new document. Building one registers every
+        pattern and processor of every extension, so each thread keeps
+        its instance and resets it between documents instead. Neither
+        Markdown instances nor the extensions (which hold on to the
+        instance they extend) are thread safe, so every thread gets its
+        own copies.
+        """
+        extensions = cls.all_extensions()
+        instances = getattr(cls._local, "instances", None)
+        if instances is None:
+            instances = cls._local.instances = {}
+        cached = instances.get(cls)
+        # rebuild if extensions were added since
+        if cached is None or cached[0] != extensions:
+            md = markdown.Markdown(
+                extensions=[copy.copy(e) for e in extensions])
+            instances[cls] = (list(extensions), md)
+            return md
+        md = cached[1]
+        md.reset()
+        return md
+
     @classmethod
     def render_text(cls, post):
-        md = markdown.Markdown(extensions=cls.all_extensions())
+        md = cls.markdown()
         post["rendered_text"] = md.convert(post["text"])
         post["meta"] = md.Meta
 
+    @classmethod
+    def excerpt(cls, html):
+        """
+        The beginning of the rendered post ``html``, for listings.
+
+        :param html: The rendered post
+        :type html: str
+        :return: The plain text of the first ``excerpt_length`` characters
+         and the HTML teaser holding them
+        """
+        parser = _Teaser(cls.excerpt_length)
+        parser.feed(html)
+        parser.close()
+        text = " ".join("".join(parser.text).split())
+        if parser.cut:
+            text = text[:-1].rstrip() + u"\u2026"
+        return text, parser.teaser()
+
+    @classmethod
+    def render(cls, post):
+        """
+        Renders the post text to HTML and fills in ``rendered_text``,
+        ``meta`` (with the ``images``), the ``excerpt`` and
+        ``rendered_excerpt`` of listings, and ``render_version``.
+
+        :param post: Dictionary representing the post
+        :type post: dict
+        """
+        cls.render_text(post)
+        post["meta"]["images"] = cls.extract_images(post)
+        post["rendered_text"] = lazy_images(post["rendered_text"],
+                                            cls._image_derivatives)
+        post["excerpt"], post["rendered_excerpt"] = \
+            cls.excerpt(post["rendered_text"])
+        post["render_version"] = cls.render_version()
+
+    @classmethod
+    def render_version(cls):
+        """
+        A stamp identifying the renderer: the ``renderer_version``, the
+        Markdown version and the extension set. Stored renderings with a
+        different stamp are stale.
+        """
+        extensions = ",".join("%s.%s" % (type(e).__module__, type(e).__name__)
+                              for e in cls.all_extensions())
+        stamp = "%s|%s|%s|%s|%s" % (cls.renderer_version,
+                                    markdown.__version__, extensions,
+                                    cls._image_derivatives is not None,
+                                    cls.excerpt_length)
+        return hashlib.sha1(stamp.encode("utf-8")).hexdigest()[:16]
+
+    @classmethod
+    def is_rendered(cls, post):
+        """
+        Whether the post carries a rendering made by the current renderer:
+        the full one, or the excerpt of a summary (see
+        ``Storage.SUMMARY_FIELDS``).
+        """
+        return ("rendered_text" in post or "rendered_excerpt" in post) and \
+            post.get("render_version") == cls.render_version()
+
     @classmethod
     def is_author(cls, post, user):
         return user.get_id() == u''+str(post['user_id'])
@@ -71,18 +251,21 @@ class PostProcessor(object):
         :param render:
         :return:
         """
-        post["slug"] = cls.create_slug(post["title"])
+        post["slug"] = cls.get_slug(post)
         post["editable"] = cls.is_author(post, current_user)
         post["url"] = cls.construct_url(post)
         post["priority"] = 0.8
-        if render:
-            cls.render_text(post)
-            post["meta"]["images"] = cls.extract_images(post)
+        if render and not cls.is_rendered(post):
+            cls.render(post)
 
     @classmethod
     def all_extensions(cls):
         return cls._markdown_extensions
 
+    @classmethod
+    def set_image_derivatives(cls, derivatives):
+        cls._image_derivatives = derivatives
+
     @classmethod
     def set_custom_extensions(cls, extensions):
         if type(extensions) == list:
@@ -111,6 +111,33 @@ Signal sent after posts by an author were fetched and processed
 :type meta: dict
 """)
 
+search_posts_fetched = signals.signal("search_posts_fetched", doc="""\
+Signal sent after the posts matching a search were fetched but before
+processing
+
+:param app: The Flask app which is the sender
+:type app: object
+:param engine: The blogging engine that was initialized
+:type engine: object
+:param posts: Lists of post matching the search, best match first
+:type posts: list
+:param meta: The metadata associated with that page
+:type meta: dict
+""")
+
+search_posts_processed = signals.signal("search_posts_processed", doc="""\
+Signal sent after the posts matching a search were fetched and processed
+
+:param app: The Flask app which is the sender
+:type app: object
+:param engine: The blogging engine that was initialized
+:type engine: object
+:param posts: Lists of post matching the search, fetched and processed
+:type posts: list
+:param meta: The metadata associated with that page
+:type meta: dict
+""")
+
 index_posts_fetched = signals.signal("index_posts_fetched", doc="""\
 Signal sent after the posts for the index page are fetched
 
@@ -3,18 +3,122 @@ try:
 except ImportError:
     pass
 from collections import defaultdict, OrderedDict
+import json
+import re
 import sys
+import time
 import logging
 import sqlalchemy as sqla
+from sqlalchemy.dialects import postgresql
 from sqlalchemy.ext.automap import automap_base
 import datetime
+from flask import g, has_request_context, session
 from .storage import Storage
 from .signals import sqla_initialized
+from .utils import decode_cursor, CURSOR_AFTER
 
 this = sys.modules[__name__]
 this.Post = None
 this.Tag = None
 
+# joins aggregated tag texts; tags are split on commas by the editor, so
+# use a control character that can never be typed into a tag
+_TAG_SEPARATOR = "\x1f"
+
+# the optional post fields of get_posts and the columns holding them
+_OPTIONAL_POST_COLUMNS = (("text", "text"),
+                          ("rendered_text", "rendered_text"),
+                          ("meta", "rendered_meta"),
+                          ("excerpt", "excerpt"),
+                          ("rendered_excerpt", "rendered_excerpt"))
+
+# dialects with a full-text index behind search_posts
+_SEARCH_DIALECTS = ("sqlite", "postgresql")
+
+# session key holding the time until which reads go to the primary
+_PRIMARY_UNTIL_KEY = "blogging_primary_until"
+
+# pragmas applied to every new SQLite connection by apply_sqlite_profile.
+# WAL lets readers run alongside the single writer, busy_timeout makes
+# writers queue for the lock instead of failing with "database is locked".
+SQLITE_PRAGMAS = OrderedDict([
+    ("journal_mode", "WAL"),
+    ("synchronous", "NORMAL"),
+    ("busy_timeout", 15000),
+    ("mmap_size", 256 * 1024 * 1024),
+    ("cache_size", -16000),
+    ("temp_store", "MEMORY"),
+])
+
+
+def apply_sqlite_profile(engine, pragmas=None, optimize_interval=3600):
+    """
+    Tune a SQLite engine for concurrent use by several workers. The
+    ``SQLITE_PRAGMAS`` (updated with ``pragmas``) are set on every new
+    connection, the database is analyzed once if it never was, and
+    ``PRAGMA optimize`` runs on returned connections at most every
+    ``optimize_interval`` seconds. Other databases are left alone, and a
+    profiled engine is not profiled twice.
+
+    :param engine: The SQLAlchemy engine
+    :type engine: object
+    :param pragmas: (Optional) Pragma overrides; ``None`` values drop a
+     pragma from the profile
+    :type pragmas: dict
+    :param optimize_interval: (Optional) Seconds between ``PRAGMA
+     optimize`` runs (default 3600)
+    :type optimize_interval: int
+    :return: ``True`` if the profile was applied
+    """
+    if engine.dialect.name != "sqlite" or \
+            getattr(engine, "_blogging_sqlite_profile", False):
+        return False
+    profile = OrderedDict(SQLITE_PRAGMAS)
+    profile.update(pragmas or {})
+    statements = ["PRAGMA %s = %s" % (name, value)
+                  for name, value in profile.items() if value is not None]
+    state = {"analyzed": False, "optimized": time.time()}
+
+    def on_connect(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for statement in statements:
+                cursor.execute(statement)
+            if not state["analyzed"]:
+                state["analyzed"] = True
+                cursor.execute("SELECT 1 FROM sqlite_master "
+                               "WHERE name = 'sqlite_stat1'")
+                if cursor.fetchone() is None:
+                    cursor.execute("ANALYZE")
+        finally:
+            cursor.close()
+
+    def on_checkin(dbapi_connection, connection_record):
+        if dbapi_connection is None or \
+                time.time() - state["optimized"] < optimize_interval:
+            return
+        state["optimized"] = time.time()
+        try:
+            dbapi_connection.cursor().execute("PRAGMA optimize")
+        except Exception as e:
+            SQLAStorage._logger.warning("PRAGMA optimize failed: %s" % e)
+
+    sqla.event.listen(engine, "connect", on_connect)
+    sqla.event.listen(engine, "checkin", on_checkin)
+    engine._blogging_sqlite_profile = True
+    return True
+
+
+def _chunks(iterable, size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
 
 def _as_int(s):
     try:
@@ -32,9 +136,12 @@ class SQLAStorage(Storage):
     """
     _db = None
     _logger = logging.getLogger("flask-blogging")
+    # text search configuration used for the PostgreSQL index
+    _search_language = "english"
 
     def __init__(self, engine=None, table_prefix="", metadata=None, db=None,
-                 bind=None):
+                 bind=None, lazy=False, read_bind=None, read_engine=None,
+                 sqlite_profile=False):
         """
         The constructor for the ``SQLAStorage`` class.
 
@@ -52,36 +159,86 @@ class SQLAStorage(Storage):
         :param bind: (Optional) Reference the database to bind for multiple
         database scenario with binds
         :type bind: str
+        :param lazy: (Optional) Declare the tables statically instead of
+         reflecting and creating them, and only automap ``post_model`` and
+         ``tag_model`` when they are first used. The schema must then be
+         created by migrations (or ``metadata.create_all``). This keeps the
+         constructor free of database round trips. Otherwise the missing
+         tables are created; existing tables are never altered, that is
+         left to the migrations. (default ``False``)
+        :type lazy: bool
+        :param read_bind: (Optional) The Flask-SQLAlchemy bind of a read
+         replica. Post reads are sent there, writes go to ``bind``.
+        :type read_bind: str
+        :param read_engine: (Optional) The engine of a read replica, when
+         ``db`` is not used.
+        :type read_engine: object
+        :param sqlite_profile: (Optional) Apply ``apply_sqlite_profile`` to
+         the storage engines if they are SQLite. Pass a dict to override
+         pragmas. (default ``False``)
+        :type sqlite_profile: bool or dict
         """
         self._bind = bind
         if db:
             self._engine = db.get_engine(db.get_app(), bind=self._bind)
+            self._read_engine = self._engine if read_bind is None else \
+                db.get_engine(db.get_app(), bind=read_bind)
             self._metadata = db.metadata
         else:
             if engine is None:
                 raise ValueError("Both db and engine args cannot be None")
             self._engine = engine
+            self._read_engine = read_engine or engine
             self._metadata = metadata or sqla.MetaData()
+        if sqlite_profile:
+            pragmas = sqlite_profile if isinstance(sqlite_profile, dict) \
+                else None
+            apply_sqlite_profile(self._engine, pragmas)
+            apply_sqlite_profile(self._read_engine, pragmas)
         self._info = {} if self._bind is None else {"bind_key": self._bind}
         self._table_prefix = table_prefix
+        # tag text -> id, shared by every save in this process
+        self._tag_ids = {}
+        # statement templates by shape, and their compiled forms, so that
+        # hot reads only bind parameters
+        self._statements = {}
+        self._compiled_cache = sqla.util.LRUCache(100)
+
+        self._Base = None
+        self._search_dialect = self._engine.dialect.name \
+            if self._engine.dialect.name in _SEARCH_DIALECTS else None
+        self._search_index_checked = False
+
+        if lazy:
+            self._declare_all_tables()
+        else:
+            # a new database gets the whole schema; the tables of an
+            # existing one are only changed by the migrations, never by
+            # workers booting at the same time
+            self._metadata.reflect(bind=self._engine)
+            counts_existed = self._table_name("post_counts") in \
+                self._metadata.tables
+            self._declare_all_tables()
+            self._metadata.create_all(bind=self._engine,
+                                      tables=self.all_tables)
+            self._check_schema(counts_existed)
+            self._automap()
 
-        self._metadata.reflect(bind=self._engine)
-        self._create_all_tables()
+        sqla_initialized.send(self, engine=self._engine,
+                              table_prefix=self._table_prefix,
+                              meta=self.metadata,
+                              bind=self._bind)
 
+    def _automap(self):
         # automap base and restrict to the required tables here.
         table_suffix = ['post', 'tag', 'user_posts', 'tag_posts']
         table_names = [self._table_name(t) for t in table_suffix]
-        self._metadata.create_all(bind=self._engine, tables=self.all_tables)
         meta = sqla.MetaData()
         meta.reflect(bind=self._engine, only=table_names)
         self._Base = automap_base(metadata=meta)
         self._Base.prepare()
         self._inject_models()
-
-        sqla_initialized.send(self, engine=self._engine,
-                              table_prefix=self._table_prefix,
-                              meta=self.metadata,
-                              bind=self._bind)
+        return self._Base
 
     def _inject_models(self):
         global this
@@ -90,6 +247,10 @@ class SQLAStorage(Storage):
         this.Tag = getattr(self._Base.classes, self._table_name("tag"))
         this.Tag.__name__ = 'Tag'
 
+    @property
+    def automap_base(self):
+        return self._Base or self._automap()
+
     @property
     def metadata(self):
         return self._metadata
@@ -100,11 +261,11 @@ class SQLAStorage(Storage):
 
     @property
     def post_model(self):
-        return getattr(self._Base.classes, self._table_name("post"))
+        return getattr(self.automap_base.classes, self._table_name("post"))
 
     @property
     def tag_model(self):
-        return getattr(self._Base.classes, self._table_name("tag"))
+        return getattr(self.automap_base.classes, self._table_name("tag"))
 
     @property
     def tag_table(self):
@@ -118,18 +279,60 @@ class SQLAStorage(Storage):
     def user_posts_table(self):
         return self._user_posts_table
 
+    @property
+    def post_counts_table(self):
+        return self._post_counts_table
+
+    @property
+    def post_search_table(self):
+        return self._post_search_table
+
     @property
     def all_tables(self):
-        return [self._post_table, self._tag_table,
-                self._user_posts_table, self._tag_posts_table]
+        tables = [self._post_table, self._tag_table,
+                  self._user_posts_table, self._tag_posts_table,
+                  self._post_counts_table]
+        if self._post_search_table is not None:
+            tables.append(self._post_search_table)
+        return tables
 
     @property
     def engine(self):
         return self._engine
 
+    @property
+    def read_engine(self):
+        return self._read_engine
+
+    @property
+    def _reader(self):
+        """
+        The engine post reads go to: the read replica, unless the current
+        client has written recently and must see its own writes.
+        """
+        if self._read_engine is self._engine:
+            return self._engine
+        if has_request_context() and \
+                session.get(_PRIMARY_UNTIL_KEY, 0) > time.time():
+            return self._engine
+        return self._read_engine
+
+    def read_from_primary(self, seconds):
+        """
+        Send the current client's reads to the primary for the next
+        ``seconds``, so a post it just saved does not go missing while the
+        replica catches up. The deadline is kept in the session, so it
+        holds whichever worker serves the next request.
+
+        :param seconds: Length of the read-your-writes window
+        :type seconds: float
+        """
+        if self._read_engine is not self._engine and has_request_context():
+            session[_PRIMARY_UNTIL_KEY] = time.time() + seconds
+
     def save_post(self, title, text, user_id, tags, draft=False,
                   post_date=None, last_modified_date=None, meta_data=None,
-                  post_id=None):
+                  post_id=None, slug=None):
         """
         Persist the blog post data. If ``post_id`` is ``None`` or ``post_id``
         is invalid, the post must be inserted into the storage. If ``post_id``
@@ -156,6 +359,9 @@ class SQLAStorage(Storage):
          for an insert call,
          and a valid value for update. (default ``None``)
         :type post_id: str
+        :param slug: (Optional) The slug of the post URLs, stored in the
+         indexed ``slug`` column. (default ``create_slug(title)``)
+        :type slug: str
 
         :return: The post_id value, in case of a successful insert or update.
          Return ``None`` if there were errors.
@@ -167,22 +373,30 @@ class SQLAStorage(Storage):
         post_date = post_date if post_date is not None else current_datetime
         last_modified_date = last_modified_date if last_modified_date is not \
             None else current_datetime
+        slug = slug if slug is not None else self.create_slug(title)
+        self._ensure_search_index()
 
         with self._engine.begin() as conn:
             try:
+                old_buckets = []
                 if post_id is not None:  # validate post_id
                     exists_statement = sqla.select([self._post_table]).where(
                         self._post_table.c.id == post_id)
                     exists = \
                         conn.execute(exists_statement).fetchone() is not None
                     post_id = post_id if exists else None
+                if post_id is not None:
+                    old_buckets = self._get_count_buckets(post_id, conn)
                 post_statement = \
                     self._post_table.insert() if post_id is None else \
                     self._post_table.update().where(
                         self._post_table.c.id == post_id)
                 post_statement = post_statement.values(
-                    title=title, text=text, post_date=post_date,
-                    last_modified_date=last_modified_date, draft=draft
+                    title=title, slug=slug, text=text, post_date=post_date,
+                    last_modified_date=last_modified_date, draft=draft,
+                    # the text may have changed, render it again
+                    rendered_text=None, rendered_meta=None, excerpt=None,
+                    rendered_excerpt=None, render_version=None
                 )
 
                 post_result = conn.execute(post_statement)
@@ -190,12 +404,143 @@ class SQLAStorage(Storage):
                     if post_id is None else post_id
                 self._save_tags(tags, post_id, conn)
                 self._save_user_post(user_id, post_id, conn)
+                self._update_counts(
+                    old_buckets, self._get_count_buckets(post_id, conn), conn)
+                self._index_posts([(post_id, title, text)], conn,
+                                  replace=not new_post)
 
             except Exception as e:
                 self._logger.exception(str(e))
                 post_id = None
         return post_id
 
+    def _read_failed(self, e):
+        """
+        Logs a failed read, which then returns no posts. While a cached
+        view is rendered again in the background, the error is raised
+        instead, so that the stale copy is kept rather than replaced with
+        an empty page.
+        """
+        self._logger.exception(str(e))
+        if has_request_context() and g.get("blogging_raise_read_errors"):
+            raise e
+
+    def _template(self, key, build):
+        """
+        Returns the statement template stored under ``key``, building it
+        with ``build()`` on first use. Templates take their values as bind
+        parameters, so one instance serves every call of the same shape.
+        """
+        statement = self._statements.get(key)
+        if statement is None:
+            statement = self._statements[key] = build()
+        return statement
+
+    def _execute(self, conn, statement, **params):
+        # reusing the same statement object lets SQLAlchemy find its
+        # compiled form in the cache instead of compiling it again
+        return conn.execution_options(
+            compiled_cache=self._compiled_cache).execute(statement, params)
+
+    def _fetch_posts_with_tags(self, conn, post_statement, recent=True,
+                               **params):
+        """
+        Runs ``post_statement`` (which selects and orders the posts) joined
+        with the tag and user information. Where the dialect can aggregate
+        the tags, one row per post comes back; otherwise there is one row
+        per post/tag pairing that is folded back together here. Outer joins
+        keep posts that have no tag or no user.
+        """
+        statement, aggregated = self._posts_with_tags_statement(
+            post_statement, recent)
+        return self._run_posts_with_tags(conn, statement, aggregated,
+                                         **params)
+
+    def _run_posts_with_tags(self, conn, statement, aggregated, **params):
+        rows = self._execute(conn, statement, **params).fetchall()
+        if aggregated:
+            return self._serialise_posts_from_aggregated_rows(rows)
+        return self._serialise_posts_and_tags_from_joined_rows(rows)
+
+    def _posts_with_tags_statement(self, post_statement, recent=True,
+                                   fields=None):
+        """
+        Builds the statement run by ``_fetch_posts_with_tags``. Returns it
+        along with whether its rows carry aggregated tags. ``fields`` are
+        the optional fields to select, as for ``get_posts``; the columns
+        holding them must be selected by ``post_statement``.
+        """
+        post = post_statement.alias('post')
+        tag_posts = self._tag_posts_table
+        tag = self._tag_table
+        user_posts = self._user_posts_table
+        joined = post.outerjoin(tag_posts, tag_posts.c.post_id == post.c.id) \
+            .outerjoin(tag, tag.c.id == tag_posts.c.tag_id) \
+            .outerjoin(user_posts, user_posts.c.post_id == post.c.id)
+        optional = self._optional_columns(fields)
+        post_columns = [post.c.id, post.c.title, post.c.slug,
+                        post.c.post_date, post.c.last_modified_date,
+                        post.c.draft, post.c.render_version] + \
+            [post.c[name] for name in optional] + [user_posts.c.user_id]
+        labels = ["post_id", "post_title", "post_slug", "post_post_date",
+                  "post_last_modified_date", "post_draft",
+                  "post_render_version"] + \
+            ["post_" + name for name in optional] + ["user_posts_user_id"]
+        columns = [column.label(label)
+                   for column, label in zip(post_columns, labels)]
+        ordering = self._post_ordering(post.c.post_date, post.c.id, recent)
+
+        tag_aggregate = self._tag_aggregate(tag.c.text)
+        if tag_aggregate is None:
+            statement = sqla.select(columns + [tag.c.text.label("tag_text")])
+            statement = statement.select_from(joined).order_by(*ordering)
+            return statement, False
+
+        statement = sqla.select(columns + [tag_aggregate.label("tag_texts")])
+        statement = statement.select_from(joined).group_by(*post_columns) \
+            .order_by(*ordering)
+        return statement, True
+
+    @staticmethod
+    def _optional_columns(fields):
+        return [column for field, column in _OPTIONAL_POST_COLUMNS
+                if fields is None or field in fields]
+
+    def _post_columns(self, fields):
+        # the post table columns get_posts reads for ``fields``
+        post = self._post_table
+        return [post.c.id, post.c.title, post.c.slug, post.c.post_date,
+                post.c.last_modified_date, post.c.draft,
+                post.c.render_version] + \
+            [post.c[name] for name in self._optional_columns(fields)]
+
+    def _tag_aggregate(self, tag_column):
+        dialect = self._engine.dialect.name
+        if dialect == "sqlite":
+            return sqla.func.group_concat(tag_column, _TAG_SEPARATOR)
+        if dialect == "postgresql":
+            return sqla.func.array_agg(tag_column)
+        return None
+
+    @classmethod
+    def _serialise_posts_from_aggregated_rows(cls, rows):
+        """
+        Translates rows that carry all the tags of a post in a single
+        aggregated column into the dictionary format expected by
+        flask-blogging.
+        """
+        posts = []
+        for row in rows:
+            tags = row.tag_texts
+            if tags is None:
+                tags = []
+            elif isinstance(tags, str):
+                tags = tags.split(_TAG_SEPARATOR)
+            post = cls._serialise_post_from_joined_row(row)
+            post["tags"] = [t for t in tags if t is not None]
+            posts.append(post)
+        return posts
+
     @classmethod
     def _serialise_posts_and_tags_from_joined_rows(cls, joined_rows):
         """
@@ -209,26 +554,37 @@ class SQLAStorage(Storage):
             post_id = joined_row.post_id
             post = cls._serialise_post_from_joined_row(joined_row)
             posts_by_id[post_id] = post
-            tags_by_post_id[post_id].append(joined_row.tag_text)
+            if joined_row.tag_text is not None:
+                tags_by_post_id[post_id].append(joined_row.tag_text)
 
         for id, post in posts_by_id.items():
-            tags = tags_by_post_id.get(id)
-            if tags:
-                post["tags"] = tags
+            post["tags"] = tags_by_post_id.get(id, [])
 
         return [post for post in posts_by_id.values()]
 
     @staticmethod
     def _serialise_post_from_joined_row(joined_row):
-        return dict(
+        post = dict(
             post_id=joined_row.post_id,
             title=joined_row.post_title,
-            text=joined_row.post_text,
+            slug=joined_row.post_slug,
             post_date=joined_row.post_post_date,
             last_modified_date=joined_row.post_last_modified_date,
             draft=joined_row.post_draft,
             user_id=joined_row.user_posts_user_id
         )
+        # only the fields that were selected
+        keys = joined_row.keys()
+        if "post_text" in keys:
+            post["text"] = joined_row.post_text
+        if joined_row.post_render_version is not None:
+            post["render_version"] = joined_row.post_render_version
+            for field, column in _OPTIONAL_POST_COLUMNS[1:]:
+                if "post_" + column in keys:
+                    post[field] = joined_row["post_" + column]
+            if "meta" in post:
+                post["meta"] = json.loads(post["meta"])
+        return post
 
     def get_post_by_id(self, post_id):
         """
@@ -241,32 +597,68 @@ class SQLAStorage(Storage):
         """
         r = None
         post_id = _as_int(post_id)
-        with self._engine.begin() as conn:
+        statement, aggregated = self._template(
+            ("post_by_id",), self._build_post_by_id_statement)
+        with self._reader.begin() as conn:
             try:
-                post_statement = sqla.select([self._post_table]) \
-                    .where(self._post_table.c.id == post_id) \
-                    .alias('post')
-
-                joined_statement = post_statement.join(self._tag_posts_table) \
-                    .join(self._tag_table) \
-                    .join(self._user_posts_table) \
-                    .alias('join')
-
-                # Note this will retrieve one row per tag
-                all_rows = conn.execute(
-                    sqla.select([joined_statement])
-                ).fetchall()
-                r = self._serialise_posts_and_tags_from_joined_rows(
-                    all_rows
-                )[0]
+                posts = self._run_posts_with_tags(conn, statement, aggregated,
+                                                  post_id=post_id)
+                r = posts[0] if posts else None
 
             except Exception as e:
-                self._logger.exception(str(e))
+                self._read_failed(e)
+                r = None
+        return r
+
+    def get_posts_by_ids(self, post_ids):
+        """
+        Fetch the whole blog posts given by ``post_ids`` with one query.
+
+        :param post_ids: The post identifiers
+        :type post_ids: iterable
+        :return: A list of the posts found, in no particular order
+        """
+        result = []
+        post_ids = [_as_int(post_id) for post_id in post_ids]
+        if not post_ids:
+            return result
+        statement = sqla.select([self._post_table]).where(
+            self._post_table.c.id.in_(post_ids))
+        with self._reader.begin() as conn:
+            try:
+                result = self._fetch_posts_with_tags(conn, statement)
+            except Exception as e:
+                self._read_failed(e)
+                result = []
+        return result
+
+    def get_post_by_slug(self, slug):
+        """
+        Fetch the published blog post stored with ``slug``, through the
+        index on the ``slug`` column. Titles, and so slugs, may repeat;
+        the post with the lowest id is returned.
+
+        :param slug: The slug of the blog post
+        :type slug: str
+        :return: The post data, or ``None`` if no published post has the
+         slug.
+        """
+        r = None
+        statement, aggregated = self._template(
+            ("post_by_slug",), self._build_post_by_slug_statement)
+        with self._reader.begin() as conn:
+            try:
+                posts = self._run_posts_with_tags(conn, statement, aggregated,
+                                                  slug=slug)
+                r = posts[0] if posts else None
+            except Exception as e:
+                self._read_failed(e)
                 r = None
         return r
 
     def get_posts(self, count=10, offset=0, recent=True, tag=None,
-                  user_id=None, include_draft=False):
+                  user_id=None, include_draft=False, cursor=None,
+                  fields=None):
         """
         Get posts given by filter criteria
 
@@ -282,6 +674,16 @@ class SQLAStorage(Storage):
         :type user_id: str
         :param include_draft: Whether to include posts marked as draft or not
         :type include_draft: bool
+        :param cursor: (Optional) An opaque cursor built by
+         ``utils.encode_cursor``. When given, ``offset`` is ignored and the
+         page starts right after (or ends right before) the keyed post.
+        :type cursor: str
+        :param fields: (Optional) The fields to load besides ``post_id``,
+         ``title``, ``user_id``, ``tags``, ``draft``, the dates and
+         ``render_version``: any of ``text``, ``rendered_text``, ``meta``,
+         ``excerpt`` and ``rendered_excerpt``. Only their columns are
+         read. All of them if ``None``.
+        :type fields: iterable
 
         :return: A list of posts, with each element a dict containing values
          for the following keys: (title, text, draft, post_date,
@@ -289,46 +691,31 @@ class SQLAStorage(Storage):
          returned.
         """
         user_id = str(user_id) if user_id else user_id
-
-        with self._engine.begin() as conn:
+        cursor = decode_cursor(cursor)
+        params = dict(tag=self.normalize_tag(tag) if tag else None,
+                      user_id=user_id, count=count, offset=offset)
+
+        # seeking backwards walks the index in the opposite direction; the
+        # outer query restores the listing order
+        descending = recent
+        if cursor is not None:
+            direction, params["cursor_date"], params["cursor_id"] = cursor
+            descending = recent == (direction == CURSOR_AFTER)
+            seek = "cursor"
+        else:
+            seek = "offset" if offset else None
+        key = ("posts", bool(tag), bool(user_id), bool(include_draft),
+               bool(count), seek, descending, recent,
+               None if fields is None else tuple(sorted(set(fields))))
+        statement, aggregated = self._template(
+            key, lambda: self._build_posts_statement(*key[1:]))
+
+        with self._reader.begin() as conn:
             try:
-                # post_statement ensures the correct posts are selected
-                # in the correct order
-                post_statement = sqla.select([self._post_table])
-                post_filter = self._get_filter(
-                    tag, user_id, include_draft, conn
-                )
-
-                if post_filter is not None:
-                    post_statement = post_statement.where(post_filter)
-                if count:
-                    post_statement = post_statement.limit(count)
-                if offset:
-                    post_statement = post_statement.offset(offset)
-
-                post_ordering = \
-                    sqla.desc(self._post_table.c.post_date) if recent \
-                    else self._post_table.c.post_date
-                post_statement = post_statement.order_by(post_ordering)
-                post_statement = post_statement.alias('post')
-
-                # joined_statement ensures other data is retrieved
-                joined_statement = post_statement.join(self._tag_posts_table) \
-                    .join(self._tag_table) \
-                    .join(self._user_posts_table) \
-                    .alias('join')
-
-                joined_ordering = \
-                    sqla.desc(joined_statement.c.post_post_date) if recent \
-                    else joined_statement.c.post_post_date
-
-                joined_statement = sqla.select([joined_statement]) \
-                    .order_by(joined_ordering)
-                all_rows = conn.execute(joined_statement).fetchall()
-                result = \
-                    self._serialise_posts_and_tags_from_joined_rows(all_rows)
+                result = self._run_posts_with_tags(conn, statement,
+                                                   aggregated, **params)
             except Exception as e:
-                self._logger.exception(str(e))
+                self._read_failed(e)
                 result = []
 
         return result
@@ -346,19 +733,512 @@ class SQLAStorage(Storage):
         :return: The number of posts for the given filter.
         """
         result = 0
+        tag, user_id, draft = self._count_key(tag, user_id, include_draft)
+        count_statement = self._template(
+            ("count",), self._build_count_statement)
+        with self._reader.begin() as conn:
+            try:
+                # counters are maintained by save_post and delete_post, so
+                # this is a single primary key lookup
+                result = self._execute(conn, count_statement, tag=tag,
+                                       user_id=user_id, draft=draft) \
+                    .scalar() or 0
+            except Exception as e:
+                self._read_failed(e)
+                result = 0
+        return result
+
+    def get_last_modified(self, post_id=None, tag=None, user_id=None,
+                          include_draft=False):
+        """
+        Returns the latest ``last_modified_date`` of the posts matching the
+        filter, or of the post ``post_id``. Only the date column is read,
+        through the ``(draft, last_modified_date)`` index when there is no
+        tag or user filter.
+
+        :param post_id: (Optional) The post identifier
+        :type post_id: str
+        :param tag: Filter by a specific tag
+        :type tag: str
+        :param user_id: Filter by a specific user
+        :type user_id: str
+        :param include_draft: Whether to include posts marked as draft or not
+        :type include_draft: bool
+        :return: The date, or ``None`` if no post matches.
+        """
+        result = None
+        user_id = str(user_id) if user_id else user_id
+        key = ("last_modified", post_id is not None, bool(tag),
+               bool(user_id), bool(include_draft))
+        statement = self._template(
+            key, lambda: self._build_last_modified_statement(*key[1:]))
+        with self._reader.begin() as conn:
+            try:
+                result = self._execute(
+                    conn, statement, post_id=_as_int(post_id),
+                    tag=self.normalize_tag(tag) if tag else None,
+                    user_id=user_id).scalar()
+            except Exception as e:
+                self._read_failed(e)
+                result = None
+        return result
+
+    def iter_sitemap_posts(self, first_id=None, last_id=None,
+                           chunk_size=1000):
+        """
+        Yields the ``post_id``, ``title``, ``slug`` and
+        ``last_modified_date`` of the published posts, by increasing id.
+        Only those columns are read, ``chunk_size`` posts at a time by
+        seeking on the id.
+
+        :param first_id: (Optional) The lowest post id to yield
+        :type first_id: int
+        :param last_id: (Optional) The highest post id to yield
+        :type last_id: int
+        :param chunk_size: (Optional) The number of posts read per query
+         (default 1000)
+        :type chunk_size: int
+        :return: A generator of dicts with the keys ``post_id``, ``title``,
+         ``slug`` and ``last_modified_date``
+        """
+        key = ("sitemap_posts", last_id is not None)
+        statement = self._template(
+            key, lambda: self._build_sitemap_posts_statement(*key[1:]))
+        after = (_as_int(first_id) or 1) - 1
+        while True:
+            with self._reader.begin() as conn:
+                try:
+                    rows = self._execute(conn, statement, after=after,
+                                         last_id=_as_int(last_id),
+                                         count=chunk_size).fetchall()
+                except Exception as e:
+                    self._read_failed(e)
+                    return
+            for row in rows:
+                yield dict(post_id=row[0], title=row[1], slug=row[2],
+                           last_modified_date=row[3])
+            if len(rows) < chunk_size:
+                return
+            after = rows[-1][0]
+
+    def _build_sitemap_posts_statement(self, by_last_id):
+        post = self._post_table
+        statement = sqla.select(
+            [post.c.id, post.c.title, post.c.slug,
+             post.c.last_modified_date]).where(
+            sqla.and_(post.c.draft == 0,
+                      post.c.id > sqla.bindparam("after")))
+        if by_last_id:
+            statement = statement.where(
+                post.c.id <= sqla.bindparam("last_id"))
+        return statement.order_by(post.c.id).limit(sqla.bindparam("count"))
+
+    def get_sitemap_shards(self, shard_size):
+        """
+        The ranges of ``shard_size`` post ids that hold published posts.
+        Shard ``n`` holds the posts with ids ``(n - 1) * shard_size + 1``
+        to ``n * shard_size``. One grouped query over the ids.
+
+        :param shard_size: The number of post ids per shard
+        :type shard_size: int
+        :return: A list of dicts with the keys ``shard``, ``count`` and
+         ``last_modified``, ordered by shard
+        """
+        shard_size = int(shard_size)
+        statement = self._template(
+            ("sitemap_shards", shard_size),
+            lambda: self._build_sitemap_shards_statement(shard_size))
+        result = []
+        with self._reader.begin() as conn:
+            try:
+                for start, count, last_modified in self._execute(
+                        conn, statement):
+                    result.append(dict(shard=start // shard_size + 1,
+                                       count=count,
+                                       last_modified=last_modified))
+            except Exception as e:
+                self._read_failed(e)
+                result = []
+        return result
+
+    def _build_sitemap_shards_statement(self, shard_size):
+        post = self._post_table
+        # the first id of the shard less one, as integer arithmetic that
+        # every dialect does alike; literals, so that the grouped and the
+        # selected expressions compare equal
+        offset = post.c.id - sqla.literal_column("1")
+        start = offset - offset % sqla.literal_column(str(shard_size))
+        return sqla.select(
+            [start, sqla.func.count(post.c.id),
+             sqla.func.max(post.c.last_modified_date)]) \
+            .where(post.c.draft == 0).group_by(start).order_by(start)
+
+    def _build_last_modified_statement(self, by_id, by_tag, by_user,
+                                       include_draft):
+        post = self._post_table
+        statement = sqla.select([sqla.func.max(post.c.last_modified_date)])
+        if by_id:
+            return statement.where(post.c.id == sqla.bindparam("post_id"))
+        return statement.where(
+            self._get_filter(by_tag, by_user, include_draft))
+
+    def _build_post_by_id_statement(self):
+        return self._posts_with_tags_statement(
+            sqla.select([self._post_table]).where(
+                self._post_table.c.id == sqla.bindparam("post_id")))
+
+    def _build_post_by_slug_statement(self):
+        post = self._post_table
+        return self._posts_with_tags_statement(
+            sqla.select([post]).where(
+                sqla.and_(post.c.slug == sqla.bindparam("slug"),
+                          post.c.draft == 0)).order_by(post.c.id).limit(1))
+
+    def _build_posts_statement(self, by_tag, by_user, include_draft, limit,
+                               seek, descending, recent, fields):
+        """
+        Builds the ``get_posts`` statement for one combination of filters,
+        taking ``tag``, ``user_id``, ``count``, ``offset``, ``cursor_date``
+        and ``cursor_id`` as bind parameters.
+        """
+        # post_statement ensures the correct posts are selected in the
+        # correct order
+        post_statement = sqla.select(self._post_columns(fields)).where(
+            self._get_filter(by_tag, by_user, include_draft))
+        if limit:
+            post_statement = post_statement.limit(sqla.bindparam("count"))
+        if seek == "cursor":
+            post_statement = post_statement.where(self._keyset_filter(
+                sqla.bindparam("cursor_date"), sqla.bindparam("cursor_id"),
+                descending))
+        elif seek == "offset":
+            post_statement = post_statement.offset(sqla.bindparam("offset"))
+        post_statement = post_statement.order_by(
+            *self._post_ordering(self._post_table.c.post_date,
+                                 self._post_table.c.id, descending))
+        return self._posts_with_tags_statement(post_statement, recent,
+                                               fields)
+
+    def _build_count_statement(self):
+        return sqla.select([self._post_counts_table.c.count]).where(
+            self._count_key_filter((sqla.bindparam("tag"),
+                                    sqla.bindparam("user_id"),
+                                    sqla.bindparam("draft"))))
+
+    def recount_posts(self):
+        """
+        Rebuilds the post counters from the post, tag and user tables. Use
+        this if the counters have drifted, e.g. after posts were edited
+        directly in the database.
+
+        :return: The number of counter buckets written.
+        """
+        post = self._post_table
+        tag = self._tag_table
+        tag_posts = self._tag_posts_table
+        user_posts = self._user_posts_table
+        by_tag = post.join(tag_posts, tag_posts.c.post_id == post.c.id) \
+            .join(tag, tag.c.id == tag_posts.c.tag_id)
+        by_user = post.join(user_posts, user_posts.c.post_id == post.c.id)
+        by_tag_and_user = by_tag.join(user_posts,
+                                      user_posts.c.post_id == post.c.id)
+        no_value = sqla.literal_column("''")
+        groupings = [
+            (post, no_value, no_value),
+            (by_user, no_value, user_posts.c.user_id),
+            (by_tag, tag.c.text, no_value),
+            (by_tag_and_user, tag.c.text, user_posts.c.user_id),
+        ]
+        with self._engine.begin() as conn:
+            counts = []
+            for from_clause, tag_column, user_column in groupings:
+                group_by = [c for c in (tag_column, user_column)
+                            if c is not no_value] + [post.c.draft]
+                statement = sqla.select(
+                    [tag_column.label("tag"), user_column.label("user_id"),
+                     post.c.draft,
+                     sqla.func.count(sqla.distinct(post.c.id))]) \
+                    .select_from(from_clause).group_by(*group_by)
+                for tag_text, user_id, draft, count in conn.execute(
+                        statement):
+                    counts.append(dict(tag=tag_text or "",
+                                       user_id=user_id or "",
+                                       draft=draft or 0, count=count))
+            conn.execute(self._post_counts_table.delete())
+            if counts:
+                conn.execute(self._post_counts_table.insert(), counts)
+        return len(counts)
+
+    def save_posts_bulk(self, posts, chunk_size=500):
+        """
+        Insert many new posts, one transaction per chunk. Within a chunk
+        the tags, tag links, user links and counters are each written with
+        a single batched statement.
+
+        :param posts: An iterable of post dicts with the keys ``title``,
+         ``text``, ``user_id``, ``tags`` and optionally ``draft``,
+         ``post_date`` and ``last_modified_date``. It is consumed lazily.
+        :type posts: iterable
+        :param chunk_size: (Optional) The number of posts per transaction
+         (default 500)
+        :type chunk_size: int
+        :return: The number of posts inserted. Insertion stops at the first
+         chunk that fails.
+        """
+        saved = 0
+        self._ensure_search_index()
+        for chunk in _chunks(posts, chunk_size):
+            try:
+                with self._engine.begin() as conn:
+                    self._insert_posts(chunk, conn)
+            except Exception as e:
+                self._logger.exception(str(e))
+                break
+            saved += len(chunk)
+        return saved
+
+    def _insert_posts(self, posts, conn):
+        current_datetime = datetime.datetime.utcnow()
+        rows = []
+        indexed = []
+        for post in posts:
+            draft = 1 if post.get("draft") else 0
+            post_date = post.get("post_date") or current_datetime
+            statement = self._post_table.insert().values(
+                title=post["title"],
+                slug=post.get("slug") or self.create_slug(post["title"]),
+                text=post["text"], post_date=post_date,
+                last_modified_date=post.get("last_modified_date") or
+                post_date, draft=draft)
+            post_id = conn.execute(statement).inserted_primary_key[0]
+            tags = sorted(set(self.normalize_tags(post.get("tags") or [])))
+            rows.append((post_id, tags, str(post["user_id"]), draft))
+            indexed.append((post_id, post["title"], post["text"]))
+
+        tag_ids = self._resolve_tag_ids(
+            sorted(set(t for _, tags, _, _ in rows for t in tags)), conn)
+        tag_links = [dict(tag_id=tag_ids[t], post_id=post_id)
+                     for post_id, tags, _, _ in rows for t in tags]
+        if tag_links:
+            conn.execute(self._tag_posts_table.insert(), tag_links)
+        conn.execute(self._user_posts_table.insert(),
+                     [dict(user_id=user_id, post_id=post_id)
+                      for post_id, _, user_id, _ in rows])
+        buckets = [key for _, tags, user_id, draft in rows
+                   for key in self._count_buckets(tags, [user_id], draft)]
+        self._update_counts([], buckets, conn)
+        self._index_posts(indexed, conn)
+
+    def iter_posts(self, chunk_size=500):
+        """
+        Yields every post, drafts included, oldest first. Posts are read
+        ``chunk_size`` at a time by seeking on ``(post_date, id)``, so memory
+        use does not depend on the size of the blog.
+
+        :param chunk_size: (Optional) The number of posts read per query
+         (default 500)
+        :type chunk_size: int
+        :return: A generator of post dicts, as returned by ``get_posts``
+        """
+        last = None
+        while True:
+            statement = sqla.select([self._post_table])
+            if last is not None:
+                statement = statement.where(self._keyset_filter(
+                    last["post_date"], last["post_id"], False))
+            statement = statement.order_by(*self._post_ordering(
+                self._post_table.c.post_date, self._post_table.c.id,
+                False)).limit(chunk_size)
+            with self._reader.begin() as conn:
+                posts = self._fetch_posts_with_tags(conn, statement, False)
+            for post in posts:
+                yield post
+            if len(posts) < chunk_size:
+                return
+            last = posts[-1]
+
+    def save_rendered(self, post_id, rendered_text, meta, render_version,
+                      excerpt=None, rendered_excerpt=None):
+        """
+        Store the rendered HTML and Meta of a post, and the excerpt of
+        listings, so it need not be rendered again until its text or the
+        renderer changes.
+
+        :param post_id: The identifier of the post
+        :type post_id: int
+        :param rendered_text: The HTML rendered from the post text
+        :type rendered_text: str
+        :param meta: The Meta dict, including the extracted images
+        :type meta: dict
+        :param render_version: The renderer version stamp
+        :type render_version: str
+        :param excerpt: (Optional) The plain text excerpt of listings
+        :type excerpt: str
+        :param rendered_excerpt: (Optional) The HTML teaser of listings
+        :type rendered_excerpt: str
+        :return: ``True`` if the post was updated
+        """
+        post_id = _as_int(post_id)
+        statement = self._template(("save_rendered",), lambda: (
+            self._post_table.update().where(
+                self._post_table.c.id == sqla.bindparam("b_post_id"))
+            .values(rendered_text=sqla.bindparam("b_rendered_text"),
+                    rendered_meta=sqla.bindparam("b_rendered_meta"),
+                    excerpt=sqla.bindparam("b_excerpt"),
+                    rendered_excerpt=sqla.bindparam("b_rendered_excerpt"),
+                    render_version=sqla.bindparam("b_render_version"))))
         with self._engine.begin() as conn:
             try:
-                count_statement = sqla.select([sqla.func.count()]). \
-                    select_from(self._post_table)
-                sql_filter = self._get_filter(tag, user_id, include_draft,
-                                              conn)
-                count_statement = count_statement.where(sql_filter)
-                result = conn.execute(count_statement).scalar()
+                result = self._execute(
+                    conn, statement, b_post_id=post_id,
+                    b_rendered_text=rendered_text,
+                    b_rendered_meta=json.dumps(meta),
+                    b_excerpt=excerpt, b_rendered_excerpt=rendered_excerpt,
+                    b_render_version=render_version)
+                return result.rowcount > 0
             except Exception as e:
                 self._logger.exception(str(e))
+        return False
+
+    def search_posts(self, query, count=10, offset=0, include_draft=False):
+        """
+        Full-text search over post titles and texts, best matches first.
+        Backed by an FTS5 table on SQLite and a tsvector GIN index on
+        PostgreSQL; other databases return no results.
+
+        :param query: The words to search for. All of them must match.
+        :type query: str
+        :param count: The number of posts to retrieve (default 10)
+        :type count: int
+        :param offset: The number of posts to offset (default 0)
+        :type offset: int
+        :param include_draft: Whether to include posts marked as draft or not
+        :type include_draft: bool
+        :return: A list of posts in the format returned by ``get_posts``
+        """
+        result = []
+        search = self._search_statement(query, include_draft)
+        if search is None:
+            return result
+        statement, rank = search
+        statement = sqla.select([statement.c.id]).order_by(rank) \
+            .limit(count).offset(offset)
+        with self._reader.begin() as conn:
+            try:
+                post_ids = [r[0] for r in conn.execute(statement)]
+                if post_ids:
+                    posts = self._fetch_posts_with_tags(
+                        conn, sqla.select([self._post_table]).where(
+                            self._post_table.c.id.in_(post_ids)))
+                    ranks = dict((post_id, i)
+                                 for i, post_id in enumerate(post_ids))
+                    result = sorted(posts, key=lambda p: ranks[p["post_id"]])
+            except Exception as e:
+                self._read_failed(e)
+                result = []
+        return result
+
+    def count_search_results(self, query, include_draft=False):
+        """
+        Returns the number of posts matching a ``search_posts`` query.
+
+        :param query: The words to search for
+        :type query: str
+        :param include_draft: Whether to include posts marked as draft or not
+        :type include_draft: bool
+        :return: The number of matching posts
+        """
+        result = 0
+        search = self._search_statement(query, include_draft)
+        if search is None:
+            return result
+        statement = sqla.select([sqla.func.count()]).select_from(
+            search[0])
+        with self._reader.begin() as conn:
+            try:
+                result = conn.execute(statement).scalar()
+            except Exception as e:
+                self._read_failed(e)
                 result = 0
         return result
 
+    def _search_statement(self, query, include_draft):
+        """
+        Returns a (subquery of matching post ids, rank ordering) pair, or
+        ``None`` when there is nothing to search for. Queries never fall
+        back to a LIKE scan of the post text.
+        """
+        terms = re.findall(r"\w+", query or "", re.UNICODE)
+        if not terms or not self._ensure_search_index():
+            return None
+        post = self._post_table
+        draft_filter = post.c.draft == (1 if include_draft else 0)
+        if self._search_dialect == "sqlite":
+            fts = sqla.table(self._table_name("post_fts"),
+                             sqla.column("rowid"))
+            # quote every term so FTS5 operators in the input are inert
+            match = " ".join('"%s"' % t for t in terms)
+            # FTS5's rank is bm25() with titles weighted over texts;
+            # smaller is better
+            rank = sqla.func.bm25(sqla.literal_column(fts.name), 10.0, 1.0)
+            statement = sqla.select([post.c.id, rank.label("rank")]) \
+                .select_from(fts.join(post, post.c.id == fts.c.rowid)) \
+                .where(sqla.and_(sqla.literal_column(fts.name)
+                                 .op("MATCH")(match), draft_filter)) \
+                .alias("search")
+            return statement, statement.c.rank.asc()
+        search = self._post_search_table
+        ts_query = sqla.func.plainto_tsquery(self._search_language,
+                                             " ".join(terms))
+        rank = sqla.func.ts_rank_cd(search.c.document, ts_query)
+        statement = sqla.select([post.c.id, rank.label("rank")]) \
+            .select_from(search.join(post, post.c.id == search.c.post_id)) \
+            .where(sqla.and_(search.c.document.op("@@")(ts_query),
+                             draft_filter)) \
+            .alias("search")
+        return statement, statement.c.rank.desc()
+
+    def _index_posts(self, posts, conn, replace=False):
+        """
+        Writes ``(post_id, title, text)`` rows into the full-text index.
+        """
+        if not posts or not self._ensure_search_index():
+            return
+        if replace:
+            for post_id, _, _ in posts:
+                self._unindex_post(post_id, conn)
+        rows = [dict(post_id=post_id, title=title or "", text=text or "")
+                for post_id, title, text in posts]
+        if self._search_dialect == "sqlite":
+            statement = sqla.text(
+                "INSERT INTO %s (rowid, title, text) "
+                "VALUES (:post_id, :title, :text)" %
+                self._table_name("post_fts"))
+        else:
+            statement = self._post_search_table.insert().values(
+                post_id=sqla.bindparam("post_id"),
+                document=self._search_document(sqla.bindparam("title"),
+                                               sqla.bindparam("text")))
+        conn.execute(statement, rows)
+
+    def _unindex_post(self, post_id, conn):
+        if not self._ensure_search_index():
+            return
+        if self._search_dialect == "sqlite":
+            conn.execute(sqla.text(
+                "DELETE FROM %s WHERE rowid = :post_id" %
+                self._table_name("post_fts")), post_id=post_id)
+        elif self._search_dialect == "postgresql":
+            conn.execute(self._post_search_table.delete().where(
+                self._post_search_table.c.post_id == post_id))
+
+    def _search_document(self, title, text):
+        # title matches weigh more than body matches
+        language = self._search_language
+        return sqla.func.setweight(
+            sqla.func.to_tsvector(language, title), "A").op("||")(
+            sqla.func.setweight(sqla.func.to_tsvector(language, text), "B"))
+
     def delete_post(self, post_id):
         """
         Delete the post defined by ``post_id``
@@ -371,7 +1251,14 @@ class SQLAStorage(Storage):
         status = False
         success = 0
         post_id = _as_int(post_id)
+        self._ensure_search_index()
         with self._engine.begin() as conn:
+            try:
+                self._update_counts(self._get_count_buckets(post_id, conn),
+                                    [], conn)
+                self._unindex_post(post_id, conn)
+            except Exception as e:
+                self._logger.exception(str(e))
             try:
                 post_del_statement = self._post_table.delete().where(
                     self._post_table.c.id == post_id)
@@ -396,24 +1283,109 @@ class SQLAStorage(Storage):
         status = success == 3
         return status
 
-    def _get_filter(self, tag, user_id, include_draft, conn):
-        filters = []
-        if tag:
-            tag = tag.upper()
-            tag_statement = sqla.select([self._tag_table.c.id]).where(
-                self._tag_table.c.text == tag)
-            tag_result = conn.execute(tag_statement).fetchone()
-            if tag_result is not None:
-                tag_id = tag_result[0]
-                tag_filter = sqla.and_(
-                    self._tag_posts_table.c.tag_id == tag_id,
-                    self._post_table.c.id == self._tag_posts_table.c.post_id
-                )
-                filters.append(tag_filter)
+    def _count_key(self, tag, user_id, include_draft):
+        tag = self.normalize_tag(tag) if tag else ""
+        user_id = str(user_id) if user_id else ""
+        return tag, user_id, 1 if include_draft else 0
+
+    def _count_key_filter(self, key):
+        tag, user_id, draft = key
+        table = self._post_counts_table
+        return sqla.and_(table.c.tag == tag, table.c.user_id == user_id,
+                         table.c.draft == draft)
+
+    def _get_count_buckets(self, post_id, conn):
+        """
+        Returns the counter keys a post contributes to, as currently stored:
+        every combination of (no tag or one of its tags) and (no user or its
+        user) for its draft state.
+        """
+        draft = conn.execute(sqla.select([self._post_table.c.draft]).where(
+            self._post_table.c.id == post_id)).scalar()
+        if draft is None:
+            return []
+        tags = [r[0] for r in conn.execute(
+            sqla.select([self._tag_table.c.text]).select_from(
+                self._tag_posts_table.join(self._tag_table)).where(
+                self._tag_posts_table.c.post_id == post_id))]
+        users = [r[0] for r in conn.execute(
+            sqla.select([self._user_posts_table.c.user_id]).where(
+                self._user_posts_table.c.post_id == post_id))]
+        return self._count_buckets(tags, users, draft)
+
+    @staticmethod
+    def _count_buckets(tags, user_ids, draft):
+        return [(tag, user_id, draft)
+                for tag in [""] + [t for t in set(tags) if t]
+                for user_id in [""] + [u for u in set(user_ids) if u]]
+
+    def _update_counts(self, old_buckets, new_buckets, conn):
+        deltas = defaultdict(int)
+        for key in old_buckets:
+            deltas[key] -= 1
+        for key in new_buckets:
+            deltas[key] += 1
+        deltas = dict((k, d) for k, d in deltas.items() if d != 0)
+        if not deltas:
+            return
+        table = self._post_counts_table
+        tags, user_ids, drafts = (set(values) for values in zip(*deltas))
+        statement = sqla.select([table.c.tag, table.c.user_id,
+                                 table.c.draft]).where(sqla.and_(
+                                     table.c.tag.in_(tags),
+                                     table.c.user_id.in_(user_ids),
+                                     table.c.draft.in_(drafts)))
+        existing = set(tuple(r) for r in conn.execute(statement))
+        updates = [dict(b_tag=k[0], b_user_id=k[1], b_draft=k[2], delta=d)
+                   for k, d in deltas.items() if k in existing]
+        inserts = [dict(tag=k[0], user_id=k[1], draft=k[2], count=max(d, 0))
+                   for k, d in deltas.items() if k not in existing]
+        if updates:
+            statement = table.update().where(sqla.and_(
+                table.c.tag == sqla.bindparam("b_tag"),
+                table.c.user_id == sqla.bindparam("b_user_id"),
+                table.c.draft == sqla.bindparam("b_draft"))).values(
+                count=table.c.count + sqla.bindparam("delta"))
+            conn.execute(statement, updates)
+        if inserts:
+            conn.execute(table.insert(), inserts)
 
-        if user_id:
+    @staticmethod
+    def _post_ordering(date_column, id_column, descending):
+        # post id breaks ties between posts sharing a post_date, so that
+        # the ordering is total and keyset seeks never skip or repeat posts
+        if descending:
+            return [sqla.desc(date_column), sqla.desc(id_column)]
+        return [date_column, id_column]
+
+    def _keyset_filter(self, post_date, post_id, descending):
+        date_column = self._post_table.c.post_date
+        id_column = self._post_table.c.id
+        if descending:
+            return sqla.or_(date_column < post_date,
+                            sqla.and_(date_column == post_date,
+                                      id_column < post_id))
+        return sqla.or_(date_column > post_date,
+                        sqla.and_(date_column == post_date,
+                                  id_column > post_id))
+
+    def _get_filter(self, by_tag, by_user, include_draft):
+        """
+        The post filter for ``get_posts``. The tag and user to filter by
+        are left as the ``tag`` and ``user_id`` bind parameters.
+        """
+        filters = []
+        if by_tag:
+            # resolve the tag inside the statement rather than with a
+            # separate lookup round trip
+            tagged_posts = sqla.select([self._tag_posts_table.c.post_id]) \
+                .select_from(self._tag_posts_table.join(self._tag_table)) \
+                .where(self._tag_table.c.text == sqla.bindparam("tag"))
+            filters.append(self._post_table.c.id.in_(tagged_posts))
+
+        if by_user:
             user_filter = sqla.and_(
-                self._user_posts_table.c.user_id == user_id,
+                self._user_posts_table.c.user_id == sqla.bindparam("user_id"),
                 self._post_table.c.id == self._user_posts_table.c.post_id
             )
             filters.append(user_filter)
@@ -425,69 +1397,60 @@ class SQLAStorage(Storage):
         return sql_filter
 
     def _save_tags(self, tags, post_id, conn):
-
-        tags = self.normalize_tags(tags)
-        tag_ids = []
-
-        for tag in tags:  # iterate over given tags
-            try:
-                # check if the tag exists
-                statement = self._tag_table.select().where(
-                    self._tag_table.c.text == tag)
-                tag_result = conn.execute(statement).fetchone()
-                if tag_result is None:
-                    # insert if it is a new tag
-                    tag_insert_statement = self._tag_table.insert().\
-                        values(text=tag)
-                    result = conn.execute(tag_insert_statement)
-                    tag_id = result.inserted_primary_key[0]
-                else:
-                    # tag already exists
-                    tag_id = tag_result[0]
-
-            except sqla.exc.IntegrityError as e:
-                # some database error occurred;
-                tag_id = None
-                self._logger.exception(str(e))
-
-            except Exception as e:
-                # unknown exception occurred
-                tag_id = None
-                self._logger.exception(str(e))
-
-            if tag_id is not None:
-                # for a valid tag_id
-                tag_ids.append(tag_id)
-
-                try:
-                    # check if given post has tag given by tag_id
-                    statement = self._tag_posts_table.select().where(
-                        sqla.and_(self._tag_posts_table.c.tag_id == tag_id,
-                                  self._tag_posts_table.c.post_id == post_id))
-                    tag_post_result = conn.execute(statement).fetchone()
-
-                    if tag_post_result is None:
-                        # if tag_id not present for the post given by post_id
-                        tag_post_statement = self._tag_posts_table.insert().\
-                            values(tag_id=tag_id, post_id=post_id)
-                        conn.execute(tag_post_statement)
-
-                except sqla.exc.IntegrityError as e:
-                    self._logger.exception(str(e))
-                except Exception as e:
-                    self._logger.exception(str(e))
+        tags = sorted(set(self.normalize_tags(tags)))
         try:
-            # remove tags that have been deleted
-            statement = self._tag_posts_table.delete().where(
-                sqla.and_(sqla.not_(
-                    self._tag_posts_table.c.tag_id.in_(tag_ids)),
-                    self._tag_posts_table.c.post_id == post_id
-                )
-            )
-            conn.execute(statement)
+            tag_ids = set(self._resolve_tag_ids(tags, conn).values())
+            statement = sqla.select([self._tag_posts_table.c.tag_id]).where(
+                self._tag_posts_table.c.post_id == post_id)
+            linked_ids = set(r[0] for r in conn.execute(statement))
+
+            new_links = [dict(tag_id=tag_id, post_id=post_id)
+                         for tag_id in sorted(tag_ids - linked_ids)]
+            if new_links:
+                conn.execute(self._tag_posts_table.insert(), new_links)
+
+            stale_ids = linked_ids - tag_ids
+            if stale_ids:
+                # remove tags that have been deleted
+                statement = self._tag_posts_table.delete().where(
+                    sqla.and_(self._tag_posts_table.c.post_id == post_id,
+                              self._tag_posts_table.c.tag_id.in_(stale_ids)))
+                conn.execute(statement)
         except Exception as e:
+            self._tag_ids.clear()
             self._logger.exception(str(e))
 
+    def _resolve_tag_ids(self, tags, conn):
+        """
+        Maps the normalized ``tags`` to their ids with one query for the
+        tags not already known to this process, inserting the missing tags
+        in a single batch.
+        """
+        tag_ids = dict((t, self._tag_ids[t]) for t in tags
+                       if t in self._tag_ids)
+        unknown = [t for t in tags if t not in tag_ids]
+        if not unknown:
+            return tag_ids
+        statement = sqla.select([self._tag_table.c.text,
+                                 self._tag_table.c.id]).where(
+            self._tag_table.c.text.in_(unknown))
+        found = dict(conn.execute(statement).fetchall())
+        missing = [t for t in unknown if t not in found]
+        if missing:
+            conn.execute(self._tag_table.insert(),
+                         [dict(text=t) for t in missing])
+            # the insert may still be rolled back with the transaction, so
+            # don't remember ids from here on until it has settled
+            self._tag_ids.clear()
+            statement = sqla.select([self._tag_table.c.text,
+                                     self._tag_table.c.id]).where(
+                self._tag_table.c.text.in_(missing))
+            found.update(conn.execute(statement).fetchall())
+        else:
+            self._tag_ids.update(found)
+        tag_ids.update(found)
+        return tag_ids
+
     def _save_user_post(self, user_id, post_id, conn):
         user_id = str(user_id)
         statement = sqla.select([self._user_posts_table]).where(
@@ -513,124 +1476,220 @@ class SQLAStorage(Storage):
     def _table_name(self, table_name):
         return self._table_prefix + table_name
 
-    def _create_all_tables(self):
+    def _declare_all_tables(self):
         """
-        Creates all the required tables by calling the required functions.
+        Declares all the required tables without looking at the database.
         :return:
         """
-        self._create_post_table()
-        self._create_tag_table()
-        self._create_tag_posts_table()
-        self._create_user_posts_table()
-
-    def _create_post_table(self):
+        self._post_table = self._define_post_table()
+        self._tag_table = self._define_tag_table()
+        self._tag_posts_table = self._define_tag_posts_table()
+        self._user_posts_table = self._define_user_posts_table()
+        self._post_counts_table = self._define_post_counts_table()
+        self._post_search_table = self._define_post_search_table()
+
+    def _check_schema(self, counts_existed):
         """
-        Creates the table to store the blog posts.
+        Warns about the schema changes an existing database still needs
+        from the migrations. The post columns it lacks are declared
+        anyway, so the storage can be built; the reads using them fail
+        until the migrations ran.
         :return:
         """
-        with self._engine.begin() as conn:
-            post_table_name = self._table_name("post")
-            if not conn.dialect.has_table(conn, post_table_name):
-
-                self._post_table = sqla.Table(
-                    post_table_name, self._metadata,
-                    sqla.Column("id", sqla.Integer, primary_key=True),
-                    sqla.Column("title", sqla.String(256)),
-                    sqla.Column("text", sqla.Text),
-                    sqla.Column("post_date", sqla.DateTime),
-                    sqla.Column("last_modified_date", sqla.DateTime),
-                    # if 1 then make it a draft
-                    sqla.Column("draft", sqla.SmallInteger, default=0),
-                    info=self._info
-
-                )
-                self._logger.debug("Created table with table name %s" %
-                                   post_table_name)
-            else:
-                self._post_table = self._metadata.tables[post_table_name]
-                self._logger.debug("Reflecting to table with table name %s" %
-                                   post_table_name)
-
-    def _create_tag_table(self):
+        missing = [column for column in self._added_post_columns()
+                   if column.name not in self._post_table.c]
+        for column in missing:
+            self._post_table.append_column(column)
+        if missing:
+            self._logger.warning(
+                "Table %s lacks the columns %s, run the migrations" %
+                (self._post_table.name,
+                 ", ".join(column.name for column in missing)))
+        if not counts_existed:
+            with self._engine.begin() as conn:
+                has_posts = conn.execute(
+                    sqla.select([self._post_table.c.id]).limit(1)).first()
+            if has_posts is not None:
+                self._logger.warning(
+                    "Table %s was created empty, run the migrations or "
+                    "`flask blogging recount`" %
+                    self._post_counts_table.name)
+
+    def _ensure_search_index(self):
         """
-        Creates the table to store blog post tags.
-        :return:
+        Returns whether search is available. The index is checked for (and
+        created, where the migrations did not) on first use instead of at
+        construction.
         """
-        with self._engine.begin() as conn:
-            tag_table_name = self._table_name("tag")
-            if not conn.dialect.has_table(conn, tag_table_name):
-                self._tag_table = sqla.Table(
-                    tag_table_name, self._metadata,
-                    sqla.Column("id", sqla.Integer, primary_key=True),
-                    sqla.Column("text", sqla.String(128), unique=True,
-                                index=True),
-                    info=self._info
-                )
-                self._logger.debug("Created table with table name %s" %
-                                   tag_table_name)
-            else:
-                self._tag_table = self._metadata.tables[tag_table_name]
-                self._logger.debug("Reflecting to table with table name %s" %
-                                   tag_table_name)
+        if not self._search_index_checked:
+            try:
+                self._create_search_index()
+            except Exception as e:
+                # e.g. a locked database; try again on the next call
+                self._logger.exception(str(e))
+                self._search_index_checked = False
+                return False
+        return self._search_dialect is not None
 
-    def _create_tag_posts_table(self):
+    def _create_search_index(self):
         """
-        Creates the table to store association info between blog posts and
-        tags.
+        Creates and fills the full-text index if it does not exist yet.
+        On SQLite this is an FTS5 table keyed by the post id; the
+        PostgreSQL table is created with the other tables.
         :return:
         """
+        self._search_index_checked = True
+        if self._search_dialect is None:
+            return
         with self._engine.begin() as conn:
-            tag_posts_table_name = self._table_name("tag_posts")
-            if not conn.dialect.has_table(conn, tag_posts_table_name):
-                tag_id_key = self._table_name("tag") + ".id"
-                post_id_key = self._table_name("post") + ".id"
-                self._tag_posts_table = sqla.Table(
-                    tag_posts_table_name, self._metadata,
-                    sqla.Column('tag_id', sqla.Integer,
-                                sqla.ForeignKey(tag_id_key, onupdate="CASCADE",
-                                                ondelete="CASCADE"),
-                                index=True),
-                    sqla.Column('post_id', sqla.Integer,
-                                sqla.ForeignKey(post_id_key,
-                                                onupdate="CASCADE",
-                                                ondelete="CASCADE"),
-                                index=True),
-                    sqla.UniqueConstraint('tag_id', 'post_id', name='uix_1'),
-                    info=self._info
-                )
-                self._logger.debug("Created table with table name %s" %
-                                   tag_posts_table_name)
-            else:
-                self._tag_posts_table = \
-                    self._metadata.tables[tag_posts_table_name]
-                self._logger.debug("Reflecting to table with table name %s" %
-                                   tag_posts_table_name)
-
-    def _create_user_posts_table(self):
-        """
-        Creates the table to store association info between user and blog
-        posts.
-        :return:
+            if self._search_dialect == "sqlite":
+                fts_table_name = self._table_name("post_fts")
+                if conn.dialect.has_table(conn, fts_table_name):
+                    return
+                try:
+                    conn.execute("CREATE VIRTUAL TABLE %s USING "
+                                 "fts5(title, text)" % fts_table_name)
+                except sqla.exc.OperationalError as e:
+                    if "no such module" not in str(e):
+                        raise
+                    self._logger.warning("Search disabled, SQLite has no "
+                                         "FTS5 support: %s" % e)
+                    self._search_dialect = None
+                    return
+            elif conn.execute(sqla.select([sqla.func.count()]).select_from(
+                    self._post_search_table)).scalar():
+                return
+            self._logger.debug("Building the search index")
+            posts = conn.execute(sqla.select([
+                self._post_table.c.id, self._post_table.c.title,
+                self._post_table.c.text])).fetchall()
+            self._index_posts([tuple(p) for p in posts], conn)
+
+    def _define_post_search_table(self):
         """
-        with self._engine.begin() as conn:
-            user_posts_table_name = self._table_name("user_posts")
-            if not conn.dialect.has_table(conn, user_posts_table_name):
-                post_id_key = self._table_name("post") + ".id"
-                self._user_posts_table = sqla.Table(
-                    user_posts_table_name, self._metadata,
-                    sqla.Column("user_id", sqla.String(128), index=True),
-                    sqla.Column("post_id", sqla.Integer,
-                                sqla.ForeignKey(post_id_key,
-                                                onupdate="CASCADE",
-                                                ondelete="CASCADE"),
-                                index=True),
-                    sqla.UniqueConstraint('user_id', 'post_id', name='uix_2'),
-                    info=self._info
-                )
-                self._logger.debug("Created table with table name %s" %
-                                   user_posts_table_name)
-            else:
-                self._user_posts_table = \
-                    self._metadata.tables[user_posts_table_name]
-                self._logger.debug("Reflecting to table with table name %s" %
-                                   user_posts_table_name)
+        The tsvector table behind search on PostgreSQL. Other databases
+        don't get it; SQLite uses an FTS5 virtual table instead.
+        """
+        if self._engine.dialect.name != "postgresql":
+            return None
+        table_name = self._table_name("post_search")
+        if table_name in self._metadata.tables:
+            return self._metadata.tables[table_name]
+        post_id_key = self._table_name("post") + ".id"
+        return sqla.Table(
+            table_name, self._metadata,
+            sqla.Column("post_id", sqla.Integer,
+                        sqla.ForeignKey(post_id_key, onupdate="CASCADE",
+                                        ondelete="CASCADE"),
+                        primary_key=True),
+            sqla.Column("document", postgresql.TSVECTOR, nullable=False),
+            sqla.Index(self._table_name("ix_post_search_document"),
+                       "document", postgresql_using="gin"),
+            info=self._info
+        )
+
+    def _define_post_table(self):
+        table_name = self._table_name("post")
+        if table_name in self._metadata.tables:
+            return self._metadata.tables[table_name]
+        return sqla.Table(
+            table_name, self._metadata,
+            sqla.Column("id", sqla.Integer, primary_key=True),
+            sqla.Column("title", sqla.String(256)),
+            sqla.Column("text", sqla.Text),
+            sqla.Column("post_date", sqla.DateTime),
+            sqla.Column("last_modified_date", sqla.DateTime),
+            # if 1 then make it a draft
+            sqla.Column("draft", sqla.SmallInteger, default=0),
+            *self._added_post_columns(),
+            # keyset pagination seeks on (post_date, id)
+            sqla.Index(self._table_name("ix_post_draft_date_id"),
+                       "draft", "post_date", "id"),
+            # the validators for conditional GETs read the latest change
+            sqla.Index(self._table_name("ix_post_draft_modified"),
+                       "draft", "last_modified_date"),
+            # slug URLs resolve to their post through get_post_by_slug
+            sqla.Index(self._table_name("ix_post_slug"), "slug"),
+            info=self._info
+        )
+
+    @staticmethod
+    def _added_post_columns():
+        """
+        Post columns added after the table was first released. Existing
+        tables get them through the migrations.
+        """
+        return [
+            # the slug of the post URLs, made from the title on save
+            sqla.Column("slug", sqla.String(256)),
+            # the HTML, Meta and images rendered from text, and the
+            # renderer version they were rendered with
+            sqla.Column("rendered_text", sqla.Text),
+            sqla.Column("rendered_meta", sqla.Text),
+            sqla.Column("render_version", sqla.String(64)),
+            # the plain text and HTML teaser of post listings
+            sqla.Column("excerpt", sqla.Text),
+            sqla.Column("rendered_excerpt", sqla.Text),
+        ]
+
+    def _define_tag_table(self):
+        table_name = self._table_name("tag")
+        if table_name in self._metadata.tables:
+            return self._metadata.tables[table_name]
+        return sqla.Table(
+            table_name, self._metadata,
+            sqla.Column("id", sqla.Integer, primary_key=True),
+            sqla.Column("text", sqla.String(128), unique=True, index=True),
+            info=self._info
+        )
+
+    def _define_tag_posts_table(self):
+        table_name = self._table_name("tag_posts")
+        if table_name in self._metadata.tables:
+            return self._metadata.tables[table_name]
+        tag_id_key = self._table_name("tag") + ".id"
+        post_id_key = self._table_name("post") + ".id"
+        return sqla.Table(
+            table_name, self._metadata,
+            sqla.Column('tag_id', sqla.Integer,
+                        sqla.ForeignKey(tag_id_key, onupdate="CASCADE",
+                                        ondelete="CASCADE"),
+                        index=True),
+            sqla.Column('post_id', sqla.Integer,
+                        sqla.ForeignKey(post_id_key,
+                                        onupdate="CASCADE",
+                                        ondelete="CASCADE"),
+                        index=True),
+            sqla.UniqueConstraint('tag_id', 'post_id', name='uix_1'),
+            info=self._info
+        )
+
+    def _define_user_posts_table(self):
+        table_name = self._table_name("user_posts")
+        if table_name in self._metadata.tables:
+            return self._metadata.tables[table_name]
+        post_id_key = self._table_name("post") + ".id"
+        return sqla.Table(
+            table_name, self._metadata,
+            sqla.Column("user_id", sqla.String(128), index=True),
+            sqla.Column("post_id", sqla.Integer,
+                        sqla.ForeignKey(post_id_key,
+                                        onupdate="CASCADE",
+                                        ondelete="CASCADE"),
+                        index=True),
+            sqla.UniqueConstraint('user_id', 'post_id', name='uix_2'),
+            info=self._info
+        )
+
+    def _define_post_counts_table(self):
+        table_name = self._table_name("post_counts")
+        if table_name in self._metadata.tables:
+            return self._metadata.tables[table_name]
+        return sqla.Table(
+            table_name, self._metadata,
+            sqla.Column("tag", sqla.String(128), primary_key=True),
+            sqla.Column("user_id", sqla.String(128), primary_key=True),
+            sqla.Column("draft", sqla.SmallInteger, primary_key=True),
+            sqla.Column("count", sqla.Integer, nullable=False, default=0),
+            info=self._info
+        )
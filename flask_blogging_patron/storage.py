@@ -2,13 +2,18 @@ try:
     from builtins import object
 except ImportError:
     pass
+from slugify import slugify
 
 
 class Storage(object):
 
+    #: The ``fields`` of ``get_posts`` for post listings: the excerpt
+    #: stored by ``save_rendered`` instead of the text and its rendering
+    SUMMARY_FIELDS = ("excerpt", "rendered_excerpt")
+
     def save_post(self, title, text, user_id, tags, draft=False,
                   post_date=None, last_modified_date=None, meta_data=None,
-                  post_id=None):
+                  post_id=None, slug=None):
         """
         Persist the blog post data. If ``post_id`` is ``None`` or ``post_id``
         is invalid, the post must be inserted into the storage. If ``post_id``
@@ -35,6 +40,9 @@ class Storage(object):
         :param post_id: The post identifier. This should be ``None`` for an
          insert call, and a valid value for update.
         :type post_id: int
+        :param slug: (Optional) The slug of the post URLs, stored with the
+         post. (default ``create_slug(title)``)
+        :type slug: str
 
         :return: The post_id value, in case of a successful insert or update.
         Return ``None`` if there were errors.
@@ -54,8 +62,34 @@ class Storage(object):
         raise NotImplementedError("This method needs to be implemented by the "
                                   "inheriting class")
 
+    def get_posts_by_ids(self, post_ids):
+        """
+        Fetch the whole blog posts given by ``post_ids`` at once, e.g. to
+        render the summaries of a listing again.
+
+        :param post_ids: The post identifiers
+        :type post_ids: iterable
+        :return: A list of the posts found, in no particular order
+        """
+        raise NotImplementedError("This method needs to be implemented by the "
+                                  "inheriting class")
+
+    def get_post_by_slug(self, slug):
+        """
+        Fetch the published blog post stored with ``slug``. Titles, and so
+        slugs, may repeat; the first post saved with the slug is returned.
+
+        :param slug: The slug of the blog post
+        :type slug: str
+        :return: The post data, or ``None`` if no published post has the
+         slug.
+        """
+        raise NotImplementedError("This method needs to be implemented by the "
+                                  "inheriting class")
+
     def get_posts(self, count=10, offset=0, recent=True,  tag=None,
-                  user_id=None, include_draft=False):
+                  user_id=None, include_draft=False, cursor=None,
+                  fields=None):
         """
         Get posts given by filter criteria
 
@@ -72,6 +106,16 @@ class Storage(object):
         :type user_id: str
         :param include_draft: Whether to include posts marked as draft or not
         :type include_draft: bool
+        :param cursor: (Optional) An opaque cursor built by
+         ``utils.encode_cursor``. When given, ``offset`` is ignored and the
+         page is located by seeking on ``(post_date, post_id)`` instead.
+        :type cursor: str
+        :param fields: (Optional) The fields to load besides ``post_id``,
+         ``title``, ``user_id``, ``tags``, ``draft``, the dates and
+         ``render_version``: any of ``text``, ``rendered_text``, ``meta``,
+         ``excerpt`` and ``rendered_excerpt``. All of them if ``None``.
+         Storages may return more fields than asked for.
+        :type fields: iterable
 
         :return: A list of posts, with each element a dict containing values
          for the following keys: (title, text, draft, post_date,
@@ -96,6 +140,61 @@ class Storage(object):
         raise NotImplementedError("This method needs to be implemented by the "
                                   "inheriting class")
 
+    def get_last_modified(self, post_id=None, tag=None, user_id=None,
+                          include_draft=False):
+        """
+        Returns the latest ``last_modified_date`` of the posts matching the
+        filter, or of the post ``post_id`` if given. Used to answer
+        conditional GETs without fetching the posts, so it should be cheap.
+
+        :param post_id: (Optional) The post identifier
+        :type post_id: str
+        :param tag: Filter by a specific tag
+        :type tag: str
+        :param user_id: Filter by a specific user
+        :type user_id: str
+        :param include_draft: Whether to include posts marked as draft or not
+        :type include_draft: bool
+        :return: A ``datetime.datetime``, or ``None`` if no post matches.
+        """
+        raise NotImplementedError("This method needs to be implemented by the "
+                                  "inheriting class")
+
+    def iter_sitemap_posts(self, first_id=None, last_id=None,
+                           chunk_size=1000):
+        """
+        Yield the ``post_id``, ``title``, ``slug`` and
+        ``last_modified_date`` of the published posts, by increasing id,
+        without reading their text or tags. Used to stream the sitemap.
+
+        :param first_id: (Optional) The lowest post id to yield
+        :type first_id: int
+        :param last_id: (Optional) The highest post id to yield
+        :type last_id: int
+        :param chunk_size: (Optional) The number of posts read per batch
+         (default 1000)
+        :type chunk_size: int
+        :return: A generator of dicts with the keys ``post_id``, ``title``,
+         ``slug`` and ``last_modified_date``
+        """
+        raise NotImplementedError("This method needs to be implemented by the "
+                                  "inheriting class")
+
+    def get_sitemap_shards(self, shard_size):
+        """
+        The ranges of ``shard_size`` post ids that hold published posts,
+        which the sitemap is split into when it gets too large. Shard ``n``
+        holds the posts with ids ``(n - 1) * shard_size + 1`` to
+        ``n * shard_size``.
+
+        :param shard_size: The number of post ids per shard
+        :type shard_size: int
+        :return: A list of dicts with the keys ``shard``, ``count`` and
+         ``last_modified``, ordered by shard
+        """
+        raise NotImplementedError("This method needs to be implemented by the "
+                                  "inheriting class")
+
     def delete_post(self, post_id):
         """
         Delete the post defined by ``post_id``
@@ -108,6 +207,102 @@ class Storage(object):
         raise NotImplementedError("This method needs to be implemented by the "
                                   "inheriting class")
 
+    def save_posts_bulk(self, posts, chunk_size=500):
+        """
+        Insert many new posts at once, e.g. when importing an archive.
+
+        :param posts: An iterable of post dicts with the keys ``title``,
+         ``text``, ``user_id``, ``tags`` and optionally ``draft``,
+         ``post_date`` and ``last_modified_date``. It is consumed lazily.
+        :type posts: iterable
+        :param chunk_size: (Optional) The number of posts written per batch
+         (default 500)
+        :type chunk_size: int
+        :return: The number of posts inserted.
+        """
+        raise NotImplementedError("This method needs to be implemented by the "
+                                  "inheriting class")
+
+    def iter_posts(self, chunk_size=500):
+        """
+        Yield every post, drafts included, without loading them all into
+        memory at once.
+
+        :param chunk_size: (Optional) The number of posts read per batch
+         (default 500)
+        :type chunk_size: int
+        :return: A generator of post dicts, as returned by ``get_posts``
+        """
+        raise NotImplementedError("This method needs to be implemented by the "
+                                  "inheriting class")
+
+    def recount_posts(self):
+        """
+        Rebuild any post counters the storage maintains to answer
+        ``count_posts`` cheaply.
+
+        :return: The number of counters written.
+        """
+        raise NotImplementedError("This method needs to be implemented by the "
+                                  "inheriting class")
+
+    def save_rendered(self, post_id, rendered_text, meta, render_version,
+                      excerpt=None, rendered_excerpt=None):
+        """
+        Store the rendered HTML and Meta of a post alongside it. Storages
+        return them from ``get_posts`` and ``get_post_by_id`` as the
+        ``rendered_text``, ``meta``, ``excerpt``, ``rendered_excerpt`` and
+        ``render_version`` keys, until the post is saved again.
+
+        :param post_id: The identifier of the post
+        :type post_id: str
+        :param rendered_text: The HTML rendered from the post text
+        :type rendered_text: str
+        :param meta: The Meta dict, including the extracted images
+        :type meta: dict
+        :param render_version: The renderer version stamp
+        :type render_version: str
+        :param excerpt: (Optional) The plain text excerpt of listings
+        :type excerpt: str
+        :param rendered_excerpt: (Optional) The HTML teaser of listings
+        :type rendered_excerpt: str
+        :return: ``True`` if the post was updated
+        """
+        raise NotImplementedError("This method needs to be implemented by the "
+                                  "inheriting class")
+
+    def search_posts(self, query, count=10, offset=0, include_draft=False):
+        """
+        Full-text search over the posts, best matches first. Storages
+        should answer this from a search index rather than scanning the
+        post texts.
+
+        :param query: The words to search for
+        :type query: str
+        :param count: The number of posts to retrieve (default 10)
+        :type count: int
+        :param offset: The number of posts to offset (default 0)
+        :type offset: int
+        :param include_draft: Whether to include posts marked as draft or not
+        :type include_draft: bool
+        :return: A list of posts, in the format returned by ``get_posts``
+        """
+        raise NotImplementedError("This method needs to be implemented by the "
+                                  "inheriting class")
+
+    def count_search_results(self, query, include_draft=False):
+        """
+        Returns the number of posts matching a ``search_posts`` query
+
+        :param query: The words to search for
+        :type query: str
+        :param include_draft: Whether to include posts marked as draft or not
+        :type include_draft: bool
+        :return: The number of matching posts
+        """
+        raise NotImplementedError("This method needs to be implemented by the "
+                                  "inheriting class")
+
     @classmethod
     def normalize_tags(cls, tags):
         return [cls.normalize_tag(tag) for tag in tags]
@@ -115,3 +310,7 @@ class Storage(object):
     @staticmethod
     def normalize_tag(tag):
         return tag.upper().strip()
+
+    @staticmethod
+    def create_slug(title):
+        return slugify(title)
@@ -1,3 +1,12 @@
+import base64
+import datetime
+import json
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None
+
+
 def ensureUtf(s, encoding='utf8'):
     """Converts input to unicode if necessary.
     If `s` is bytes, it will be decoded using the `encoding` parameters.
@@ -11,3 +20,66 @@ def ensureUtf(s, encoding='utf8'):
         return s.decode(encoding, 'ignore')
     else:
         return s
+
+
+CURSOR_AFTER = "a"
+CURSOR_BEFORE = "b"
+_CURSOR_DATE_FORMAT = "%Y-%m-%dT%H:%M:%S.%f"
+
+
+def encode_cursor(direction, post_date, post_id):
+    """Builds an opaque pagination cursor keyed on ``(post_date, post_id)``.
+
+    ``direction`` is ``CURSOR_AFTER`` to continue past the keyed post in
+    listing order, or ``CURSOR_BEFORE`` to go back to the posts preceding it.
+    """
+    payload = json.dumps([direction, post_date.strftime(_CURSOR_DATE_FORMAT),
+                          post_id], separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode("utf8")) \
+        .decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor):
+    """Decodes a cursor built by ``encode_cursor``.
+
+    :return: A ``(direction, post_date, post_id)`` tuple, or ``None`` if the
+     cursor is missing or malformed.
+    """
+    if not cursor:
+        return None
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        payload = base64.urlsafe_b64decode(padded.encode("ascii"))
+        direction, post_date, post_id = json.loads(payload.decode("utf8"))
+        if direction not in (CURSOR_AFTER, CURSOR_BEFORE):
+            return None
+        post_date = datetime.datetime.strptime(post_date,
+                                               _CURSOR_DATE_FORMAT)
+    except (ValueError, TypeError, UnicodeError):
+        return None
+    return direction, post_date, post_id
+
+
+class FileLock(object):
+    """
+    A lock shared by the threads of this worker, through ``lock``, and,
+    where fcntl is available, by the other workers, through an flock on
+    the file at ``path``. Use it as a context manager.
+    """
+    def __init__(self, lock, path):
+        self._lock = lock
+        self._path = path
+        self._file = None
+
+    def __enter__(self):
+        self._lock.acquire()
+        if fcntl is not None:
+            self._file = open(self._path, "a")
+            fcntl.flock(self._file, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc_info):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        self._lock.release()
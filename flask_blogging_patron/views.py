@@ -5,22 +5,38 @@ except ImportError:
     pass
 from flask import escape
 from .processor import PostProcessor
+from .storage import Storage
+from .cache import get_generations
 from flask_login import login_required, current_user
 from flask import Blueprint, current_app, render_template, request, redirect, \
-    url_for, flash, make_response
+    url_for, flash, make_response, session, abort, stream_with_context, \
+    copy_current_request_context, g
 from flask_blogging_patron.forms import BlogEditor, HomePageEditor
+import collections
+import functools
+import hashlib
+import itertools
+import logging
 import math
+import os
+import threading
+import time
+import zlib
+from werkzeug.datastructures import Headers
+from werkzeug.http import is_resource_modified
 from werkzeug.contrib.atom import AtomFeed
 import datetime
 from flask_principal import PermissionDenied
 from .signals import page_by_id_fetched, page_by_id_processed, \
     posts_by_tag_fetched, posts_by_tag_processed, \
     posts_by_author_fetched, posts_by_author_processed, \
+    search_posts_fetched, search_posts_processed, \
     index_posts_fetched, index_posts_processed, \
     feed_posts_fetched, feed_posts_processed, \
     sitemap_posts_fetched, sitemap_posts_processed, editor_post_saved, \
     post_deleted, editor_get_fetched
-from .utils import ensureUtf
+from .utils import ensureUtf, encode_cursor, decode_cursor, \
+    CURSOR_AFTER, CURSOR_BEFORE
 
 
 def _get_blogging_engine(app):
@@ -32,15 +48,6 @@ def _get_user_name(user):
     return user_name
 
 
-def _clear_cache(cache):
-    cache.delete_memoized(index)
-    cache.delete_memoized(page_by_id)
-    cache.delete_memoized(posts_by_author)
-    cache.delete_memoized(posts_by_tag)
-    cache.delete_memoized(sitemap)
-    cache.delete_memoized(feed)
-
-
 def _store_form_data(blog_form, storage, user, post, escape_text=True):
     title = blog_form.title.data
     text = escape(blog_form.text.data) if escape_text \
@@ -52,46 +59,90 @@ def _store_form_data(blog_form, storage, user, post, escape_text=True):
     post_date = post.get("post_date", current_datetime)
     last_modified_date = datetime.datetime.utcnow()
     post_id = post.get("post_id")
+    slug = storage.create_slug(title)
     pid = storage.save_post(title, text, user_id, tags, draft=draft,
                             post_date=post_date,
                             last_modified_date=last_modified_date,
-                            post_id=post_id)
-    return pid
+                            post_id=post_id, slug=slug)
+    return pid, slug
 
 
-def _get_meta(storage, count, page, tag=None, user_id=None):
+def _get_meta(storage, count, page, tag=None, user_id=None, cursor=None):
     max_posts = storage.count_posts(tag=tag, user_id=user_id)
     max_pages = math.ceil(float(max_posts)/float(count))
     max_offset = (max_pages-1)*count
     offset = min(max(0, (page-1)*count), max_offset)
     offset = offset if offset >= 0 else 0
-    if (tag is None) and (user_id is None):
-        prev_page = None if page <= 1 else url_for(
-            "blogging.index", count=count, page=page-1)
-        next_page = None if page >= max_pages else url_for(
-            "blogging.index", count=count, page=page+1)
-    elif tag:
-        prev_page = None if page <= 1 else url_for(
-            "blogging.posts_by_tag", tag=tag, count=count, page=page-1)
-        next_page = None if page >= max_pages else url_for(
-            "blogging.posts_by_tag", tag=tag, count=count, page=page+1)
-    elif user_id:
-        prev_page = None if page <= 1 else url_for(
-            "blogging.posts_by_author", user_id=user_id, count=count,
-            page=page-1)
-        next_page = None if page >= max_pages else url_for(
-            "blogging.posts_by_author", user_id=user_id, count=count,
-            page=page+1)
-    else:
-        prev_page = next_page = None
-
-    pagination = dict(prev_page=prev_page, next_page=next_page)
+    if decode_cursor(cursor) is None:
+        # malformed cursors fall back to the page number
+        cursor = None
+    pagination = dict(prev_page=None, next_page=None)
     meta = dict(max_posts=max_posts, max_pages=max_pages, page=page,
                 max_offset=max_offset, offset=offset, count=count,
+                cursor=cursor,
                 pagination=pagination)
     return meta
 
 
+def _page_url(count, cursor, tag=None, user_id=None):
+    if tag:
+        return url_for("blogging.posts_by_tag", tag=tag, count=count,
+                       cursor=cursor)
+    elif user_id:
+        return url_for("blogging.posts_by_author", user_id=user_id,
+                       count=count, cursor=cursor)
+    return url_for("blogging.index", count=count, cursor=cursor)
+
+
+def _get_page_posts(storage, meta, tag=None, user_id=None, fields=None):
+    """
+    Fetches the posts for the page described by ``meta`` and fills in the
+    prev/next cursors. Page-number URLs are still honoured through the
+    offset computed by ``_get_meta``, but the links emitted from here are
+    always cursors, so the cost of a page does not grow with its depth.
+    Only ``fields`` are loaded, as for ``Storage.get_posts``.
+    """
+    count = meta["count"]
+    cursor = meta["cursor"]
+    if cursor is None:
+        posts = storage.get_posts(count=count, offset=meta["offset"],
+                                  tag=tag, user_id=user_id,
+                                  include_draft=False, recent=True,
+                                  fields=fields)
+        has_prev = meta["offset"] > 0
+        has_next = meta["offset"] + len(posts) < meta["max_posts"]
+    else:
+        # fetch one extra post to find out if there is anything beyond
+        posts = storage.get_posts(count=count + 1, cursor=cursor, tag=tag,
+                                  user_id=user_id, include_draft=False,
+                                  recent=True, fields=fields)
+        more = len(posts) > count
+        if decode_cursor(cursor)[0] == CURSOR_AFTER:
+            posts = posts[:count]
+            has_prev, has_next = True, more
+        else:
+            posts = posts[-count:]
+            has_prev, has_next = more, True
+
+    pagination = meta["pagination"]
+    if posts and has_prev:
+        first = posts[0]
+        pagination["prev_page"] = _page_url(
+            count, encode_cursor(CURSOR_BEFORE, first["post_date"],
+                                 first["post_id"]), tag, user_id)
+    if posts and has_next:
+        last = posts[-1]
+        pagination["next_page"] = _page_url(
+            count, encode_cursor(CURSOR_AFTER, last["post_date"],
+                                 last["post_id"]), tag, user_id)
+    return posts
+
+
+def _listing_fields(config):
+    # listings show the excerpt; None loads and renders whole posts
+    return config.get("BLOGGING_LISTING_FIELDS", Storage.SUMMARY_FIELDS)
+
+
 def _is_blogger(blogger_permission):
     authenticated = current_user.is_authenticated() if \
         callable(current_user.is_authenticated) \
@@ -101,12 +152,13 @@ def _is_blogger(blogger_permission):
     return is_blogger
 
 
-def index(count, page):
+def index(count, page, cursor=None):
     """
     Serves the page with a list of blog posts
 
     :param count:
-    :param offset:
+    :param page:
+    :param cursor:
     :return:
     """
     blogging_engine = _get_blogging_engine(current_app)
@@ -114,30 +166,39 @@ def index(count, page):
     config = blogging_engine.config
     count = count or config.get("BLOGGING_POSTS_PER_PAGE", 10)
 
-    meta = _get_meta(storage, count, page)
-    offset = meta["offset"]
+    meta = _get_meta(storage, count, page, cursor=cursor)
     meta["is_user_blogger"] = _is_blogger(blogging_engine.blogger_permission)
     meta["count"] = count
     meta["page"] = page
 
     render = config.get("BLOGGING_RENDER_TEXT", True)
-    posts = storage.get_posts(count=count, offset=offset, include_draft=False,
-                              tag=None, user_id=None, recent=True)
+    posts = _get_page_posts(storage, meta, fields=_listing_fields(config))
     index_posts_fetched.send(blogging_engine.app, engine=blogging_engine,
                              posts=posts, meta=meta)
-    for post in posts:
-        blogging_engine.process_post(post, render=render)
+    blogging_engine.process_posts(posts, render=render)
     index_posts_processed.send(blogging_engine.app, engine=blogging_engine,
                                posts=posts, meta=meta)
     return render_template("blogging/index.html", posts=posts, meta=meta,
                            config=config)
 
 
+def _get_post(storage, config, post_id):
+    # with BLOGGING_SLUG_URLS, /page/<slug>/ finds the post by its stored
+    # slug; numeric ids are always post ids
+    if config.get("BLOGGING_SLUG_URLS", False) and \
+            not str(post_id).isdigit():
+        try:
+            return storage.get_post_by_slug(post_id)
+        except NotImplementedError:
+            pass
+    return storage.get_post_by_id(post_id)
+
+
 def page_by_id(post_id, slug):
     blogging_engine = _get_blogging_engine(current_app)
     storage = blogging_engine.storage
     config = blogging_engine.config
-    post = storage.get_post_by_id(post_id)
+    post = _get_post(storage, config, post_id)
     meta = {}
     meta["is_user_blogger"] = _is_blogger(blogging_engine.blogger_permission)
 
@@ -157,25 +218,23 @@ def page_by_id(post_id, slug):
         return redirect(url_for("blogging.index"))
 
 
-def posts_by_tag(tag, count, page):
+def posts_by_tag(tag, count, page, cursor=None):
     blogging_engine = _get_blogging_engine(current_app)
     storage = blogging_engine.storage
     config = blogging_engine.config
     count = count or config.get("BLOGGING_POSTS_PER_PAGE", 10)
-    meta = _get_meta(storage, count, page, tag=tag)
-    offset = meta["offset"]
+    meta = _get_meta(storage, count, page, tag=tag, cursor=cursor)
     meta["is_user_blogger"] = _is_blogger(blogging_engine.blogger_permission)
     meta["tag"] = tag
     meta["count"] = count
     meta["page"] = page
     render = config.get("BLOGGING_RENDER_TEXT", True)
-    posts = storage.get_posts(count=count, offset=offset, tag=tag,
-                              include_draft=False, user_id=None, recent=True)
+    posts = _get_page_posts(storage, meta, tag=tag,
+                            fields=_listing_fields(config))
     posts_by_tag_fetched.send(blogging_engine.app, engine=blogging_engine,
                               posts=posts, meta=meta)
     if len(posts):
-        for post in posts:
-            blogging_engine.process_post(post, render=render)
+        blogging_engine.process_posts(posts, render=render)
         posts_by_tag_processed.send(blogging_engine.app,
                                     engine=blogging_engine,
                                     posts=posts, meta=meta)
@@ -186,26 +245,24 @@ def posts_by_tag(tag, count, page):
         return redirect(url_for("blogging.index", post_id=None))
 
 
-def posts_by_author(user_id, count, page):
+def posts_by_author(user_id, count, page, cursor=None):
     blogging_engine = _get_blogging_engine(current_app)
     storage = blogging_engine.storage
     config = blogging_engine.config
     count = count or config.get("BLOGGING_POSTS_PER_PAGE", 10)
-    meta = _get_meta(storage, count, page, user_id=user_id)
-    offset = meta["offset"]
+    meta = _get_meta(storage, count, page, user_id=user_id, cursor=cursor)
     meta["is_user_blogger"] = _is_blogger(blogging_engine.blogger_permission)
     meta["user_id"] = user_id
     meta["count"] = count
     meta["page"] = page
 
-    posts = storage.get_posts(count=count, offset=offset, user_id=user_id,
-                              include_draft=False, tag=None, recent=True)
+    posts = _get_page_posts(storage, meta, user_id=user_id,
+                            fields=_listing_fields(config))
     render = config.get("BLOGGING_RENDER_TEXT", True)
     posts_by_author_fetched.send(blogging_engine.app, engine=blogging_engine,
                                  posts=posts, meta=meta)
     if len(posts):
-        for post in posts:
-            blogging_engine.process_post(post, render=render)
+        blogging_engine.process_posts(posts, render=render)
         posts_by_author_processed.send(blogging_engine.app,
                                        engine=blogging_engine, posts=posts,
                                        meta=meta)
@@ -216,12 +273,57 @@ def posts_by_author(user_id, count, page):
         return redirect(url_for("blogging.index", post_id=None))
 
 
+def search():
+    """
+    Serves the posts matching the ``q`` query argument, best match first.
+    The ranking comes from the storage's full-text index.
+
+    :return:
+    """
+    blogging_engine = _get_blogging_engine(current_app)
+    storage = blogging_engine.storage
+    config = blogging_engine.config
+    count = config.get("BLOGGING_POSTS_PER_PAGE", 10)
+    query = request.args.get("q", "").strip()
+    page = max(request.args.get("page", 1, type=int), 1)
+
+    try:
+        max_posts = storage.count_search_results(query) if query else 0
+    except NotImplementedError:
+        max_posts = 0
+    max_pages = int(math.ceil(float(max_posts)/float(count)))
+    page = min(page, max(max_pages, 1))
+    pagination = dict(prev_page=None, next_page=None)
+    if page > 1:
+        pagination["prev_page"] = url_for("blogging.search", q=query,
+                                          page=page-1)
+    if page < max_pages:
+        pagination["next_page"] = url_for("blogging.search", q=query,
+                                          page=page+1)
+    meta = dict(max_posts=max_posts, max_pages=max_pages, page=page,
+                offset=(page-1)*count, count=count, query=query,
+                pagination=pagination)
+    meta["is_user_blogger"] = _is_blogger(blogging_engine.blogger_permission)
+
+    posts = []
+    if max_posts:
+        posts = storage.search_posts(query, count=count,
+                                     offset=meta["offset"])
+    search_posts_fetched.send(blogging_engine.app, engine=blogging_engine,
+                              posts=posts, meta=meta)
+    render = config.get("BLOGGING_RENDER_TEXT", True)
+    blogging_engine.process_posts(posts, render=render)
+    search_posts_processed.send(blogging_engine.app, engine=blogging_engine,
+                                posts=posts, meta=meta)
+    if query and not posts:
+        flash("No posts found for this search!", "warning")
+    return render_template("blogging/index.html", posts=posts, meta=meta,
+                           config=config)
+
+
 @login_required
 def editor(post_id):
     blogging_engine = _get_blogging_engine(current_app)
-    cache = blogging_engine.cache
-    if cache:
-        _clear_cache(cache)
     try:
         with blogging_engine.blogger_permission.require():
             post_processor = blogging_engine.post_processor
@@ -241,8 +343,8 @@ def editor(post_id):
                     else:
                         post = {}
                     escape_text = config.get("BLOGGING_ESCAPE_MARKDOWN", True)
-                    pid = _store_form_data(form, storage, current_user, post,
-                                           escape_text)
+                    pid, slug = _store_form_data(form, storage, current_user,
+                                                 post, escape_text)
                     editor_post_saved.send(
                         blogging_engine.app,
                         engine=blogging_engine,
@@ -252,7 +354,6 @@ def editor(post_id):
                     )
                                          
                     flash("Update posted successfully!", "info")
-                    slug = post_processor.create_slug(form.title.data)
                     if isinstance(form, HomePageEditor):
                         return redirect(url_for('main.index'))
                     else:
@@ -299,9 +400,6 @@ def editor(post_id):
 @login_required
 def delete(post_id):
     blogging_engine = _get_blogging_engine(current_app)
-    cache = blogging_engine.cache
-    if cache:
-        _clear_cache(cache)
     try:
         with blogging_engine.blogger_permission.require():
             storage = blogging_engine.storage
@@ -327,18 +425,90 @@ def delete(post_id):
         return redirect(url_for("blogging.index", post_id=None))
 
 
+def _sitemap_posts(blogging_engine, posts, chunk_size=1000):
+    """
+    Adds the url and priority to the posts of the sitemap as they are
+    streamed, sending the sitemap signals for every ``chunk_size`` posts.
+    """
+    post_processor = blogging_engine.post_processor
+    chunk = list(itertools.islice(posts, chunk_size))
+    while chunk:
+        sitemap_posts_fetched.send(blogging_engine.app,
+                                   engine=blogging_engine, posts=chunk)
+        for post in chunk:
+            post["url"] = post_processor.construct_url(post)
+            post["priority"] = 0.8
+        sitemap_posts_processed.send(blogging_engine.app,
+                                     engine=blogging_engine, posts=chunk)
+        for post in chunk:
+            yield post
+        chunk = list(itertools.islice(posts, chunk_size))
+
+
+def _stream_template(template_name, **context):
+    current_app.update_template_context(context)
+    template = current_app.jinja_env.get_template(template_name)
+    stream = template.stream(context)
+    stream.enable_buffering(100)
+    return stream
+
+
 def sitemap():
     blogging_engine = _get_blogging_engine(current_app)
     storage = blogging_engine.storage
     config = blogging_engine.config
+    shard_size = config.get("BLOGGING_SITEMAP_SHARD_SIZE", 50000)
+    try:
+        if storage.count_posts() > shard_size:
+            # a sitemap holds at most 50,000 URLs
+            shards = storage.get_sitemap_shards(shard_size)
+            body = _stream_template("blogging/sitemap_index.xml",
+                                    shards=shards, config=config)
+        else:
+            posts = _sitemap_posts(blogging_engine,
+                                   storage.iter_sitemap_posts())
+            body = _stream_template("blogging/sitemap.xml", posts=posts,
+                                    config=config)
+    except NotImplementedError:
+        return _full_sitemap(blogging_engine)
+    response = current_app.response_class(stream_with_context(body))
+    response.headers["Content-Type"] = "application/xml"
+    return response
+
+
+def sitemap_shard(shard):
+    blogging_engine = _get_blogging_engine(current_app)
+    storage = blogging_engine.storage
+    config = blogging_engine.config
+    shard_size = config.get("BLOGGING_SITEMAP_SHARD_SIZE", 50000)
+    posts = storage.iter_sitemap_posts(first_id=(shard - 1) * shard_size + 1,
+                                       last_id=shard * shard_size)
+    first = next(posts, None)
+    if first is None:
+        abort(404)
+    posts = _sitemap_posts(blogging_engine, itertools.chain([first], posts))
+    # compressed as it is rendered, so the XML is never held whole
+    compressor = zlib.compressobj(9, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    chunks = [compressor.compress(part.encode("utf-8")) for part in
+              _stream_template("blogging/sitemap.xml", posts=posts,
+                               config=config)]
+    chunks.append(compressor.flush())
+    response = make_response(b"".join(chunks))
+    response.headers["Content-Type"] = "application/x-gzip"
+    return response
+
+
+def _full_sitemap(blogging_engine):
+    # for storages without the sitemap projection
+    storage = blogging_engine.storage
+    config = blogging_engine.config
     posts = storage.get_posts(count=None, offset=None, recent=True,
                               user_id=None, tag=None, include_draft=False)
     sitemap_posts_fetched.send(blogging_engine.app, engine=blogging_engine,
                                posts=posts)
 
     if len(posts):
-        for post in posts:
-            blogging_engine.process_post(post, render=False)
+        blogging_engine.process_posts(posts, render=False)
         sitemap_posts_processed.send(blogging_engine.app,
                                      engine=blogging_engine, posts=posts)
     sitemap_xml = render_template("blogging/sitemap.xml", posts=posts,
@@ -348,24 +518,27 @@ def sitemap():
     return response
 
 
-def feed():
+def feed(tag=None):
     blogging_engine = _get_blogging_engine(current_app)
     storage = blogging_engine.storage
     config = blogging_engine.config
     count = config.get("BLOGGING_FEED_LIMIT")
     posts = storage.get_posts(count=count, offset=None, recent=True,
-                              user_id=None, tag=None, include_draft=False)
+                              user_id=None, tag=tag, include_draft=False)
+    if tag is not None and not posts:
+        abort(404)
 
+    site_name = config.get("BLOGGING_SITENAME", "Flask-Blogging")
     feed = AtomFeed(
-        '%s - All Articles' % config.get("BLOGGING_SITENAME",
-                                         "Flask-Blogging"),
+        '%s - All Articles' % site_name if tag is None else
+        '%s - %s' % (site_name, storage.normalize_tag(tag)),
         feed_url=request.url, url=request.url_root, generator=None)
 
     feed_posts_fetched.send(blogging_engine.app, engine=blogging_engine,
                             posts=posts)
     if len(posts):
+        blogging_engine.process_posts(posts, render=True)
         for post in posts:
-            blogging_engine.process_post(post, render=True)
             feed.add(post["title"], ensureUtf(post["rendered_text"]),
                      content_type='html',
                      author=post["user_name"],
@@ -379,24 +552,216 @@ def feed():
     return response
 
 
+def stored_feed(tag=None):
+    """
+    Serves a feed kept up to date by ``FeedArtifacts`` with a single read
+    of the stored XML, validated by its size and modification time.
+    """
+    blogging_engine = _get_blogging_engine(current_app)
+    f = blogging_engine.feeds.open(tag)
+    if f is None:
+        abort(404)
+    with f:
+        stat = os.fstat(f.fileno())
+        data = f.read()
+    response = current_app.response_class(data)
+    response.headers["Content-Type"] = "application/xml"
+    response.set_etag("%x-%x" % (int(stat.st_mtime * 1000000), stat.st_size))
+    response.last_modified = datetime.datetime.utcfromtimestamp(
+        int(stat.st_mtime))
+    response.headers["Cache-Control"] = blogging_engine.config.get(
+        "BLOGGING_CACHE_CONTROL", "private, no-cache")
+    return response.make_conditional(request)
+
+
+def _get_validators(blogging_engine, post_id=None, tag=None, user_id=None):
+    """
+    The ETag and Last-Modified of a post, or of a listing of posts, made
+    from the latest ``last_modified_date``, the post count, the render
+    version, ``BLOGGING_ETAG_SALT`` (or what it returns, if callable, for
+    a site version that changes at runtime) and the user, without
+    fetching any post. ``None`` when the
+    response is not validated: for bloggers, while flashed messages are
+    pending, or when the storage can't tell.
+    """
+    if _is_blogger(blogging_engine.blogger_permission) or \
+            session.get("_flashes"):
+        return None
+    storage = blogging_engine.storage
+    try:
+        last_modified = storage.get_last_modified(post_id=post_id, tag=tag,
+                                                  user_id=user_id)
+    except NotImplementedError:
+        return None
+    if last_modified is None:
+        return None
+    # deleting a post leaves the latest change as it was, not the count
+    count = 1 if post_id is not None else \
+        storage.count_posts(tag=tag, user_id=user_id)
+    salt = blogging_engine.config.get("BLOGGING_ETAG_SALT", "")
+    if callable(salt):
+        salt = salt()
+    stamp = "%s|%s|%s|%s|%s" % (
+        last_modified.isoformat(), count,
+        blogging_engine.post_processor.render_version(), salt,
+        current_user.get_id())
+    return hashlib.sha1(stamp.encode("utf-8")).hexdigest(), last_modified
+
+
+def conditional_func(blogging_engine, func, filters):
+    """
+    Answers conditional GETs for the view ``func`` with a 304 before it
+    (or its memoized copy) runs, and adds the validators to the responses
+    it renders. ``filters`` maps the view arguments to the arguments of
+    ``_get_validators``. Only ``If-None-Match`` is answered: a deleted
+    post or a new ``BLOGGING_ETAG_SALT`` changes the ETag but leaves
+    the latest ``last_modified_date``, so a bare ``If-Modified-Since``
+    can't tell them.
+    """
+    config = blogging_engine.config
+
+    @functools.wraps(func)
+    def _conditional(**kwargs):
+        validators = _get_validators(blogging_engine, **filters(**kwargs))
+        if validators is not None and not is_resource_modified(
+                request.environ, etag=validators[0]):
+            response = current_app.response_class(status=304)
+        else:
+            response = make_response(func(**kwargs))
+            # a stale copy doesn't match the validators of the posts now
+            if validators is None or response.status_code != 200 or \
+                    g.get("blogging_stale"):
+                return response
+            # cached views hand out the same response object every time;
+            # streamed ones are new and are not read into memory here
+            if not response.is_streamed:
+                response = current_app.response_class(
+                    response.get_data(), response.status_code,
+                    Headers(response.headers))
+        response.set_etag(validators[0])
+        response.last_modified = validators[1]
+        if "Cache-Control" not in response.headers:
+            response.headers["Cache-Control"] = config.get(
+                "BLOGGING_CACHE_CONTROL", "private, no-cache")
+        return response
+    return _conditional
+
+
 def unless(blogging_engine):
-    # disable caching for bloggers. They can change state!
+    # disable caching for bloggers. They can change state! Pages shown
+    # with pending flashed messages (e.g. after logging in) are the
+    # user's own, too
     def _unless():
-        return _is_blogger(blogging_engine.blogger_permission)
+        return _is_blogger(blogging_engine.blogger_permission) or \
+            bool(session.get("_flashes"))
     return _unless
 
 
-def cached_func(blogging_engine, func):
+# a memoized view: the response, until when it is fresh and when the
+# cache drops it
+_CachedView = collections.namedtuple("_CachedView",
+                                     "response fresh_until expires")
+
+
+def cached_func(blogging_engine, func, namespaces, timeout=None):
+    """
+    Caches the responses of the view ``func`` under keys versioned with
+    the generations of the namespaces they show, which ``namespaces``
+    maps the view arguments to. The engine moves the namespaces a post
+    change affects to a new generation (see
+    ``BloggingEngine.invalidate_posts``).
+
+    A response is fresh for ``timeout`` (``BLOGGING_CACHE_TIMEOUT``)
+    seconds, then stale for ``BLOGGING_CACHE_GRACE`` more. A stale
+    response is served at once while a background thread renders the
+    view again; if that fails, e.g. because the database can't be read,
+    the stale response is served until the next try. Only responses with
+    the status 200 are cached.
+    """
     cache = blogging_engine.cache
     if cache is None:
         return func
-    else:
-        unless_func = unless(blogging_engine)
-        config = blogging_engine.config
-        cache_timeout = config.get("BLOGGING_CACHE_TIMEOUT", 60)  # 60 seconds
-        memoized_func = cache.memoize(
-            timeout=cache_timeout, unless=unless_func)(func)
-        return memoized_func
+    unless_func = unless(blogging_engine)
+    config = blogging_engine.config
+    logger = logging.getLogger(__name__)
+
+    def _fresh_for():
+        return timeout or config.get(
+            "BLOGGING_CACHE_TIMEOUT", 60)  # 60 seconds
+
+    def _store(key, response):
+        # redirects and errors, e.g. of a post that could not be read,
+        # are not cached
+        if getattr(response, "status_code", 200) != 200:
+            return
+        fresh_for = _fresh_for()
+        if not fresh_for:  # kept until invalidated
+            entry = _CachedView(response, float("inf"), 0)
+        else:
+            now = time.time()
+            expires = now + fresh_for + config.get("BLOGGING_CACHE_GRACE",
+                                                   300)
+            entry = _CachedView(response, now + fresh_for, expires)
+        try:
+            cache.set(key, entry, timeout=_remaining(entry))
+        except Exception as e:
+            logger.exception(str(e))
+
+    def _refresh(key, entry, kwargs):
+        # marks the stale entry fresh for as long as a refresh may take,
+        # so the other requests serve it rather than refresh it too; a
+        # refresh that fails is tried again once that time is up
+        marked = entry._replace(fresh_until=min(time.time() + _fresh_for(),
+                                                entry.expires))
+        try:
+            cache.set(key, marked, timeout=_remaining(marked))
+        except Exception as e:
+            logger.exception(str(e))
+            return
+
+        @copy_current_request_context
+        def _render():
+            # the storage raises its read errors, see
+            # SQLAStorage._read_failed
+            g.blogging_raise_read_errors = True
+            try:
+                response = func(**kwargs)
+            except Exception as e:
+                logger.exception(str(e))
+                return
+            _store(key, response)
+        threading.Thread(target=_render, name="refresh %s" % key,
+                         daemon=True).start()
+
+    @functools.wraps(func)
+    def _cached(**kwargs):
+        if unless_func():
+            return func(**kwargs)
+        try:
+            generations = get_generations(cache, namespaces(**kwargs))
+            stamp = repr((sorted(kwargs.items()), generations))
+            key = "view:%s:%s" % (func.__name__, hashlib.sha1(
+                stamp.encode("utf-8")).hexdigest())
+            entry = cache.get(key)
+        except Exception as e:
+            logger.exception(str(e))
+            return func(**kwargs)
+        if isinstance(entry, _CachedView):
+            if entry.fresh_until <= time.time():
+                _refresh(key, entry, kwargs)
+                g.blogging_stale = True
+            return entry.response
+        response = func(**kwargs)
+        _store(key, response)
+        return response
+    return _cached
+
+
+def _remaining(entry):
+    # the cache timeout of an entry; 0 keeps it
+    if not entry.expires:
+        return 0
+    return max(1, int(math.ceil(entry.expires - time.time())))
 
 
 def create_blueprint(import_name, blogging_engine):
@@ -404,31 +769,51 @@ def create_blueprint(import_name, blogging_engine):
     blog_app = Blueprint("blogging", import_name, template_folder='templates')
 
     # register index
-    index_func = cached_func(blogging_engine, index)
+    index_func = conditional_func(blogging_engine,
+                                  cached_func(blogging_engine, index,
+                                              lambda **kwargs: ["posts"]),
+                                  lambda **kwargs: {})
     blog_app.add_url_rule("/", defaults={"count": None, "page": 1},
                           view_func=index_func)
     blog_app.add_url_rule("/<int:count>/", defaults={"page": 1},
                           view_func=index_func)
     blog_app.add_url_rule("/<int:count>/<int:page>/", view_func=index_func)
+    blog_app.add_url_rule("/<int:count>/c/<cursor>/", defaults={"page": 1},
+                          view_func=index_func)
 
     # register page_by_id
-    page_by_id_func = cached_func(blogging_engine, page_by_id)
+    page_by_id_func = conditional_func(
+        blogging_engine,
+        cached_func(blogging_engine, page_by_id,
+                    lambda post_id, slug: ["post:%s" % post_id]),
+        lambda post_id, slug: dict(post_id=post_id))
     blog_app.add_url_rule("/page/<post_id>/", defaults={"slug": ""},
                           view_func=page_by_id_func)
     blog_app.add_url_rule("/page/<post_id>/<slug>/",
                           view_func=page_by_id_func)
 
     # register posts_by_tag
-    posts_by_tag_func = cached_func(blogging_engine, posts_by_tag)
+    posts_by_tag_func = conditional_func(
+        blogging_engine,
+        cached_func(blogging_engine, posts_by_tag,
+                    lambda tag, **kwargs: [
+                        "tag:%s" % Storage.normalize_tag(tag)]),
+        lambda tag, **kwargs: dict(tag=tag))
     blog_app.add_url_rule("/tag/<tag>/", defaults=dict(count=None, page=1),
                           view_func=posts_by_tag_func)
     blog_app.add_url_rule("/tag/<tag>/<int:count>/", defaults=dict(page=1),
                           view_func=posts_by_tag_func)
     blog_app.add_url_rule("/tag/<tag>/<int:count>/<int:page>/",
                           view_func=posts_by_tag_func)
+    blog_app.add_url_rule("/tag/<tag>/<int:count>/c/<cursor>/",
+                          defaults=dict(page=1), view_func=posts_by_tag_func)
 
     # register posts_by_author
-    posts_by_author_func = cached_func(blogging_engine, posts_by_author)
+    posts_by_author_func = conditional_func(
+        blogging_engine,
+        cached_func(blogging_engine, posts_by_author,
+                    lambda user_id, **kwargs: ["author:%s" % user_id]),
+        lambda user_id, **kwargs: dict(user_id=user_id))
     blog_app.add_url_rule("/author/<user_id>/",
                           defaults=dict(count=None, page=1),
                           view_func=posts_by_author_func)
@@ -437,6 +822,13 @@ def create_blueprint(import_name, blogging_engine):
                           view_func=posts_by_author_func)
     blog_app.add_url_rule("/author/<user_id>/<int:count>/<int:page>/",
                           view_func=posts_by_author_func)
+    blog_app.add_url_rule("/author/<user_id>/<int:count>/c/<cursor>/",
+                          defaults=dict(page=1),
+                          view_func=posts_by_author_func)
+
+    # register search; results depend on the query string, which the
+    # cached views don't key on, so it is never cached
+    blog_app.add_url_rule("/search/", view_func=search)
 
     # register editor
     editor_func = editor  # For now lets not cache this
@@ -452,11 +844,36 @@ def create_blueprint(import_name, blogging_engine):
                           view_func=delete_func)
 
     # register sitemap
-    sitemap_func = cached_func(blogging_engine, sitemap)
+    # streamed from the id, title and date of the posts, so not cached
+    sitemap_func = conditional_func(blogging_engine, sitemap, lambda: {})
     blog_app.add_url_rule("/sitemap.xml", view_func=sitemap_func)
 
+    # the shards of a sitemap split up by post id, kept until a post in
+    # the shard changes
+    sitemap_shard_func = cached_func(
+        blogging_engine, sitemap_shard,
+        lambda shard: ["sitemap:%s" % shard],
+        timeout=blogging_engine.config.get(
+            "BLOGGING_SITEMAP_CACHE_TIMEOUT", 24 * 60 * 60))
+    blog_app.add_url_rule("/sitemap-<int:shard>.xml.gz",
+                          view_func=sitemap_shard_func)
+
     # register feed
-    feed_func = cached_func(blogging_engine, feed)
-    blog_app.add_url_rule('/feeds/all.atom.xml', view_func=feed_func)
+    if blogging_engine.feeds is not None:
+        feed_func = tag_feed_func = stored_feed
+    else:
+        feed_func = conditional_func(blogging_engine,
+                                     cached_func(blogging_engine, feed,
+                                                 lambda: ["posts"]),
+                                     lambda: {})
+        tag_feed_func = conditional_func(
+            blogging_engine,
+            cached_func(blogging_engine, feed,
+                        lambda tag: ["tag:%s" % Storage.normalize_tag(tag)]),
+            lambda tag: dict(tag=tag))
+    blog_app.add_url_rule('/feeds/all.atom.xml', endpoint="feed",
+                          view_func=feed_func)
+    blog_app.add_url_rule('/feeds/tag/<tag>.atom.xml', endpoint="tag_feed",
+                          view_func=tag_feed_func)
 
     return blog_app
@@ -0,0 +1,69 @@
+"""full-text search index over blogging posts
+
+Revision ID: 3b9d7f1c2a60
+Revises: e83b5a91f0c4
+Create Date: 2026-10-18 21:12:05.604731
+
+"""
+from alembic import op
+import logging
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = '3b9d7f1c2a60'
+down_revision = 'e83b5a91f0c4'
+branch_labels = None
+depends_on = None
+
+
+PG_DOCUMENT = ("setweight(to_tsvector('english', coalesce(title, '')), 'A')"
+               " || setweight(to_tsvector('english', coalesce(text, '')),"
+               " 'B')")
+
+
+def _create_fts_table(bind):
+    # SQLite may be built without FTS5; SQLAStorage then searches
+    # without the index, as it does when it creates the table itself
+    try:
+        bind.execute("CREATE VIRTUAL TABLE post_fts USING fts5(title, text)")
+    except sa.exc.OperationalError as e:
+        if 'no such module' not in str(e):
+            raise
+        logging.getLogger('alembic.env').warning(
+            'Skipping the search index, SQLite has no FTS5 support: %s' % e)
+        return False
+    return True
+
+
+def upgrade():
+    bind = op.get_bind()
+    tables = sa.inspect(bind).get_table_names()
+    if bind.dialect.name == 'sqlite' and 'post_fts' not in tables:
+        if _create_fts_table(bind):
+            op.execute("INSERT INTO post_fts (rowid, title, text) "
+                       "SELECT id, title, text FROM post")
+    elif bind.dialect.name == 'postgresql' and 'post_search' not in tables:
+        op.create_table(
+            'post_search',
+            sa.Column('post_id', sa.Integer(), nullable=False),
+            sa.Column('document', postgresql.TSVECTOR(), nullable=False),
+            sa.ForeignKeyConstraint(['post_id'], ['post.id'],
+                                    onupdate='CASCADE', ondelete='CASCADE'),
+            sa.PrimaryKeyConstraint('post_id')
+        )
+        op.create_index('ix_post_search_document', 'post_search',
+                        ['document'], postgresql_using='gin')
+        op.execute("INSERT INTO post_search (post_id, document) "
+                   "SELECT id, %s FROM post" % PG_DOCUMENT)
+
+
+def downgrade():
+    bind = op.get_bind()
+    tables = sa.inspect(bind).get_table_names()
+    if bind.dialect.name == 'sqlite' and 'post_fts' in tables:
+        op.execute("DROP TABLE post_fts")
+    elif bind.dialect.name == 'postgresql' and 'post_search' in tables:
+        op.drop_index('ix_post_search_document', table_name='post_search')
+        op.drop_table('post_search')
@@ -0,0 +1,53 @@
+"""persisted post renderings
+
+Revision ID: 7a2e64c9d1b3
+Revises: 3b9d7f1c2a60
+Create Date: 2026-10-18 22:04:39.271590
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7a2e64c9d1b3'
+down_revision = '3b9d7f1c2a60'
+branch_labels = None
+depends_on = None
+
+
+COLUMNS = [
+    ('rendered_text', sa.Text()),
+    ('rendered_meta', sa.Text()),
+    ('render_version', sa.String(length=64)),
+]
+
+
+def _post_columns():
+    inspector = sa.inspect(op.get_bind())
+    if 'post' not in inspector.get_table_names():
+        return None
+    return [column['name'] for column in inspector.get_columns('post')]
+
+
+def upgrade():
+    # existing posts are rendered on first view, or all at once with
+    # `flask blogging render`
+    columns = _post_columns()
+    if columns is None:
+        return
+    with op.batch_alter_table('post') as batch_op:
+        for name, column_type in COLUMNS:
+            if name not in columns:
+                batch_op.add_column(sa.Column(name, column_type,
+                                              nullable=True))
+
+
+def downgrade():
+    columns = _post_columns()
+    if columns is None:
+        return
+    with op.batch_alter_table('post') as batch_op:
+        for name, _ in reversed(COLUMNS):
+            if name in columns:
+                batch_op.drop_column(name)
@@ -0,0 +1,39 @@
+"""index post changes for conditional GETs
+
+Revision ID: 9c4e1f2b7d58
+Revises: 7a2e64c9d1b3
+Create Date: 2026-10-19 09:12:05.448213
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9c4e1f2b7d58'
+down_revision = '7a2e64c9d1b3'
+branch_labels = None
+depends_on = None
+
+
+INDEX = 'ix_post_draft_modified'
+
+
+def _post_indexes():
+    inspector = sa.inspect(op.get_bind())
+    if 'post' not in inspector.get_table_names():
+        return None
+    return [index['name'] for index in inspector.get_indexes('post')]
+
+
+def upgrade():
+    # the ETag/Last-Modified validators read max(last_modified_date)
+    indexes = _post_indexes()
+    if indexes is not None and INDEX not in indexes:
+        op.create_index(INDEX, 'post', ['draft', 'last_modified_date'])
+
+
+def downgrade():
+    indexes = _post_indexes()
+    if indexes is not None and INDEX in indexes:
+        op.drop_index(INDEX, table_name='post')
@@ -0,0 +1,52 @@
+"""post excerpts for listings
+
+Revision ID: b5d83e0f6a21
+Revises: 9c4e1f2b7d58
+Create Date: 2026-10-19 14:27:51.903114
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b5d83e0f6a21'
+down_revision = '9c4e1f2b7d58'
+branch_labels = None
+depends_on = None
+
+
+COLUMNS = [
+    ('excerpt', sa.Text()),
+    ('rendered_excerpt', sa.Text()),
+]
+
+
+def _post_columns():
+    inspector = sa.inspect(op.get_bind())
+    if 'post' not in inspector.get_table_names():
+        return None
+    return [column['name'] for column in inspector.get_columns('post')]
+
+
+def upgrade():
+    # filled in when posts are rendered again, which the renderer version
+    # bump makes happen on first view or with `flask blogging render`
+    columns = _post_columns()
+    if columns is None:
+        return
+    with op.batch_alter_table('post') as batch_op:
+        for name, column_type in COLUMNS:
+            if name not in columns:
+                batch_op.add_column(sa.Column(name, column_type,
+                                              nullable=True))
+
+
+def downgrade():
+    columns = _post_columns()
+    if columns is None:
+        return
+    with op.batch_alter_table('post') as batch_op:
+        for name, _ in reversed(COLUMNS):
+            if name in columns:
+                batch_op.drop_column(name)
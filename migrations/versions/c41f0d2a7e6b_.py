@@ -0,0 +1,38 @@
+"""keyset pagination index on blogging posts
+
+Revision ID: c41f0d2a7e6b
+Revises: 5346190a2f75
+Create Date: 2026-10-18 20:02:11.412908
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c41f0d2a7e6b'
+down_revision = '5346190a2f75'
+branch_labels = None
+depends_on = None
+
+
+def _post_indexes():
+    inspector = sa.inspect(op.get_bind())
+    if 'post' not in inspector.get_table_names():
+        return None
+    return [index['name'] for index in inspector.get_indexes('post')]
+
+
+def upgrade():
+    # the blogging tables are created by SQLAStorage, so only touch
+    # databases where the index is missing
+    indexes = _post_indexes()
+    if indexes is not None and 'ix_post_draft_date_id' not in indexes:
+        op.create_index('ix_post_draft_date_id', 'post',
+                        ['draft', 'post_date', 'id'])
+
+
+def downgrade():
+    indexes = _post_indexes()
+    if indexes is not None and 'ix_post_draft_date_id' in indexes:
+        op.drop_index('ix_post_draft_date_id', table_name='post')
@@ -0,0 +1,61 @@
+"""indexed slug column on blogging posts
+
+Revision ID: d41a7c3e9f08
+Revises: b5d83e0f6a21
+Create Date: 2026-10-19 16:05:12.418530
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from slugify import slugify
+
+
+# revision identifiers, used by Alembic.
+revision = 'd41a7c3e9f08'
+down_revision = 'b5d83e0f6a21'
+branch_labels = None
+depends_on = None
+
+
+def _inspect_post():
+    inspector = sa.inspect(op.get_bind())
+    if 'post' not in inspector.get_table_names():
+        return None, None
+    columns = [column['name'] for column in inspector.get_columns('post')]
+    indexes = [index['name'] for index in inspector.get_indexes('post')]
+    return columns, indexes
+
+
+def upgrade():
+    columns, indexes = _inspect_post()
+    if columns is None:
+        return
+    if 'slug' not in columns:
+        with op.batch_alter_table('post') as batch_op:
+            batch_op.add_column(sa.Column('slug', sa.String(length=256),
+                                          nullable=True))
+    # the slugs of the existing posts, as save_post makes them
+    bind = op.get_bind()
+    post = sa.table('post', sa.column('id', sa.Integer),
+                    sa.column('title', sa.String),
+                    sa.column('slug', sa.String))
+    rows = bind.execute(sa.select([post.c.id, post.c.title])
+                        .where(post.c.slug.is_(None))).fetchall()
+    if rows:
+        bind.execute(post.update().where(post.c.id == sa.bindparam('b_id'))
+                     .values(slug=sa.bindparam('b_slug')),
+                     [dict(b_id=id, b_slug=slugify(title or ''))
+                      for id, title in rows])
+    if 'ix_post_slug' not in indexes:
+        op.create_index('ix_post_slug', 'post', ['slug'])
+
+
+def downgrade():
+    columns, indexes = _inspect_post()
+    if columns is None:
+        return
+    if 'ix_post_slug' in indexes:
+        op.drop_index('ix_post_slug', table_name='post')
+    if 'slug' in columns:
+        with op.batch_alter_table('post') as batch_op:
+            batch_op.drop_column('slug')
@@ -0,0 +1,108 @@
+"""create blogging tables for lazily initialized storage
+
+Revision ID: e83b5a91f0c4
+Revises: c41f0d2a7e6b
+Create Date: 2026-10-18 20:31:47.118204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e83b5a91f0c4'
+down_revision = 'c41f0d2a7e6b'
+branch_labels = None
+depends_on = None
+
+
+# SQLAStorage(lazy=True) no longer creates its tables at boot, so they
+# are created here instead. Existing installs already have them (created
+# by the storage itself), hence every step checks first.
+RECOUNT = [
+    """INSERT INTO post_counts (tag, user_id, draft, count)
+       SELECT '', '', post.draft, count(DISTINCT post.id)
+       FROM post GROUP BY post.draft""",
+    """INSERT INTO post_counts (tag, user_id, draft, count)
+       SELECT '', user_posts.user_id, post.draft, count(DISTINCT post.id)
+       FROM post JOIN user_posts ON user_posts.post_id = post.id
+       GROUP BY user_posts.user_id, post.draft""",
+    """INSERT INTO post_counts (tag, user_id, draft, count)
+       SELECT tag.text, '', post.draft, count(DISTINCT post.id)
+       FROM post JOIN tag_posts ON tag_posts.post_id = post.id
+       JOIN tag ON tag.id = tag_posts.tag_id
+       GROUP BY tag.text, post.draft""",
+    """INSERT INTO post_counts (tag, user_id, draft, count)
+       SELECT tag.text, user_posts.user_id, post.draft,
+              count(DISTINCT post.id)
+       FROM post JOIN tag_posts ON tag_posts.post_id = post.id
+       JOIN tag ON tag.id = tag_posts.tag_id
+       JOIN user_posts ON user_posts.post_id = post.id
+       GROUP BY tag.text, user_posts.user_id, post.draft""",
+]
+
+
+def upgrade():
+    tables = sa.inspect(op.get_bind()).get_table_names()
+    if 'post' not in tables:
+        op.create_table(
+            'post',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('title', sa.String(length=256), nullable=True),
+            sa.Column('text', sa.Text(), nullable=True),
+            sa.Column('post_date', sa.DateTime(), nullable=True),
+            sa.Column('last_modified_date', sa.DateTime(), nullable=True),
+            sa.Column('draft', sa.SmallInteger(), nullable=True),
+            sa.PrimaryKeyConstraint('id')
+        )
+        op.create_index('ix_post_draft_date_id', 'post',
+                        ['draft', 'post_date', 'id'])
+    if 'tag' not in tables:
+        op.create_table(
+            'tag',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('text', sa.String(length=128), nullable=True),
+            sa.PrimaryKeyConstraint('id')
+        )
+        op.create_index('ix_tag_text', 'tag', ['text'], unique=True)
+    if 'tag_posts' not in tables:
+        op.create_table(
+            'tag_posts',
+            sa.Column('tag_id', sa.Integer(), nullable=True),
+            sa.Column('post_id', sa.Integer(), nullable=True),
+            sa.ForeignKeyConstraint(['post_id'], ['post.id'],
+                                    onupdate='CASCADE', ondelete='CASCADE'),
+            sa.ForeignKeyConstraint(['tag_id'], ['tag.id'],
+                                    onupdate='CASCADE', ondelete='CASCADE'),
+            sa.UniqueConstraint('tag_id', 'post_id', name='uix_1')
+        )
+        op.create_index('ix_tag_posts_post_id', 'tag_posts', ['post_id'])
+        op.create_index('ix_tag_posts_tag_id', 'tag_posts', ['tag_id'])
+    if 'user_posts' not in tables:
+        op.create_table(
+            'user_posts',
+            sa.Column('user_id', sa.String(length=128), nullable=True),
+            sa.Column('post_id', sa.Integer(), nullable=True),
+            sa.ForeignKeyConstraint(['post_id'], ['post.id'],
+                                    onupdate='CASCADE', ondelete='CASCADE'),
+            sa.UniqueConstraint('user_id', 'post_id', name='uix_2')
+        )
+        op.create_index('ix_user_posts_post_id', 'user_posts', ['post_id'])
+        op.create_index('ix_user_posts_user_id', 'user_posts', ['user_id'])
+    if 'post_counts' not in tables:
+        op.create_table(
+            'post_counts',
+            sa.Column('tag', sa.String(length=128), nullable=False),
+            sa.Column('user_id', sa.String(length=128), nullable=False),
+            sa.Column('draft', sa.SmallInteger(), nullable=False),
+            sa.Column('count', sa.Integer(), nullable=False),
+            sa.PrimaryKeyConstraint('tag', 'user_id', 'draft')
+        )
+        for statement in RECOUNT:
+            op.execute(statement)
+
+
+def downgrade():
+    # the blogging tables predate this revision on most installs, so
+    # leave them in place
+    pass
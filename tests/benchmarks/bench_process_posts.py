@@ -0,0 +1,81 @@
+'''
+Measures BloggingEngine.process_posts over a 5,000 post archive (the
+size of a full sitemap or a large feed) with each
+BLOGGING_RENDER_WORKERS / BLOGGING_RENDER_EXECUTOR setting. Every run
+starts from unrendered posts.
+
+    python tests/benchmarks/bench_process_posts.py [posts] [workers]
+'''
+from datetime import datetime, timedelta
+import os
+import sys
+import time
+
+from flask import Flask
+from flask_login import LoginManager
+import sqlalchemy as sqla
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..'))
+from flask_blogging_patron import BloggingEngine, SQLAStorage  # noqa: E402
+
+TEXT = '''Title: Update %d
+
+Some **bold** text, a [link](https://example.com) and $$x^%d$$.
+
+![cover](/static/uploads/%d.png)
+
+* one
+* two
+'''
+
+
+def build_app(posts):
+    app = Flask(__name__)
+    app.config.update(SECRET_KEY='bench', SERVER_NAME='localhost')
+    LoginManager(app)
+    storage = SQLAStorage(sqla.create_engine('sqlite://'),
+                          metadata=sqla.MetaData())
+    base = datetime(2019, 1, 1)
+    storage.save_posts_bulk(
+        dict(title='Post %d' % i, text=TEXT % (i, i, i), user_id=i % 5,
+             tags=['a'], post_date=base + timedelta(hours=i))
+        for i in range(posts))
+    engine = BloggingEngine(app, storage)
+    engine.users_loader(lambda ids: dict((i, 'user %s' % i) for i in ids))
+    return app, engine
+
+
+def run(app, engine, posts, executor, workers):
+    app.config['BLOGGING_RENDER_WORKERS'] = workers
+    app.config['BLOGGING_RENDER_EXECUTOR'] = executor
+    engine._render_executor = None
+    with app.test_request_context('/'):
+        batch = [dict((k, v) for k, v in post.items()
+                      if k not in ('rendered_text', 'meta', 'render_version'))
+                 for post in posts]
+        if engine.render_executor is not None:
+            # start the pool outside the timing
+            list(engine.render_executor.map(abs, range(workers)))
+        start = time.time()
+        engine.process_posts(batch, render=True)
+        seconds = time.time() - start
+    if engine._render_executor is not None:
+        engine._render_executor.shutdown()
+    return seconds, [post['rendered_text'] for post in batch]
+
+
+def main(count=5000, workers=4):
+    app, engine = build_app(count)
+    posts = engine.storage.get_posts(count=None)
+    expected = None
+    for executor, n in (('thread', 0), ('thread', workers),
+                        ('process', workers)):
+        seconds, rendered = run(app, engine, posts, executor, n)
+        expected = expected or rendered
+        assert rendered == expected, 'render output differs'
+        print('%-7s workers=%d %6.2f s  %6.0f posts/s' %
+              (executor if n else 'serial', n, seconds, count / seconds))
+
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:]])
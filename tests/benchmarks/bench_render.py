@@ -0,0 +1,45 @@
+'''
+Measures Markdown render throughput per post with the per thread
+Markdown instance that PostProcessor reuses, against building a new
+Markdown instance for every post (the behaviour before it was pooled).
+
+    python tests/benchmarks/bench_render.py [posts]
+'''
+import os
+import sys
+import timeit
+
+import markdown
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..'))
+from flask_blogging_patron import PostProcessor  # noqa: E402
+
+TEXT = '''Title: Weekly update
+Tags: news
+
+Some **bold** text, a [link](https://example.com) and $$e^{i\\pi} = -1$$.
+
+![cover](/static/uploads/cover.png)
+
+* one
+* two
+'''
+
+
+def fresh(post):
+    md = markdown.Markdown(extensions=PostProcessor.all_extensions())
+    post['rendered_text'] = md.convert(post['text'])
+    post['meta'] = md.Meta
+
+
+def main(posts=2000):
+    for name, render in (('new per post', fresh),
+                         ('pooled', PostProcessor.render_text)):
+        seconds = min(timeit.repeat(lambda: render(dict(text=TEXT)),
+                                    number=posts, repeat=3)) / posts
+        print('%-13s %7.1f us per post  %8.0f posts/s' %
+              (name, seconds * 1e6, 1 / seconds))
+
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:]])
@@ -0,0 +1,149 @@
+'''
+Stress test for the SQLite profile: several processes (standing in for
+gunicorn workers and email threads) save posts through SQLAStorage,
+import posts in long chunked transactions, apply IPN-style
+read-modify-write updates to a user table and page through posts, all
+on one database file. Reports the number of
+"database is locked" errors with stock settings and with
+apply_sqlite_profile.
+
+    python tests/benchmarks/bench_sqlite_locking.py [seconds] [workers]
+'''
+from datetime import datetime
+import logging
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+import sqlalchemy as sqla
+from sqlalchemy.pool import NullPool
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..'))
+from flask_blogging_patron import SQLAStorage, \
+    apply_sqlite_profile  # noqa: E402
+
+USERS = 50
+IMPORT_CHUNK = 200
+
+
+def user_table(meta):
+    return sqla.Table('user', meta,
+                      sqla.Column('id', sqla.Integer, primary_key=True),
+                      sqla.Column('expiration', sqla.DateTime),
+                      sqla.Column('renewals', sqla.Integer))
+
+
+def make_engine(path, profile):
+    # NullPool, as Flask-SQLAlchemy uses for SQLite without a pool size
+    engine = sqla.create_engine('sqlite:///' + path, poolclass=NullPool)
+    if profile:
+        apply_sqlite_profile(engine)
+    return engine
+
+
+def build_database(path):
+    engine = make_engine(path, False)
+    meta = sqla.MetaData()
+    users = user_table(meta)
+    meta.create_all(engine)
+    engine.execute(users.insert(), [dict(id=i, renewals=0)
+                                    for i in range(USERS)])
+    storage = SQLAStorage(engine, metadata=sqla.MetaData())
+    for i in range(200):
+        storage.save_post('Post %d' % i, 'text', 1, ['a', 'b'])
+    engine.dispose()
+
+
+def is_locked(e):
+    return 'database is locked' in str(e)
+
+
+def editor(storage, engine, users, i):
+    # SQLAStorage logs and swallows its errors, returning None
+    return storage.save_post('Stress %d' % i, 'text ' * 50, 1,
+                             ['a', 'stress']) is not None
+
+
+def importer(storage, engine, users, i):
+    # `flask blogging import`: one long write transaction per chunk
+    posts = [dict(title='Import %d.%d' % (i, j), text='text ' * 200,
+                  user_id=2, tags=['import', 'tag %d' % j])
+             for j in range(IMPORT_CHUNK)]
+    return storage.save_posts_bulk(posts, chunk_size=IMPORT_CHUNK) == \
+        IMPORT_CHUNK
+
+
+def ipn(storage, engine, users, i):
+    with engine.begin() as conn:
+        user_id = i % USERS
+        row = conn.execute(sqla.select([users.c.renewals]).where(
+            users.c.id == user_id)).fetchone()
+        conn.execute(users.update().where(users.c.id == user_id).values(
+            renewals=row[0] + 1, expiration=datetime.utcnow()))
+    return True
+
+
+def reader(storage, engine, users, i):
+    storage.get_posts(count=10, offset=(i % 10) * 10)
+    storage.count_posts(tag='a')
+    return True
+
+
+def worker(path, profile, role, seconds, results):
+    logging.getLogger('flask-blogging').disabled = True
+    engine = make_engine(path, profile)
+    storage = SQLAStorage(engine, metadata=sqla.MetaData(), lazy=True)
+    users = user_table(sqla.MetaData())
+    action = dict(editor=editor, importer=importer, ipn=ipn,
+                  reader=reader)[role]
+    done = failed = 0
+    deadline = time.time() + seconds
+    i = 0
+    while time.time() < deadline:
+        i += 1
+        try:
+            if action(storage, engine, users, i):
+                done += 1
+            else:
+                failed += 1
+        except sqla.exc.OperationalError as e:
+            if not is_locked(e):
+                raise
+            failed += 1
+    results.put((role, done, failed))
+
+
+def run(path, profile, seconds, workers):
+    roles = ['editor', 'importer', 'ipn', 'reader'] * workers
+    results = multiprocessing.Queue()
+    procs = [multiprocessing.Process(target=worker,
+                                     args=(path, profile, role, seconds,
+                                           results))
+             for role in roles]
+    for p in procs:
+        p.start()
+    totals = {}
+    for _ in procs:
+        role, done, failed = results.get()
+        d, f = totals.get(role, (0, 0))
+        totals[role] = (d + done, f + failed)
+    for p in procs:
+        p.join()
+    return totals
+
+
+def main(seconds=10, workers=10):
+    for profile in (False, True):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'stress.db')
+            build_database(path)
+            totals = run(path, profile, seconds, workers)
+        print('profile=%-5s %s' % (profile, '  '.join(
+            '%s: %d ok / %d locked' % (role, d, f)
+            for role, (d, f) in sorted(totals.items()))))
+
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:]])
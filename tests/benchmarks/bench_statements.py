@@ -0,0 +1,61 @@
+'''
+Measures the per-call cost of the hot SQLAStorage reads with the
+statement templates and compiled cache warm, against rebuilding and
+recompiling every statement on each call (the behaviour before the
+templates were introduced).
+
+    python tests/benchmarks/bench_statements.py [calls]
+'''
+from datetime import datetime, timedelta
+import os
+import sys
+import timeit
+
+import sqlalchemy as sqla
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..'))
+from flask_blogging_patron import SQLAStorage  # noqa: E402
+
+
+def build_storage(posts=200):
+    # in memory, so the numbers are dominated by the Python side
+    storage = SQLAStorage(sqla.create_engine('sqlite://'),
+                          metadata=sqla.MetaData())
+    base = datetime(2019, 1, 1)
+    storage.save_posts_bulk(
+        dict(title='Post %d' % i, text='text', user_id=i % 3,
+             tags=['a', 'b'][:i % 3], post_date=base + timedelta(hours=i))
+        for i in range(posts))
+    return storage
+
+
+def calls(storage):
+    return [
+        ('get_post_by_id', lambda: storage.get_post_by_id(42)),
+        ('get_posts', lambda: storage.get_posts(count=10, offset=20)),
+        ('get_posts tag', lambda: storage.get_posts(count=10, tag='a')),
+        ('count_posts', lambda: storage.count_posts(tag='a', user_id=1)),
+    ]
+
+
+def cold(storage, call):
+    def run():
+        storage._statements.clear()
+        storage._compiled_cache.clear()
+        call()
+    return run
+
+
+def main(number=2000):
+    storage = build_storage()
+    for name, call in calls(storage):
+        call()
+        warm = min(timeit.repeat(call, number=number, repeat=3)) / number
+        rebuilt = min(timeit.repeat(cold(storage, call), number=number,
+                                    repeat=3)) / number
+        print('%-15s rebuilt %7.1f us  templated %7.1f us  (%.1fx)' %
+              (name, rebuilt * 1e6, warm * 1e6, rebuilt / warm))
+
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:]])
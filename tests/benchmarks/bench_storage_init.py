@@ -0,0 +1,55 @@
+'''
+Measures how long SQLAStorage takes to construct, i.e. the per-worker
+cost paid inside create_app on every gunicorn boot and HUP.
+
+    python tests/benchmarks/bench_storage_init.py [runs]
+'''
+from datetime import datetime
+import os
+import sys
+import tempfile
+import timeit
+
+import sqlalchemy as sqla
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..'))
+from flask_blogging_patron import SQLAStorage  # noqa: E402
+
+
+def build_database(path, app_tables=15, posts=200):
+    engine = sqla.create_engine('sqlite:///' + path)
+    meta = sqla.MetaData()
+    # stand-ins for the app's own models, which the eager path reflects
+    for i in range(app_tables):
+        sqla.Table('app_table_%d' % i, meta,
+                   sqla.Column('id', sqla.Integer, primary_key=True),
+                   sqla.Column('name', sqla.String(64), index=True),
+                   sqla.Column('value', sqla.Text))
+    meta.create_all(engine)
+    storage = SQLAStorage(engine, metadata=sqla.MetaData())
+    for i in range(posts):
+        storage.save_post('Post %d' % i, 'text', 1, ['a', 'b'],
+                          post_date=datetime(2019, 1, 1))
+    engine.dispose()
+
+
+def boot(path, lazy):
+    # a fresh engine and metadata, as in a newly forked worker
+    engine = sqla.create_engine('sqlite:///' + path)
+    SQLAStorage(engine, metadata=sqla.MetaData(), lazy=lazy)
+    engine.dispose()
+
+
+def main(runs=50):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'bench.db')
+        build_database(path)
+        for lazy in (False, True):
+            seconds = min(timeit.repeat(lambda: boot(path, lazy),
+                                        number=runs, repeat=3)) / runs
+            print('lazy=%-5s %8.2f ms per storage init' %
+                  (lazy, seconds * 1000))
+
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:]])
@@ -2,7 +2,12 @@ from app import create_app, db
 from app.models import User, PriceLevel, Email
 from tests.tconfig import Config
 from datetime import datetime, timedelta
+from flask import Flask
+from flask_caching import Cache
+from flask_login import LoginManager
+from flask_blogging_patron import BloggingEngine, SQLAStorage
 import pytest
+import sqlalchemy as sqla
 
 
 @pytest.fixture(scope='module')
@@ -70,3 +75,22 @@ def init_database(new_user, test_mail):
     db.session.commit()
     yield db
     db.drop_all()
+
+
+@pytest.fixture(scope='function')
+def make_blog():
+    # a bare Flask app with the blogging engine over a new SQLAStorage,
+    # for the unit tests of the blog views. Returns (app, storage, engine)
+    def _make_blog(database='sqlite://', cache_type=None, **config):
+        app = Flask(__name__)
+        app.config.update(SECRET_KEY='test', SERVER_NAME='localhost',
+                          **config)
+        LoginManager(app).user_loader(lambda user_id: None)
+        storage = SQLAStorage(sqla.create_engine(database),
+                              metadata=sqla.MetaData())
+        cache = Cache(app, config={'CACHE_TYPE': cache_type}) \
+            if cache_type else None
+        engine = BloggingEngine(app, storage, cache=cache)
+        engine.user_loader(lambda user_id: None)
+        return app, storage, engine
+    return _make_blog
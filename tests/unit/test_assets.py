@@ -0,0 +1,48 @@
+import gzip
+
+from flask import Flask, render_template_string
+from app.assets import build_assets, init_assets
+
+
+def test_static_url_resolves_fingerprinted_assets(tmp_path):
+    '''
+    GIVEN a static folder with a theme and uploaded images
+    WHEN the assets are built
+    THEN check static_url points at a hashed, precompressed copy of the
+    theme and leaves everything else alone
+    '''
+    (tmp_path / 'themes').mkdir()
+    (tmp_path / 'themes' / 'flatly.min.css').write_text('body{}')
+    (tmp_path / 'images').mkdir()
+    (tmp_path / 'images' / 'logo.svg').write_text('<svg/>')
+
+    manifest = build_assets(str(tmp_path))
+    hashed = manifest['files']['themes/flatly.min.css']
+    assert hashed.startswith('themes/flatly.min.')
+    assert list(manifest['files']) == ['themes/flatly.min.css']
+    assert gzip.decompress((tmp_path / (hashed + '.gz')).read_bytes()) == \
+        b'body{}'
+
+    app = Flask(__name__, static_folder=str(tmp_path),
+                static_url_path='/static')
+    init_assets(app)
+    with app.test_request_context():
+        assert render_template_string(
+            "{{ static_url('themes/flatly.min.css') }} "
+            "{{ static_url('images/logo.svg') }}") == \
+            '/static/%s /static/images/logo.svg' % hashed
+
+
+def test_compressed_originals_follow_their_changes(tmp_path):
+    '''
+    GIVEN built assets
+    WHEN an asset is changed in place and the assets are built again
+    THEN check the .gz served for its unhashed name holds the new content
+    '''
+    (tmp_path / 'site.css').write_text('body{}')
+    build_assets(str(tmp_path))
+    (tmp_path / 'site.css').write_text('body{color:red}')
+
+    build_assets(str(tmp_path))
+    assert gzip.decompress((tmp_path / 'site.css.gz').read_bytes()) == \
+        b'body{color:red}'
@@ -0,0 +1,68 @@
+from flask_blogging_patron.signals import editor_post_saved
+
+
+def test_saving_a_post_invalidates_only_the_views_showing_it(make_blog):
+    '''
+    GIVEN cached pages of two posts, their tags and the index
+    WHEN one post is saved with another tag
+    THEN check its page, its old and new tags and the index are rendered
+    again, and the other post's page and other tag are still served
+    cached
+    '''
+    app, storage, engine = make_blog(cache_type='simple')
+    first = storage.save_post('First', 'text', 1, ['old'])
+    # redirects are not cached, so the new tag shows a post already
+    second = storage.save_post('Second', 'text', 2, ['other', 'new'])
+    # visitors without a session, whose pages are cached for everyone
+    def get(url):
+        return app.test_client().get(url)
+    urls = ['/', '/page/%s/' % first, '/page/%s/' % second, '/tag/old/',
+            '/tag/new/', '/tag/other/', '/author/2/']
+    for url in urls:
+        get(url)
+
+    fetched = []
+    get_posts, get_post_by_id = storage.get_posts, storage.get_post_by_id
+
+    def counting(name, method):
+        def _counting(*args, **kwargs):
+            fetched.append(name)
+            return method(*args, **kwargs)
+        return _counting
+    storage.get_posts = counting('posts', get_posts)
+    storage.get_post_by_id = counting('post', get_post_by_id)
+    for url in urls:
+        get(url)
+    assert fetched == []
+
+    old = get_post_by_id(first)
+    storage.save_post('First', 'new text', 1, ['new'], post_id=first)
+    editor_post_saved.send(app, engine=engine, post_id=first, user=None,
+                           post=old)
+    rendered = []
+    for url in urls:
+        del fetched[:]
+        get(url)
+        if fetched:
+            rendered.append(url)
+    assert rendered == ['/', '/page/%s/' % first, '/tag/old/', '/tag/new/']
+
+
+def test_pages_showing_flashed_messages_are_not_cached(make_blog):
+    '''
+    GIVEN a visitor with a pending flashed message
+    WHEN the index is requested by them and then by another visitor
+    THEN check only the first sees the message, and the other gets the
+    index cached for everyone
+    '''
+    app, storage, engine = make_blog(cache_type='simple')
+    storage.save_post('First', 'text', 1, [])
+    flashed = app.test_client()
+    with flashed.session_transaction() as session:
+        session['_flashes'] = [('info', 'Successful login.')]
+
+    assert 'Successful login.' in flashed.get('/').get_data(as_text=True)
+    other = app.test_client()
+    assert 'Successful login.' not in other.get('/').get_data(as_text=True)
+    storage.get_posts = None  # served from the cache from now on
+    assert other.get('/').status_code == 200
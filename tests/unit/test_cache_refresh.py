@@ -0,0 +1,49 @@
+import threading
+import time
+
+
+def _wait_for_refreshes():
+    for thread in threading.enumerate():
+        if thread.name.startswith('refresh '):
+            thread.join()
+
+
+def test_stale_pages_are_served_while_refreshed_in_the_background(
+        tmp_path, make_blog):
+    '''
+    GIVEN a cached page of a post and a cached listing, gone stale
+    WHEN it is requested while its post can't be read, and again once
+    it can
+    THEN check the stale pages are served both times, and the pages
+    rendered by the background refresh are served after them
+    '''
+    # a file, so the refresh thread sees the same database
+    app, storage, engine = make_blog(
+        'sqlite:///%s' % tmp_path.joinpath('blog.db'), cache_type='simple',
+        BLOGGING_CACHE_TIMEOUT=1, BLOGGING_CACHE_GRACE=60)
+    post_id = storage.save_post('Old title', 'old text', 1, [])
+    client = app.test_client()
+    urls = ['/page/%s/' % post_id, '/']
+    for url in urls:
+        assert 'Old title' in client.get(url).get_data(as_text=True)
+    # changed without the signal, so only expiry brings it in
+    storage.save_post('New title', 'new text', 1, [], post_id=post_id)
+
+    # a real read failure: the table of the posts is gone for a while
+    post_table = storage.post_table.name
+    storage.engine.execute('ALTER TABLE %s RENAME TO moved' % post_table)
+    time.sleep(1.1)
+    for url in urls:
+        response = client.get(url)
+        assert response.status_code == 200
+        assert 'Old title' in response.get_data(as_text=True)
+        assert 'ETag' not in response.headers
+    _wait_for_refreshes()
+
+    storage.engine.execute('ALTER TABLE moved RENAME TO %s' % post_table)
+    time.sleep(1.1)
+    for url in urls:
+        assert 'Old title' in client.get(url).get_data(as_text=True)
+    _wait_for_refreshes()
+    for url in urls:
+        assert 'New title' in client.get(url).get_data(as_text=True)
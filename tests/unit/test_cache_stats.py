@@ -0,0 +1,32 @@
+import json
+import os
+import subprocess
+import sys
+
+from werkzeug.contrib.cache import SimpleCache
+from flask_blogging_patron.cache import CacheStats
+
+
+def test_hits_and_misses_are_added_up_over_workers(tmp_path):
+    '''
+    GIVEN a counted cache shared with another worker
+    WHEN entries are looked up
+    THEN check the hits and misses of both workers are reported, and the
+    counts of a worker that has exited are dropped
+    '''
+    # the parent process stands in for a running worker
+    (tmp_path / ('%d.json' % os.getppid())).write_text(
+        json.dumps({'hits': 3, 'misses': 1}))
+    exited = subprocess.Popen([sys.executable, '-c', ''])
+    exited.wait()
+    (tmp_path / ('%d.json' % exited.pid)).write_text(
+        json.dumps({'hits': 10, 'misses': 10}))
+    cache = CacheStats(SimpleCache(), str(tmp_path))
+    assert cache.get('page') is None
+    cache.set('page', 'html')
+    assert cache.get('page') == 'html'
+    assert cache.get('page') == 'html'
+
+    assert cache.stats() == dict(hits=5, misses=2, workers=2,
+                                 hit_ratio=5 / 7.0)
+    assert not (tmp_path / ('%d.json' % exited.pid)).exists()
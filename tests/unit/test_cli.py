@@ -0,0 +1,76 @@
+from datetime import datetime
+import json
+
+
+def test_import_reports_the_chunk_it_could_not_save(make_blog):
+    '''
+    GIVEN newline-delimited posts, one of them with tags that can't be
+    saved, and blank lines between them
+    WHEN they are imported two posts per chunk
+    THEN check the command fails, naming the posts saved before and the
+    line the failed chunk starts at
+    '''
+    app, storage, engine = make_blog()
+    posts = [dict(title='Post %d' % i, text='text', user_id='1', tags=[])
+             for i in range(5)]
+    posts[3]['tags'] = 5
+    source = '\n\n'.join(json.dumps(post) for post in posts) + '\n'
+
+    result = app.test_cli_runner().invoke(
+        args=['blogging', 'import', '--chunk-size', '2', '-'], input=source)
+    assert result.exit_code == 1
+    assert 'Imported 2 posts, then failed on the chunk starting at line ' \
+        '5.' in result.output
+    assert storage.count_posts() == 2
+
+
+def test_bulk_saved_posts_are_iterated_oldest_first(make_blog):
+    '''
+    GIVEN posts saved in bulk, out of date order and in several chunks
+    WHEN every post is iterated a few at a time
+    THEN check each post comes once, oldest first, drafts included, with
+    its tags and user
+    '''
+    app, storage, engine = make_blog()
+    posts = [dict(title='Post %d' % i, text='text %d' % i, user_id=str(i),
+                  tags=['tag %d' % (i % 2)], draft=i == 3,
+                  post_date=datetime(2019, 1, 7 - i))
+             for i in range(7)]
+    assert storage.save_posts_bulk(iter(posts), chunk_size=3) == 7
+
+    iterated = list(storage.iter_posts(chunk_size=2))
+    assert [post['title'] for post in iterated] == \
+        ['Post %d' % i for i in reversed(range(7))]
+    assert [post['draft'] for post in iterated].count(True) == 1
+    assert iterated[0]['tags'] == ['TAG 0']
+    assert iterated[0]['user_id'] == '6'
+
+
+def test_exported_posts_import_into_another_blog(make_blog):
+    '''
+    GIVEN a blog with posts, one of them a draft
+    WHEN its posts are exported and imported into an empty blog
+    THEN check the other blog has the same posts, tags, users, dates and
+    drafts
+    '''
+    app, storage, engine = make_blog()
+    storage.save_post('First', 'text', 1, ['news'],
+                      post_date=datetime(2019, 1, 1, 10, 30, 0, 5))
+    storage.save_post('Second', 'more text', 2, ['news', 'python'],
+                      draft=True, post_date=datetime(2019, 1, 2))
+    exported = app.test_cli_runner(mix_stderr=False).invoke(
+        args=['blogging', 'export', '-'])
+    assert exported.exit_code == 0
+    assert len(exported.stdout.splitlines()) == 2
+
+    other_app, other, other_engine = make_blog()
+    imported = other_app.test_cli_runner().invoke(
+        args=['blogging', 'import', '-'], input=exported.stdout)
+    assert imported.exit_code == 0
+    assert 'Imported 2 posts.' in imported.output
+
+    def summary(posts):
+        return [(p['title'], p['text'], sorted(p['tags']), p['user_id'],
+                 p['draft'], p['post_date'], p['last_modified_date'])
+                for p in posts]
+    assert summary(other.iter_posts()) == summary(storage.iter_posts())
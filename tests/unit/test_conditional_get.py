@@ -0,0 +1,55 @@
+def test_unchanged_pages_are_not_rendered_again(make_blog):
+    '''
+    GIVEN a blog page fetched once
+    WHEN it is requested again with its ETag, or with only its
+    Last-Modified
+    THEN check a 304 comes back for the ETag without fetching the posts,
+    until a post is deleted, and Last-Modified alone gets the page
+    '''
+    app, storage, engine = make_blog()
+    first = storage.save_post('First', 'text', 1, [])
+    storage.save_post('Second', 'text', 1, [])
+    client = app.test_client()
+
+    response = client.get('/page/%s/' % first)
+    assert response.status_code == 200
+    etag = response.headers['ETag']
+
+    def fail(*args, **kwargs):
+        raise AssertionError('posts fetched')
+    get_post_by_id, storage.get_post_by_id = storage.get_post_by_id, fail
+    assert client.get('/page/%s/' % first, headers={
+        'If-None-Match': etag}).status_code == 304
+    storage.get_post_by_id = get_post_by_id
+
+    response = client.get('/')
+    etag = response.headers['ETag']
+    last_modified = response.headers['Last-Modified']
+    assert client.get('/', headers={'If-None-Match': etag}).status_code == 304
+    storage.delete_post(first)
+    assert client.get('/', headers={'If-None-Match': etag}).status_code == 200
+    # the latest date is the same after the deletion
+    assert client.get('/', headers={
+        'If-Modified-Since': last_modified}).status_code == 200
+
+
+def test_a_new_site_version_changes_the_etags(make_blog):
+    '''
+    GIVEN a callable BLOGGING_ETAG_SALT returning the site version
+    WHEN the version changes, e.g. after the theme was saved
+    THEN check neither the ETag nor the Last-Modified a page was fetched
+    with get a 304
+    '''
+    version = ['1']
+    app, storage, engine = make_blog(BLOGGING_ETAG_SALT=lambda: version[0])
+    storage.save_post('First', 'text', 1, [])
+    client = app.test_client()
+
+    response = client.get('/')
+    etag = response.headers['ETag']
+    last_modified = response.headers['Last-Modified']
+    assert client.get('/', headers={'If-None-Match': etag}).status_code == 304
+    version[0] = '2'
+    assert client.get('/', headers={'If-None-Match': etag}).status_code == 200
+    assert client.get('/', headers={
+        'If-Modified-Since': last_modified}).status_code == 200
@@ -0,0 +1,39 @@
+from flask_blogging_patron.signals import editor_post_saved, post_deleted
+
+
+def test_stored_feeds_are_updated_one_entry_at_a_time(tmp_path, make_blog):
+    '''
+    GIVEN the stored feed of all posts and of a tag
+    WHEN a post with the tag is saved and then deleted
+    THEN check its entry is spliced into and dropped from both feeds
+    without querying the posts again
+    '''
+    app, storage, engine = make_blog(BLOGGING_FEED_DIR=str(tmp_path))
+    storage.save_post('First', 'text', 1, ['news'])
+    client = app.test_client()
+    response = client.get('/feeds/all.atom.xml')
+    assert response.get_data(as_text=True).count('<entry') == 1
+    assert client.get('/feeds/all.atom.xml', headers={
+        'If-None-Match': response.headers['ETag']}).status_code == 304
+    assert client.get('/feeds/tag/news.atom.xml').status_code == 200
+    assert client.get('/feeds/tag/other.atom.xml').status_code == 404
+
+    def fail(*args, **kwargs):
+        raise AssertionError('posts fetched')
+    storage.get_posts = fail
+    with app.test_request_context():
+        post_id = storage.save_post('Second', 'text', 1, ['news'])
+        editor_post_saved.send(app, engine=engine, post_id=post_id,
+                               user=None, post={})
+    for url in ('/feeds/all.atom.xml', '/feeds/tag/news.atom.xml'):
+        feed = client.get(url).get_data(as_text=True)
+        assert feed.count('<entry') == 2
+        assert feed.index('Second') < feed.index('First')
+
+    with app.test_request_context():
+        post = storage.get_post_by_id(post_id)
+        storage.delete_post(post_id)
+        post_deleted.send(app, engine=engine, post_id=str(post_id),
+                          post=post)
+    for url in ('/feeds/all.atom.xml', '/feeds/tag/news.atom.xml'):
+        assert 'Second' not in client.get(url).get_data(as_text=True)
@@ -0,0 +1,31 @@
+import json
+
+from flask import Blueprint, Flask
+from app.freeze import freeze
+
+
+def test_freeze_rewrites_only_changed_pages(tmp_path):
+    '''
+    GIVEN an app with frozen public pages
+    WHEN it is frozen again after one page changed
+    THEN check only that page is rewritten and the manifest version bumped
+    '''
+    content = {'headline': 'one'}
+    app = Flask(__name__)
+    bp = Blueprint('main', __name__)
+    bp.add_url_rule('/', 'index', lambda: content['headline'])
+    bp.add_url_rule('/terms', 'terms', lambda: 'terms')
+    app.register_blueprint(bp)
+
+    first = freeze(app, str(tmp_path))
+    assert first['version'] == 1
+    assert sorted(first['changed']) == ['/', '/terms']
+    assert freeze(app, str(tmp_path))['changed'] == []
+
+    content['headline'] = 'two'
+    second = freeze(app, str(tmp_path))
+    assert second['version'] == 2
+    assert second['changed'] == ['/']
+    assert (tmp_path / 'index.html').read_text() == 'two'
+    manifest = json.loads((tmp_path / 'manifest.json').read_text())
+    assert manifest['pages']['/terms']['file'] == 'terms/index.html'
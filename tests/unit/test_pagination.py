@@ -0,0 +1,74 @@
+from datetime import datetime
+import sqlalchemy as sqla
+from flask_blogging_patron import SQLAStorage
+from flask_blogging_patron.utils import encode_cursor, decode_cursor, \
+    CURSOR_AFTER, CURSOR_BEFORE
+
+
+def test_cursor_round_trip():
+    '''
+    GIVEN a post date and id
+    WHEN a cursor is encoded and decoded again
+    THEN check the direction and keys survive, microseconds included
+    '''
+    post_date = datetime(2019, 1, 28, 3, 5, 26, 706536)
+    cursor = encode_cursor(CURSOR_AFTER, post_date, 42)
+    assert decode_cursor(cursor) == (CURSOR_AFTER, post_date, 42)
+    cursor = encode_cursor(CURSOR_BEFORE, datetime(2019, 1, 28), 'abc')
+    assert decode_cursor(cursor) == (CURSOR_BEFORE, datetime(2019, 1, 28),
+                                     'abc')
+
+
+def test_bad_cursor():
+    '''
+    GIVEN a malformed or missing cursor
+    WHEN it is decoded
+    THEN check it is rejected instead of raising
+    '''
+    assert decode_cursor(None) is None
+    assert decode_cursor('') is None
+    assert decode_cursor('garbage') is None
+    assert decode_cursor(encode_cursor('x', datetime(2019, 1, 1), 1)) is None
+
+
+def test_cursors_walk_every_post_once_in_both_directions():
+    '''
+    GIVEN posts, most of them sharing their post date, and a draft
+    WHEN the listing is walked page by page by cursor, forward to the end
+    and back again
+    THEN check every published post is listed once, in listing order,
+    both ways
+    '''
+    storage = SQLAStorage(sqla.create_engine('sqlite://'),
+                          metadata=sqla.MetaData())
+    dates = [datetime(2019, 1, 1), datetime(2019, 1, 2)] * 4 + \
+        [datetime(2019, 1, 3)]
+    for i, post_date in enumerate(dates):
+        storage.save_post('Post %d' % i, 'text', 1, [], post_date=post_date)
+    storage.save_post('Draft', 'text', 1, [], draft=True,
+                      post_date=datetime(2019, 1, 2))
+    listed = [post['post_id'] for post in storage.get_posts(count=None)]
+    assert len(listed) == len(dates)
+
+    def page(direction, post):
+        return [p['post_id'] for p in storage.get_posts(
+            count=2, cursor=encode_cursor(direction, post['post_date'],
+                                          post['post_id']))]
+
+    forward = [p['post_id'] for p in storage.get_posts(count=2)]
+    while True:
+        last = storage.get_post_by_id(forward[-1])
+        ids = page(CURSOR_AFTER, last)
+        if not ids:
+            break
+        forward += ids
+    assert forward == listed
+
+    backward = forward[-1:]
+    while True:
+        first = storage.get_post_by_id(backward[0])
+        ids = page(CURSOR_BEFORE, first)
+        if not ids:
+            break
+        backward = ids + backward
+    assert backward == listed
@@ -0,0 +1,65 @@
+import itertools
+
+import sqlalchemy as sqla
+from flask_blogging_patron import SQLAStorage
+
+TAGS = (None, 'news', 'python', 'misc')
+USERS = (None, '1', '2')
+
+
+def _check_counts(storage):
+    # the maintained counters against the posts they count
+    for tag, user_id, include_draft in itertools.product(
+            TAGS, USERS, (False, True)):
+        posts = storage.get_posts(count=None, tag=tag, user_id=user_id,
+                                  include_draft=include_draft)
+        assert storage.count_posts(tag=tag, user_id=user_id,
+                                   include_draft=include_draft) == \
+            len(posts), (tag, user_id, include_draft)
+
+
+def _counters(storage):
+    table = storage.post_counts_table
+    return set(tuple(row) for row in storage.engine.execute(
+        sqla.select([table]).where(table.c.count != 0)))
+
+
+def test_counters_follow_every_change_and_match_a_recount():
+    '''
+    GIVEN a storage with posts by two users under a few tags
+    WHEN posts are saved, edited, made drafts, retagged, moved to another
+    user, deleted and imported in bulk
+    THEN check every counter matches the posts after each change, and a
+    recount builds the same counters
+    '''
+    storage = SQLAStorage(sqla.create_engine('sqlite://'),
+                          metadata=sqla.MetaData())
+    first = storage.save_post('First', 'text', 1, ['news', 'python'])
+    second = storage.save_post('Second', 'text', 2, ['news'])
+    storage.save_post('Draft', 'text', 1, ['misc'], draft=True)
+    _check_counts(storage)
+
+    storage.save_post('First', 'edited', 1, ['news', 'python'],
+                      post_id=first)
+    _check_counts(storage)
+    storage.save_post('First', 'edited', 1, ['python', 'misc'],
+                      post_id=first)
+    _check_counts(storage)
+    storage.save_post('Second', 'text', 2, ['news'], draft=True,
+                      post_id=second)
+    _check_counts(storage)
+    storage.save_post('Second', 'text', 1, ['news'], post_id=second)
+    _check_counts(storage)
+    storage.delete_post(first)
+    _check_counts(storage)
+    storage.save_posts_bulk([
+        dict(title='Bulk %d' % i, text='text', user_id=str(i % 2 + 1),
+             tags=['news'] if i % 3 else ['python', 'news'],
+             draft=i == 4)
+        for i in range(7)], chunk_size=3)
+    _check_counts(storage)
+    assert storage.count_posts(tag='news') == 7
+
+    maintained = _counters(storage)
+    storage.recount_posts()
+    assert _counters(storage) == maintained
@@ -0,0 +1,29 @@
+import sqlalchemy as sqla
+from flask import Flask
+from flask_blogging_patron import SQLAStorage
+
+
+def test_reads_go_to_replica_until_written():
+    '''
+    GIVEN a storage with a separate read engine
+    WHEN a post is saved and read back
+    THEN check reads use the replica, except within the writer's
+    read-your-writes window
+    '''
+    replica = sqla.create_engine('sqlite://')
+    SQLAStorage(replica, metadata=sqla.MetaData())
+    storage = SQLAStorage(sqla.create_engine('sqlite://'),
+                          metadata=sqla.MetaData(), read_engine=replica)
+    post_id = storage.save_post('Title', 'text', 1, ['tag'])
+    # the replica has not caught up
+    assert storage.get_post_by_id(post_id) is None
+    assert storage.count_posts() == 0
+
+    app = Flask(__name__)
+    app.secret_key = 'test'
+    with app.test_request_context('/'):
+        storage.read_from_primary(10)
+        assert storage.get_post_by_id(post_id)['title'] == 'Title'
+        assert storage.count_posts() == 1
+    with app.test_request_context('/'):
+        assert storage.get_post_by_id(post_id) is None
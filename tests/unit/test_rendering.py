@@ -0,0 +1,110 @@
+import json
+import os
+
+import sqlalchemy as sqla
+from flask_blogging_patron import PostProcessor, SQLAStorage
+from flask_blogging_patron.images import ImageDerivatives, lazy_images
+
+
+def test_rendering_is_stored_until_the_post_changes():
+    '''
+    GIVEN a post rendered by the PostProcessor
+    WHEN the rendering is stored and the post is saved again
+    THEN check the stored rendering is served until the text changes
+    '''
+    storage = SQLAStorage(sqla.create_engine('sqlite://'),
+                          metadata=sqla.MetaData())
+    post_id = storage.save_post('Title', 'Author: me\n\n![i](/a.png)', 1, [])
+    post = storage.get_post_by_id(post_id)
+    assert not PostProcessor.is_rendered(post)
+
+    PostProcessor.render(post)
+    assert storage.save_rendered(post_id, post['rendered_text'],
+                                 post['meta'], post['render_version'])
+    stored = storage.get_post_by_id(post_id)
+    assert PostProcessor.is_rendered(stored)
+    assert stored['rendered_text'] == post['rendered_text']
+    assert stored['meta'] == {'author': ['me'], 'images': ['/a.png']}
+
+    storage.save_post('Title', 'new text', 1, [], post_id=post_id)
+    assert not PostProcessor.is_rendered(storage.get_post_by_id(post_id))
+
+
+def test_images_are_rewritten_to_their_derivatives(tmp_path):
+    '''
+    GIVEN an upload with resized copies recorded in the manifest
+    WHEN a post embedding it and an external image is rendered
+    THEN check both load lazily and the upload is served from its copies
+    '''
+    images = ImageDerivatives(str(tmp_path), '/static/upload')
+    os.makedirs(images.folder)
+    with open(images.manifest_path, 'w') as f:
+        json.dump({'/static/upload/a.png': {'hash': 'ab', 'width': 2000,
+                   'variants': [
+                       {'width': 480, 'file': 'ab-480w.png',
+                        'webp': 'ab-480w.webp'},
+                       {'width': 960, 'file': 'ab-960w.png',
+                        'webp': 'ab-960w.webp'}]}}, f)
+    html = lazy_images('<p><img alt="a" src="https://example.com/static/'
+                       'upload/a.png" /><img src="/b.png" /></p>',
+                       images)
+
+    assert '<picture><source type="image/webp" srcset="' \
+        '/static/upload/derived/ab-480w.webp 480w, ' \
+        '/static/upload/derived/ab-960w.webp 960w"' in html
+    assert '<img loading="lazy" alt="a" ' \
+        'src="/static/upload/derived/ab-960w.png" srcset="' \
+        '/static/upload/derived/ab-480w.png 480w, ' \
+        '/static/upload/derived/ab-960w.png 960w" sizes="100vw" />' \
+        '</picture>' in html
+    assert '<img loading="lazy" src="/b.png" />' in html
+
+
+def test_listings_load_only_the_stored_excerpt():
+    '''
+    GIVEN a long post whose rendering and excerpt are stored
+    WHEN the posts are fetched with the summary fields
+    THEN check the excerpt comes back, cut at a word with its elements
+    closed, without the text or its full rendering
+    '''
+    storage = SQLAStorage(sqla.create_engine('sqlite://'),
+                          metadata=sqla.MetaData())
+    post_id = storage.save_post('Title', '*' + 'word ' * 199 + 'word*', 1, [])
+    post = storage.get_post_by_id(post_id)
+    PostProcessor.render(post)
+    storage.save_rendered(post_id, post['rendered_text'], post['meta'],
+                          post['render_version'], post['excerpt'],
+                          post['rendered_excerpt'])
+
+    summary, = storage.get_posts(fields=storage.SUMMARY_FIELDS)
+    assert 'text' not in summary and 'rendered_text' not in summary
+    assert PostProcessor.is_rendered(summary)
+    assert summary['excerpt'].endswith('word…')
+    assert len(summary['excerpt']) <= PostProcessor.excerpt_length + 1
+    assert summary['rendered_excerpt'].startswith('<p><em>word word')
+    assert summary['rendered_excerpt'].endswith('word…</em></p>')
+
+
+def test_stale_summaries_are_loaded_in_one_batch(make_blog):
+    '''
+    GIVEN posts without a stored rendering, e.g. after a renderer upgrade
+    WHEN the index lists them
+    THEN check their whole posts are fetched with one query, not one
+    query per post
+    '''
+    app, storage, engine = make_blog()
+    for title in ('One', 'Two', 'Three'):
+        storage.save_post(title, 'text', 1, [])
+    batches = []
+
+    def get_posts_by_ids(post_ids, get_posts_by_ids=storage.get_posts_by_ids):
+        batches.append(sorted(post_ids))
+        return get_posts_by_ids(post_ids)
+
+    def fail(*args, **kwargs):
+        raise AssertionError('post fetched on its own')
+    storage.get_posts_by_ids = get_posts_by_ids
+    storage.get_post_by_id = fail
+
+    assert app.test_client().get('/').status_code == 200
+    assert batches == [[1, 2, 3]]
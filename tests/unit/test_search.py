@@ -0,0 +1,25 @@
+import sqlalchemy as sqla
+from flask_blogging_patron import SQLAStorage
+
+
+def test_search_posts():
+    '''
+    GIVEN a SQLite backed storage with a few posts
+    WHEN posts are searched, edited and deleted
+    THEN check results come from the index, ranked, and stay in sync
+    '''
+    storage = SQLAStorage(sqla.create_engine('sqlite://'),
+                          metadata=sqla.MetaData())
+    storage.save_post('Tomatoes', 'growing tomatoes', 1, [])
+    other = storage.save_post('Basil', 'with tomatoes', 1, [])
+    storage.save_post('Draft', 'tomatoes', 1, [], draft=True)
+
+    titles = [p['title'] for p in storage.search_posts('tomatoes')]
+    assert titles == ['Tomatoes', 'Basil']
+    assert storage.count_search_results('tomatoes') == 2
+    assert storage.search_posts('"NEAR( OR *') == []
+
+    storage.save_post('Basil', 'no longer', 1, [], post_id=other)
+    assert storage.count_search_results('tomatoes') == 1
+    storage.delete_post(other)
+    assert storage.count_search_results('basil') == 0
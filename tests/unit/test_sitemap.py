@@ -0,0 +1,29 @@
+import gzip
+
+
+def test_large_sitemaps_are_split_into_shards_by_post_id(make_blog):
+    '''
+    GIVEN more published posts than fit in one sitemap
+    WHEN the sitemap is requested
+    THEN check it is an index of gzipped shards, each listing the
+    published posts of its range of ids
+    '''
+    app, storage, engine = make_blog(
+        BLOGGING_SITEURL='https://example.com',
+        BLOGGING_SITEMAP_SHARD_SIZE=2)
+    for title in ('One', 'Two', 'Three'):
+        storage.save_post(title, 'text', 1, [])
+    storage.save_post('Draft', 'text', 1, [], draft=True)
+    client = app.test_client()
+
+    index = client.get('/sitemap.xml').get_data(as_text=True)
+    assert '<sitemapindex' in index
+    assert 'https://example.com/sitemap-1.xml.gz' in index
+    assert 'https://example.com/sitemap-2.xml.gz' in index
+
+    shard = client.get('/sitemap-2.xml.gz')
+    assert shard.headers['Content-Type'] == 'application/x-gzip'
+    urls = gzip.decompress(shard.data).decode('utf-8')
+    assert '/page/3/three/' in urls
+    assert 'draft' not in urls
+    assert client.get('/sitemap-3.xml.gz').status_code == 404
@@ -0,0 +1,23 @@
+def test_posts_are_found_and_linked_by_their_stored_slug(make_blog):
+    '''
+    GIVEN posts saved with the slug URLs enabled, two of them with the
+    same title
+    WHEN their slug is requested as the page of a post
+    THEN check the first published post with the slug is shown, and the
+    listings link to the slug that was stored
+    '''
+    app, storage, engine = make_blog(BLOGGING_SLUG_URLS=True)
+    storage.save_post('Hello World', 'draft text', 1, [], draft=True)
+    first = storage.save_post('Hello World', 'first text', 1, [])
+    storage.save_post('Hello World', 'second text', 1, [])
+    storage.save_post('Renamed', 'text', 1, [], slug='kept-slug')
+
+    assert storage.get_post_by_slug('hello-world')['post_id'] == first
+    assert storage.get_post_by_slug('missing') is None
+    client = app.test_client()
+    page = client.get('/page/hello-world/').get_data(as_text=True)
+    assert 'first text' in page
+    assert client.get('/page/%s/' % first).status_code == 200
+    assert client.get('/page/missing/').status_code == 302
+    index = client.get('/').get_data(as_text=True)
+    assert '/page/4/kept-slug/' in index
@@ -0,0 +1,25 @@
+import sqlalchemy as sqla
+from flask_blogging_patron import SQLAStorage
+
+
+def test_existing_tables_are_left_to_the_migrations(tmp_path):
+    '''
+    GIVEN a database whose post table predates the newer post columns
+    WHEN a storage is built on it
+    THEN check the missing tables are created, but the post table is
+    not altered and the counters are not filled in
+    '''
+    engine = sqla.create_engine('sqlite:///%s' % tmp_path.joinpath('b.db'))
+    engine.execute('CREATE TABLE post (id INTEGER PRIMARY KEY, '
+                   'title VARCHAR(256), text TEXT, post_date DATETIME, '
+                   'last_modified_date DATETIME, draft SMALLINTEGER)')
+    engine.execute("INSERT INTO post (title, draft) VALUES ('Old', 0)")
+
+    storage = SQLAStorage(engine, metadata=sqla.MetaData())
+
+    inspector = sqla.inspect(engine)
+    columns = [column['name'] for column in inspector.get_columns('post')]
+    assert 'slug' not in columns
+    assert 'post_counts' in inspector.get_table_names()
+    assert engine.execute('SELECT count(*) FROM post_counts').scalar() == 0
+    assert 'slug' in storage.post_table.c
@@ -0,0 +1,55 @@
+import sqlalchemy as sqla
+from flask_blogging_patron import SQLAStorage
+
+
+def _tag_rows(storage):
+    return sorted(storage.engine.execute(
+        sqla.select([storage.tag_table.c.text])).fetchall())
+
+
+def test_tags_are_stored_once_and_their_ids_remembered():
+    '''
+    GIVEN posts saved with overlapping tags, spelled differently
+    WHEN more posts are saved and retagged with those tags
+    THEN check each tag is stored once, the posts list their tags, and
+    the ids of settled tags are no longer looked up
+    '''
+    engine = sqla.create_engine('sqlite://')
+    storage = SQLAStorage(engine, metadata=sqla.MetaData())
+    first = storage.save_post('First', 'text', 1, ['news', ' News', 'tips'])
+    second = storage.save_post('Second', 'text', 1, ['NEWS', 'tips'])
+    assert _tag_rows(storage) == [('NEWS',), ('TIPS',)]
+    assert sorted(storage.get_post_by_id(first)['tags']) == ['NEWS', 'TIPS']
+
+    lookups = []
+
+    def count_lookups(conn, cursor, statement, *args):
+        if statement.startswith('SELECT tag.text, tag.id'):
+            lookups.append(statement)
+    sqla.event.listen(engine, 'before_cursor_execute', count_lookups)
+    storage.save_post('Second', 'text', 1, ['news'], post_id=second)
+    storage.save_post('Third', 'text', 1, ['tips', 'news'])
+    assert lookups == []
+    storage.save_post('Fourth', 'text', 1, ['news', 'new tag'])
+    assert len(lookups) == 2  # the unknown tag, then its new id
+    assert _tag_rows(storage) == [('NEW TAG',), ('NEWS',), ('TIPS',)]
+    assert storage.get_post_by_id(second)['tags'] == ['NEWS']
+
+
+def test_tag_ids_of_a_rolled_back_insert_are_not_remembered():
+    '''
+    GIVEN a tag inserted in a transaction that was rolled back
+    WHEN a post is saved with that tag
+    THEN check the tag is inserted again and linked to the post
+    '''
+    storage = SQLAStorage(sqla.create_engine('sqlite://'),
+                          metadata=sqla.MetaData())
+    with storage.engine.connect() as conn:
+        transaction = conn.begin()
+        storage._resolve_tag_ids(['LOST'], conn)
+        transaction.rollback()
+    assert _tag_rows(storage) == []
+
+    post_id = storage.save_post('Post', 'text', 1, ['lost'])
+    assert storage.get_post_by_id(post_id)['tags'] == ['LOST']
+    assert _tag_rows(storage) == [('LOST',)]